@@ -3,26 +3,31 @@ Flask REST API Backend for Multimodal RAG System
 Provides endpoints for search, generation, and history management
 """
 
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_file, send_from_directory, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import sys
 from pathlib import Path
 import os
+import math
+import tempfile
 import time
 from PIL import Image
 import io
 import base64
+import json
+from functools import wraps
 
 # Add parent directory to path
 sys.path.append(str(Path(__file__).parent.parent))
 
-from src.retrieval.retriever import Retriever
-from src.models.context_builder import ContextBuilder
-from src.models.text_generator import TextGenerator
-from src.models.image_generator import ImageGenerator
 from src.utils.metrics_calculator import MetricsCalculator
-from src.utils.history_manager import HistoryManager
+from src.utils.component_registry import ComponentRegistry, ComponentUnavailable
+from src.utils.rate_limiter import get_all_statistics as get_rate_limit_statistics
+from src.utils.admission_control import AdmissionController, Overloaded
+from src.utils.deadline import Deadline, DeadlineExceeded
+from src.utils.tracing import TraceFileExporter, current_trace, end_trace, span, start_trace
+from src.utils.telemetry import CONTENT_TYPE as METRICS_CONTENT_TYPE, registry as metrics
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for frontend
@@ -33,25 +38,588 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
 
-# Initialize components
-print("Initializing components...")
-retriever = Retriever()
-context_builder = ContextBuilder()
-text_gen = TextGenerator()
-try:
-    image_gen = ImageGenerator(use_local=False)
-except Exception as e:
-    print(f"Image generator not available: {e}")
-    image_gen = None
+
+# ============= COMPONENTS =============
+# Heavy modules (torch, transformers, diffusers, LLM SDKs) are imported inside
+# the factories, so they load on first use rather than at import time.
+
+def create_retriever():
+    from src.retrieval.retriever import Retriever
+    if os.getenv("ENCODER_ADDRESS"):
+        # Encode through the shared encoder service instead of loading CLIP in this worker
+        from src.models.encoder_service import RemoteCLIPEncoder
+        return Retriever(encoder=RemoteCLIPEncoder(os.getenv("ENCODER_ADDRESS")))
+    return Retriever()
+
+
+def create_context_builder():
+    from src.models.context_builder import ContextBuilder
+    return ContextBuilder(encoder=components.get('retriever').encoder)
+
+
+def create_text_generator():
+    if os.getenv("LLM_PROVIDERS"):
+        # Multi-provider mode: hedge slow requests across providers
+        from src.models.hedged_generator import HedgedTextGenerator
+        hedge_delay = os.getenv("LLM_HEDGE_DELAY", "1.0")
+        return HedgedTextGenerator.from_providers(
+            [p.strip() for p in os.getenv("LLM_PROVIDERS").split(',') if p.strip()],
+            hedge_delay=None if hedge_delay == "auto" else float(hedge_delay)
+        )
+    
+    from src.models.text_generator import TextGenerator
+    return TextGenerator()
+
+
+def create_image_generator():
+    try:
+        from src.models.image_generator import ImageGenerator
+        return ImageGenerator(use_local=False)
+    except Exception as e:
+        print(f"Image generator not available: {e}")
+        return None
+
+
+def create_history_manager():
+    from src.utils.history_manager import HistoryManager
+    return HistoryManager()
+
+
+def create_result_store():
+    from src.utils.result_store import ResultStore
+    return ResultStore(ttl_seconds=float(os.getenv("RESULT_HANDLE_TTL", 900)))
+
+
+def create_pipeline():
+    from src.models.rag_pipeline import RAGPipeline
+    
+    # Generators are optional for the pipeline; a failed one just skips its stage
+    def optional(name):
+        try:
+            return components.get(name)
+        except ComponentUnavailable:
+            return None
+    
+    return RAGPipeline(
+        components.get('retriever'),
+        components.get('context_builder'),
+        optional('text_generator'),
+        optional('image_generator')
+    )
+
+
+components = ComponentRegistry(
+    retry_seconds=float(os.getenv("COMPONENT_RETRY_SECONDS", "30")),
+    max_retry_seconds=float(os.getenv("COMPONENT_MAX_RETRY_SECONDS", "600"))
+)
+components.register('retriever', create_retriever)
+components.register('context_builder', create_context_builder)
+components.register('text_generator', create_text_generator)
+components.register('image_generator', create_image_generator)
+components.register('history_manager', create_history_manager)
+components.register('result_store', create_result_store)
+components.register('pipeline', create_pipeline)
 
 calc = MetricsCalculator()
-history_manager = HistoryManager()
-print("Components initialized!")
+
+# Components that must be loaded before /api/health/ready reports ready
+READY_COMPONENTS = [n.strip() for n in os.getenv("READY_COMPONENTS", "retriever").split(',') if n.strip()]
+
+# Optional warm-up at startup, e.g. WARMUP_COMPONENTS=retriever,text_generator
+WARMUP_COMPONENTS = [n.strip() for n in os.getenv("WARMUP_COMPONENTS", "").split(',') if n.strip()]
+if WARMUP_COMPONENTS:
+    components.warm_up(WARMUP_COMPONENTS, background=os.getenv("WARMUP_BACKGROUND", "1") == "1")
+
+
+# ============= TRACING =============
+# Every API request is traced; spans come back as a Server-Timing header, in the
+# JSON body with ?trace=1 (or X-Trace: 1), and in TRACE_FILE if set
+trace_exporter = TraceFileExporter(os.getenv("TRACE_FILE")) if os.getenv("TRACE_FILE") else None
+
+
+def trace_requested() -> bool:
+    return request.args.get('trace') == '1' or request.headers.get('X-Trace') == '1'
+
+
+def finish_trace(trace):
+    if trace is not None and trace_exporter is not None:
+        trace_exporter.export(trace)
+
+
+def add_stream_trace(payload: dict) -> dict:
+    """Attach the request trace to a stream's final event if it was requested"""
+    trace = current_trace()
+    if trace is not None and trace_requested():
+        payload['trace'] = trace.to_dict()
+    return payload
+
+
+@app.before_request
+def begin_request_trace():
+    if request.path.startswith('/api/'):
+        start_trace(f"{request.method} {request.path}")
+
+
+@app.after_request
+def add_trace_to_response(response):
+    trace = current_trace()
+    if trace is None:
+        return response
+    
+    if response.is_streamed:
+        # The stream runs after this hook, so keep tracing until the response is closed
+        response.call_on_close(lambda: finish_trace(end_trace()))
+        return response
+    
+    if trace_requested() and response.is_json:
+        data = response.get_json()
+        if isinstance(data, dict):
+            data['trace'] = trace.to_dict()
+            response.set_data(json.dumps(data))
+    response.headers['Server-Timing'] = trace.server_timing()
+    finish_trace(end_trace())
+    return response
+
+
+# ============= METRICS =============
+# Prometheus-style metrics at /metrics; labelled by route rule (not raw path) to
+# keep label cardinality bounded
+HTTP_REQUESTS = metrics.counter('http_requests_total', 'API requests by route, method and status', ['endpoint', 'method', 'status'])
+HTTP_SECONDS = metrics.histogram('http_request_seconds', 'API request latency (streams: until closed)', ['endpoint'])
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    if not request.path.startswith('/api/') or 'request_start' not in g:
+        return response
+    
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUESTS.labels(endpoint=endpoint, method=request.method, status=response.status_code).inc()
+    latency = HTTP_SECONDS.labels(endpoint=endpoint)
+    start = g.request_start
+    if response.is_streamed:
+        response.call_on_close(lambda: latency.observe(time.perf_counter() - start))
+    else:
+        latency.observe(time.perf_counter() - start)
+    return response
+
+
+def pil_to_jpeg(img: Image.Image) -> bytes:
+    """Encode a PIL image as JPEG bytes"""
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    buffered = io.BytesIO()
+    img.save(buffered, format="JPEG")
+    return buffered.getvalue()
+
+
+def jpeg_to_base64(jpeg: bytes) -> str:
+    return f"data:image/jpeg;base64,{base64.b64encode(jpeg).decode()}"
+
+
+def pil_to_base64(img: Image.Image) -> str:
+    """Encode a PIL image as a JPEG data URL"""
+    return jpeg_to_base64(pil_to_jpeg(img))
+
+
+def image_file_to_base64(path: str):
+    """JPEG data URL for an image file, or None if it can't be read"""
+    with span('image.base64'):
+        try:
+            with Image.open(path) as img:
+                return pil_to_base64(img)
+        except Exception as e:
+            print(f"Error encoding image: {e}")
+            return None
+
+
+def encode_result_images(results):
+    """Add an 'image_base64' data URL to each search result"""
+    for result in results:
+        result['image_base64'] = image_file_to_base64(result['image_path'])
+
+
+# ============= RESULT HANDLES =============
+# Search responses carry a 'result_handle'; generation requests that pass it add their
+# output, and /api/history/save can then persist everything by handle
+
+# History query_mode labels, as used by the web and Streamlit UIs
+HISTORY_MODE_LABELS = {
+    'text': 'Text Only',
+    'image': 'Image Only',
+    'multimodal': 'Text + Image (Multimodal)'
+}
+
+
+def store_search_result(
+    query_type, results, metrics, query_text=None, text_weight=None, top_k=5, query_image=None, history_match=None
+):
+    """
+    Keep a server-side copy of a search result for saving to history later
+    
+    Returns:
+        Result handle, or None if the store is unavailable (saving then needs the full payload)
+    """
+    payload = {
+        'query_type': query_type,
+        'query_text': query_text,
+        'text_weight': text_weight,
+        'top_k': top_k,
+        'results': [{k: v for k, v in r.items() if k != 'image_base64'} for r in results],
+        'metrics': metrics,
+        'index_version': current_index_version()
+    }
+    if history_match is not None:
+        # Generation outputs the generate endpoints can reuse for this handle
+        payload['history'] = {
+            'query_id': history_match['id'],
+            'generated_text': history_match['generated_text'],
+            'generated_image_path': history_match['generated_image_path']
+        }
+    try:
+        with span('result_store.create'):
+            return components.get('result_store').create(payload, query_image=query_image)
+    except Exception as e:
+        print(f"Result handle not stored: {e}")
+        return None
+
+
+def update_search_result(handle, payload=None, generated_image=None):
+    """Add generation output to a stored result; ignored if there is no (live) handle"""
+    if not handle:
+        return
+    try:
+        with span('result_store.update'):
+            components.get('result_store').update(handle, payload, generated_image=generated_image)
+    except Exception as e:
+        print(f"Result handle not updated: {e}")
+
+
+def save_upload(image_file) -> str:
+    """
+    Save an uploaded file under a unique name in UPLOAD_FOLDER, so concurrent
+    uploads with the same filename never overwrite or delete each other
+    
+    Returns:
+        Path of the saved file (remove it with remove_upload)
+    """
+    suffix = Path(secure_filename(image_file.filename or '')).suffix
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=app.config['UPLOAD_FOLDER'])
+    with os.fdopen(fd, 'wb') as f:
+        image_file.save(f)
+    return path
+
+
+def remove_upload(path):
+    """Delete a saved upload; safe to call more than once"""
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def read_file_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def compute_retrieval_metrics(results):
+    """Retrieval metrics, with the embedding-space ones when the results' stored vectors are available"""
+    embeddings = None
+    image_ids = [r.get('image_id') for r in results['results']]
+    if image_ids and None not in image_ids:
+        try:
+            embeddings = components.get('retriever').get_embeddings(image_ids)
+        except Exception as e:
+            print(f"Result embeddings unavailable: {e}")
+    return calc.calculate_retrieval_metrics(results, embeddings=embeddings)
+
+
+def current_index_version():
+    """Index version of the loaded retriever (None while it isn't loaded)"""
+    if components.status().get('retriever', {}).get('state') != 'ready':
+        return None
+    return getattr(components.get('retriever'), 'index_version', None)
+
+
+# ============= HISTORY REUSE =============
+# Optional stage in front of retrieval and generation (HISTORY_REUSE=1): a query that repeats
+# an earlier one in history (same mode, top_k, weight and index version) is answered from its
+# stored results and generation outputs. Send "reuse_history": false to force a fresh run
+HISTORY_REUSE = os.getenv("HISTORY_REUSE", "false").lower() in ("1", "true", "yes")
+HISTORY_REUSE_NEAR_EXACT = os.getenv("HISTORY_REUSE_NEAR_EXACT", "true").lower() in ("1", "true", "yes")
+HISTORY_REUSE_MAX_AGE_DAYS = float(os.getenv("HISTORY_REUSE_MAX_AGE_DAYS")) if os.getenv("HISTORY_REUSE_MAX_AGE_DAYS") else None
+
+REUSE_LOOKUPS = metrics.counter('history_reuse_lookups_total', 'Repeat-query lookups in history', ['mode', 'outcome'])
+REUSE_STAGES = metrics.counter('history_reuse_stages_total', 'Retrieval/generation stages served from history', ['stage'])
+REUSE_RUNS_SAVED = metrics.counter('history_reuse_runs_saved_total', 'Requests answered entirely from history', ['endpoint'])
+
+
+def history_reuse_requested() -> bool:
+    if not HISTORY_REUSE:
+        return False
+    data = request.get_json(silent=True) or request.form
+    return str(data.get('reuse_history', 'true')).lower() not in ('0', 'false', 'no')
+
+
+def find_history_match(query_type, query_text=None, query_image=None, text_weight=None, top_k=5):
+    """
+    Earlier history query that this one repeats
+    
+    Args:
+        query_type: 'text', 'image' or 'multimodal'
+        query_text: Text query
+        query_image: Encoded query image bytes
+        text_weight: Multimodal text weight
+        top_k: Number of results
+        
+    Returns:
+        Stored query with 'retrieval_results' and 'match', or None (also when reuse is off
+        or the lookup fails)
+    """
+    if not history_reuse_requested():
+        return None
+    try:
+        with span('history.reuse_lookup'):
+            match = components.get('history_manager').find_reusable(
+                HISTORY_MODE_LABELS[query_type],
+                top_k,
+                getattr(components.get('retriever'), 'index_version', None),
+                query_text=query_text if query_type != 'image' else None,
+                query_image=Image.open(io.BytesIO(query_image)) if query_image else None,
+                text_weight=text_weight if query_type == 'multimodal' else None,
+                max_age_days=HISTORY_REUSE_MAX_AGE_DAYS,
+                allow_near_exact=HISTORY_REUSE_NEAR_EXACT
+            )
+    except Exception as e:
+        print(f"History lookup failed: {e}")
+        return None
+    REUSE_LOOKUPS.labels(query_type, match['match'] if match else 'miss').inc()
+    return match
+
+
+def search_or_reuse(query_type, search, query_text=None, query_image=None, text_weight=None, top_k=5):
+    """
+    Results of an earlier identical query from history, or of running search()
+    
+    Returns:
+        (results dictionary, history match or None)
+    """
+    match = find_history_match(query_type, query_text, query_image, text_weight, top_k)
+    if match is None:
+        return search(), None
+    REUSE_STAGES.labels('retrieval').inc()
+    REUSE_RUNS_SAVED.labels(f"search_{query_type}").inc()
+    return {'results': match['retrieval_results']}, match
+
+
+def history_match_summary(match):
+    """What a response reports about a history match (None without one)"""
+    if match is None:
+        return None
+    return {
+        'query_id': match['id'],
+        'match': match['match'],
+        'timestamp': match['timestamp'],
+        'has_generated_text': bool(match['generated_text']),
+        'has_generated_image': bool(match['generated_image_path'])
+    }
+
+
+def reusable_generation(handle):
+    """Stored generation outputs of the history query a result handle was answered from"""
+    if not handle or not history_reuse_requested():
+        return None
+    try:
+        stored = components.get('result_store').get(handle)
+    except Exception as e:
+        print(f"Result handle lookup failed: {e}")
+        return None
+    return stored['payload'].get('history') if stored else None
+
+
+def caption_scores(data, captions):
+    """
+    Per-caption relevance and result index for a generation request
+    
+    Taken from the request's 'relevance' and 'groups' lists, else from the stored search
+    results of its 'result_handle'; failing both, captions are ranked by position
+    
+    Returns:
+        (relevance, groups), groups None if the captions' results are unknown
+    """
+    relevance, groups = data.get('relevance'), data.get('groups')
+    if isinstance(relevance, list) and len(relevance) == len(captions):
+        if not (isinstance(groups, list) and len(groups) == len(captions)):
+            groups = None
+        return [float(r) for r in relevance], groups
+    
+    handle = data.get('result_handle')
+    if handle:
+        try:
+            stored = components.get('result_store').get(handle)
+        except Exception as e:
+            print(f"Result handle lookup failed: {e}")
+            stored = None
+        if stored:
+            relevance, groups, stored_captions = [], [], []
+            for i, result in enumerate(stored['payload']['results']):
+                stored_captions.extend(result['captions'])
+                relevance.extend([result['similarity_score']] * len(result['captions']))
+                groups.extend([i] * len(result['captions']))
+            if stored_captions == list(captions):
+                return relevance, groups
+    
+    return [1.0 - i / len(captions) for i in range(len(captions))], None
+
+
+def load_history_image(path: str):
+    """JPEG bytes of a stored history image, or None if it's gone"""
+    try:
+        with Image.open(path) as img:
+            return pil_to_jpeg(img)
+    except Exception as e:
+        print(f"History image unavailable: {e}")
+        return None
+
+
+# ============= DEADLINES =============
+# Optional default budget for every request, e.g. REQUEST_DEADLINE_MS=5000
+DEFAULT_DEADLINE_MS = os.getenv("REQUEST_DEADLINE_MS")
+
+
+def request_deadline() -> Deadline:
+    """
+    Deadline for the current request, from the 'deadline_ms' field or the
+    X-Deadline-Ms header (default: REQUEST_DEADLINE_MS). Created once per request,
+    so time spent in the admission queue counts against it.
+    """
+    if 'deadline' not in g:
+        body = request.get_json(silent=True)
+        data = body if isinstance(body, dict) else request.form
+        # An explicit 0 means "no deadline", so only missing values fall through
+        value = data.get('deadline_ms')
+        if value in (None, ''):
+            value = request.headers.get('X-Deadline-Ms')
+        if value in (None, ''):
+            value = DEFAULT_DEADLINE_MS
+        try:
+            milliseconds = None if value in (None, '') else float(value)
+            if milliseconds is not None and not (math.isfinite(milliseconds) and milliseconds >= 0):
+                raise ValueError
+        except (TypeError, ValueError):
+            raise ValueError(f"deadline_ms must be a non-negative number of milliseconds, got {value!r}") from None
+        g.deadline = Deadline.from_ms(milliseconds)
+    return g.deadline
+
+
+@app.before_request
+def validate_request_deadline():
+    """Reject a malformed deadline_ms / X-Deadline-Ms with a JSON 400 before any view runs"""
+    if not request.path.startswith('/api/'):
+        return None
+    try:
+        request_deadline()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return None
+
+
+def deadline_exceeded_response(e: DeadlineExceeded):
+    return jsonify({
+        'success': False,
+        'error': str(e),
+        'deadline_exceeded': True,
+        'stage': e.stage
+    }), 504
+
+
+# ============= ADMISSION CONTROL =============
+# Per-process limits: (max concurrent, max queued, queue timeout in seconds, priority).
+# Override one class with e.g. ADMISSION_GENERATE_IMAGE=2,4,60
+ADMISSION_DEFAULTS = {
+    'search_text': (16, 64, 5.0, 'high'),
+    'search_image': (4, 16, 10.0, 'normal'),
+    'search_multimodal': (4, 16, 10.0, 'normal'),
+    'generate_text': (8, 32, 30.0, 'normal'),
+    'generate_image': (1, 4, 60.0, 'low'),
+    'pipeline': (2, 4, 30.0, 'low')
+}
+
+admission = AdmissionController(max_total=int(os.getenv("ADMISSION_MAX_TOTAL", "16")))
+for _name, (_concurrent, _queue, _timeout, _priority) in ADMISSION_DEFAULTS.items():
+    _override = os.getenv(f"ADMISSION_{_name.upper()}")
+    if _override:
+        _concurrent, _queue, _timeout = [float(v) for v in _override.split(',')]
+    admission.register(_name, int(_concurrent), int(_queue), float(_timeout), _priority)
+
+
+ADMISSION_IN_FLIGHT = metrics.gauge('admission_in_flight', 'Requests running per admission class', ['class'])
+ADMISSION_QUEUED = metrics.gauge('admission_queued', 'Requests waiting per admission class', ['class'])
+ADMISSION_SHED = metrics.counter('admission_shed_total', 'Requests shed per admission class', ['class', 'status'])
+RATE_LIMITER_QUEUED = metrics.gauge('llm_rate_limiter_queued', 'Calls waiting for LLM quota', ['limiter'])
+RATE_LIMITER_IN_FLIGHT = metrics.gauge('llm_rate_limiter_in_flight', 'LLM calls holding a concurrency slot', ['limiter'])
+COMPONENT_READY = metrics.gauge('component_ready', 'Whether a backend component is loaded', ['component'])
+
+
+def collect_gauges():
+    """Refresh gauges from state owned by the admission controller, rate limiters and registry"""
+    for name, stats in admission.get_statistics()['classes'].items():
+        ADMISSION_IN_FLIGHT.labels(name).set(stats['in_flight'])
+        ADMISSION_QUEUED.labels(name).set(stats['queued'])
+    for name, stats in get_rate_limit_statistics().items():
+        RATE_LIMITER_QUEUED.labels(name).set(stats['queued'])
+        RATE_LIMITER_IN_FLIGHT.labels(name).set(stats['in_flight'])
+    for name, info in components.status().items():
+        COMPONENT_READY.labels(name).set(1 if info['state'] == 'ready' else 0)
+
+
+metrics.register_collector(collect_gauges)
+
+
+def admission_controlled(name: str):
+    """
+    Admit a view through the named class; shed with 429/503 plus Retry-After when saturated.
+    Streaming responses keep their slot until the stream is closed.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            deadline = request_deadline()
+            try:
+                slot = admission.acquire(name, timeout=deadline.timeout(None))
+            except Overloaded as e:
+                ADMISSION_SHED.labels(name, e.status).inc()
+                response = jsonify({'success': False, 'error': str(e), 'retry_after': e.retry_after})
+                response.headers['Retry-After'] = str(e.retry_after)
+                return response, e.status
+            
+            try:
+                response = app.make_response(view(*args, **kwargs))
+            except Exception:
+                slot.release()
+                raise
+            
+            if response.is_streamed:
+                response.call_on_close(slot.release)
+            else:
+                slot.release()
+            return response
+        return wrapped
+    return decorator
 
 
 # ============= SEARCH ENDPOINTS =============
 
 @app.route('/api/search/text', methods=['POST'])
+@admission_controlled('search_text')
 def search_text():
     """Search by text query"""
     try:
@@ -59,34 +627,39 @@ def search_text():
         query = data['query']
         top_k = data.get('top_k', 5)
         
-        # Perform search
+        # Perform search (or reuse a repeat query's results from history)
         start_time = time.time()
-        results = retriever.search_by_text(query, k=top_k)
+        results, match = search_or_reuse(
+            'text',
+            lambda: components.get('retriever').search_by_text(query, k=top_k, deadline=request_deadline()),
+            query_text=query,
+            top_k=top_k
+        )
         retrieval_time = time.time() - start_time
         
         # Calculate metrics
-        metrics = calc.calculate_retrieval_metrics(results)
+        metrics = compute_retrieval_metrics(results)
         metrics['retrieval_time'] = retrieval_time
         
-        # Convert image paths to base64 for web display
-        for result in results['results']:
-            try:
-                with Image.open(result['image_path']) as img:
-                    buffered = io.BytesIO()
-                    img.save(buffered, format="JPEG")
-                    img_str = base64.b64encode(buffered.getvalue()).decode()
-                    result['image_base64'] = f"data:image/jpeg;base64,{img_str}"
-            except Exception as e:
-                result['image_base64'] = None
-                print(f"Error encoding image: {e}")
+        result_handle = store_search_result(
+            'text', results['results'], metrics, query_text=query, top_k=top_k, history_match=match
+        )
+        
+        # Convert images to base64 for web display
+        encode_result_images(results['results'])
         
         return jsonify({
             'success': True,
             'query_type': 'text',
             'results': results['results'],
-            'metrics': metrics
+            'metrics': metrics,
+            'result_handle': result_handle,
+            'history_match': history_match_summary(match)
         })
     
+    except DeadlineExceeded as e:
+        return deadline_exceeded_response(e)
+    
     except Exception as e:
         return jsonify({
             'success': False,
@@ -95,6 +668,7 @@ def search_text():
 
 
 @app.route('/api/search/image', methods=['POST'])
+@admission_controlled('search_image')
 def search_image():
     """Search by image"""
     try:
@@ -105,40 +679,46 @@ def search_image():
         top_k = int(request.form.get('top_k', 5))
         
         # Save uploaded image temporarily
-        filename = secure_filename(image_file.filename)
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        image_file.save(temp_path)
+        temp_path = save_upload(image_file)
         
         # Perform search
         start_time = time.time()
-        results = retriever.search_by_image(temp_path, k=top_k)
+        try:
+            query_image = read_file_bytes(temp_path)
+            results, match = search_or_reuse(
+                'image',
+                lambda: components.get('retriever').search_by_image(temp_path, k=top_k, deadline=request_deadline()),
+                query_image=query_image,
+                top_k=top_k
+            )
+        finally:
+            # Clean up
+            remove_upload(temp_path)
         retrieval_time = time.time() - start_time
         
         # Calculate metrics
-        metrics = calc.calculate_retrieval_metrics(results)
+        metrics = compute_retrieval_metrics(results)
         metrics['retrieval_time'] = retrieval_time
         
-        # Convert images to base64
-        for result in results['results']:
-            try:
-                with Image.open(result['image_path']) as img:
-                    buffered = io.BytesIO()
-                    img.save(buffered, format="JPEG")
-                    img_str = base64.b64encode(buffered.getvalue()).decode()
-                    result['image_base64'] = f"data:image/jpeg;base64,{img_str}"
-            except Exception as e:
-                result['image_base64'] = None
+        result_handle = store_search_result(
+            'image', results['results'], metrics, top_k=top_k, query_image=query_image, history_match=match
+        )
         
-        # Clean up
-        os.remove(temp_path)
+        # Convert images to base64 for web display
+        encode_result_images(results['results'])
         
         return jsonify({
             'success': True,
             'query_type': 'image',
             'results': results['results'],
-            'metrics': metrics
+            'metrics': metrics,
+            'result_handle': result_handle,
+            'history_match': history_match_summary(match)
         })
     
+    except DeadlineExceeded as e:
+        return deadline_exceeded_response(e)
+    
     except Exception as e:
         return jsonify({
             'success': False,
@@ -147,6 +727,7 @@ def search_image():
 
 
 @app.route('/api/search/multimodal', methods=['POST'])
+@admission_controlled('search_multimodal')
 def search_multimodal():
     """Search by text + image (multimodal)"""
     try:
@@ -159,45 +740,59 @@ def search_multimodal():
         top_k = int(request.form.get('top_k', 5))
         
         # Save uploaded image temporarily
-        filename = secure_filename(image_file.filename)
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        image_file.save(temp_path)
+        temp_path = save_upload(image_file)
         
         # Perform search
         start_time = time.time()
-        results = retriever.search_by_multimodal(
-            query_text=query_text,
-            query_image=temp_path,
-            text_weight=text_weight,
-            k=top_k
-        )
+        try:
+            query_image = read_file_bytes(temp_path)
+            results, match = search_or_reuse(
+                'multimodal',
+                lambda: components.get('retriever').search_by_multimodal(
+                    query_text=query_text,
+                    query_image=temp_path,
+                    text_weight=text_weight,
+                    k=top_k,
+                    deadline=request_deadline()
+                ),
+                query_text=query_text,
+                query_image=query_image,
+                text_weight=text_weight,
+                top_k=top_k
+            )
+        finally:
+            # Clean up
+            remove_upload(temp_path)
         retrieval_time = time.time() - start_time
         
         # Calculate metrics
-        metrics = calc.calculate_retrieval_metrics(results)
+        metrics = compute_retrieval_metrics(results)
         metrics['retrieval_time'] = retrieval_time
         
-        # Convert images to base64
-        for result in results['results']:
-            try:
-                with Image.open(result['image_path']) as img:
-                    buffered = io.BytesIO()
-                    img.save(buffered, format="JPEG")
-                    img_str = base64.b64encode(buffered.getvalue()).decode()
-                    result['image_base64'] = f"data:image/jpeg;base64,{img_str}"
-            except Exception as e:
-                result['image_base64'] = None
+        result_handle = store_search_result(
+            'multimodal', results['results'], metrics,
+            query_text=query_text, text_weight=text_weight, top_k=top_k, query_image=query_image,
+            history_match=match
+        )
         
-        # Clean up
-        os.remove(temp_path)
+        # Convert images to base64 for web display
+        encode_result_images(results['results'])
         
-        return jsonify({
+        response = {
             'success': True,
             'query_type': 'multimodal',
             'text_weight': text_weight,
             'results': results['results'],
-            'metrics': metrics
-        })
+            'metrics': metrics,
+            'result_handle': result_handle,
+            'history_match': history_match_summary(match)
+        }
+        if 'degraded' in results:
+            response['degraded'] = results['degraded']
+        return jsonify(response)
+    
+    except DeadlineExceeded as e:
+        return deadline_exceeded_response(e)
     
     except Exception as e:
         return jsonify({
@@ -209,6 +804,7 @@ def search_multimodal():
 # ============= GENERATION ENDPOINTS =============
 
 @app.route('/api/generate/text', methods=['POST'])
+@admission_controlled('generate_text')
 def generate_text():
     """Generate text description"""
     try:
@@ -216,6 +812,8 @@ def generate_text():
         query = data['query']
         captions = data['captions']
         query_mode = data.get('query_mode', 'text')
+        bypass_cache = data.get('bypass_cache', False)
+        token_budget = int(data.get('token_budget', 120))
         
         # Build context
         if query_mode == 'text':
@@ -225,20 +823,45 @@ def generate_text():
         else:
             query_str = f"{query} (with reference image)"
         
-        # Generate text
-        start_time = time.time()
-        context = context_builder.build_context(query_str, captions)
-        description = text_gen.generate_from_context(context)
-        generation_time = time.time() - start_time
+        # Reuse the description of the history query the search was answered from
+        history = None if bypass_cache else reusable_generation(data.get('result_handle'))
+        if history and history['generated_text']:
+            REUSE_STAGES.labels('text').inc()
+            REUSE_RUNS_SAVED.labels('generate_text').inc()
+            description = history['generated_text']
+            generation_time = 0.0
+            prompt_tokens = 0
+        else:
+            history = None
+            
+            # Generate text
+            start_time = time.time()
+            relevance, groups = caption_scores(data, captions)
+            context = components.get('context_builder').build_budgeted_context(
+                query_str, captions, relevance=relevance, groups=groups, token_budget=token_budget
+            )
+            description = components.get('text_generator').generate_from_context(
+                context, bypass_cache=bypass_cache, deadline=request_deadline()
+            )
+            generation_time = time.time() - start_time
+            prompt_tokens = context['token_count']
         
         # Calculate metrics
         text_metrics = calc.calculate_text_metrics(description)
+        update_search_result(data.get('result_handle'), {
+            'generated_text': description,
+            'text_metrics': text_metrics,
+            'text_gen_time': generation_time
+        })
         
         return jsonify({
             'success': True,
             'description': description,
             'metrics': text_metrics,
-            'generation_time': generation_time
+            'generation_time': generation_time,
+            'prompt_tokens': prompt_tokens,
+            'from_history': history['query_id'] if history else None,
+            'deadline': request_deadline().to_dict()
         })
     
     except Exception as e:
@@ -248,10 +871,121 @@ def generate_text():
         }), 500
 
 
+@app.route('/api/generate/text/stream', methods=['POST'])
+@admission_controlled('generate_text')
+def generate_text_stream():
+    """Stream text description as Server-Sent Events"""
+    try:
+        data = request.json
+        query = data['query']
+        captions = data['captions']
+        query_mode = data.get('query_mode', 'text')
+        bypass_cache = data.get('bypass_cache', False)
+        token_budget = int(data.get('token_budget', 120))
+        
+        # Build context
+        if query_mode == 'text':
+            query_str = query
+        elif query_mode == 'image':
+            query_str = "the uploaded image"
+        else:
+            query_str = f"{query} (with reference image)"
+        
+        deadline = request_deadline()
+        result_handle = data.get('result_handle')
+        history = None if bypass_cache else reusable_generation(result_handle)
+        if history and history['generated_text']:
+            context, text_gen = None, None
+        else:
+            history = None
+            relevance, groups = caption_scores(data, captions)
+            context = components.get('context_builder').build_budgeted_context(
+                query_str, captions, relevance=relevance, groups=groups, token_budget=token_budget
+            )
+            text_gen = components.get('text_generator')
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    def sse(event, payload):
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    
+    def event_stream():
+        start_time = time.time()
+        time_to_first_token = None
+        chunks = []
+        
+        if history is not None:
+            # Served from history: the stored description arrives as a single token
+            REUSE_STAGES.labels('text').inc()
+            REUSE_RUNS_SAVED.labels('generate_text').inc()
+            description = history['generated_text']
+            text_metrics = calc.calculate_text_metrics(description)
+            update_search_result(result_handle, {
+                'generated_text': description,
+                'text_metrics': text_metrics,
+                'text_gen_time': 0.0
+            })
+            yield sse('token', {'text': description})
+            yield sse('done', add_stream_trace({
+                'success': True,
+                'description': description,
+                'metrics': text_metrics,
+                'generation_time': 0.0,
+                'time_to_first_token': 0.0,
+                'prompt_tokens': 0,
+                'from_history': history['query_id'],
+                'deadline': deadline.to_dict()
+            }))
+            return
+        
+        try:
+            for chunk in text_gen.generate_stream_from_context(context, bypass_cache=bypass_cache, deadline=deadline):
+                if time_to_first_token is None:
+                    time_to_first_token = time.time() - start_time
+                chunks.append(chunk)
+                yield sse('token', {'text': chunk})
+        except Exception as e:
+            yield sse('error', {'error': str(e)})
+            return
+        
+        description = "".join(chunks)
+        text_metrics = calc.calculate_text_metrics(description)
+        generation_time = time.time() - start_time
+        update_search_result(result_handle, {
+            'generated_text': description,
+            'text_metrics': text_metrics,
+            'text_gen_time': generation_time
+        })
+        yield sse('done', add_stream_trace({
+            'success': True,
+            'description': description,
+            'metrics': text_metrics,
+            'generation_time': generation_time,
+            'time_to_first_token': time_to_first_token,
+            'prompt_tokens': context['token_count'],
+            'deadline': deadline.to_dict()
+        }))
+    
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
 @app.route('/api/generate/image', methods=['POST'])
+@admission_controlled('generate_image')
 def generate_image():
     """Generate image from prompt"""
     try:
+        image_gen = components.get('image_generator')
         if not image_gen:
             return jsonify({
                 'success': False,
@@ -262,26 +996,50 @@ def generate_image():
         query = data.get('query', '')
         captions = data['captions']
         
+        # Reuse the image of the history query the search was answered from
+        history = reusable_generation(data.get('result_handle'))
+        jpeg = load_history_image(history['generated_image_path']) if history and history['generated_image_path'] else None
+        if jpeg is not None:
+            REUSE_STAGES.labels('image').inc()
+            REUSE_RUNS_SAVED.labels('generate_image').inc()
+            update_search_result(data.get('result_handle'), {'image_gen_time': 0.0}, generated_image=jpeg)
+            return jsonify({
+                'success': True,
+                'image_base64': jpeg_to_base64(jpeg),
+                'prompt': None,
+                'generation_time': 0.0,
+                'from_history': history['query_id']
+            })
+        
         # Build prompt
-        img_prompt = context_builder.build_image_generation_prompt(query, captions)
+        img_prompt = components.get('context_builder').build_image_generation_prompt(query, captions)
         
         # Generate image
         start_time = time.time()
-        generated_img = image_gen.txt2img(img_prompt)
+        deadline = request_deadline()
+        generated_img = image_gen.txt2img(img_prompt, deadline=deadline)
         generation_time = time.time() - start_time
         
         if generated_img:
-            # Convert to base64
-            buffered = io.BytesIO()
-            generated_img.save(buffered, format="JPEG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
+            # Convert to base64; the same JPEG is kept for saving by handle
+            with span('image.base64'):
+                jpeg = pil_to_jpeg(generated_img)
+                image_base64 = jpeg_to_base64(jpeg)
+            update_search_result(data.get('result_handle'), {'image_gen_time': generation_time}, generated_image=jpeg)
             
             return jsonify({
                 'success': True,
-                'image_base64': f"data:image/jpeg;base64,{img_str}",
+                'image_base64': image_base64,
                 'prompt': img_prompt,
                 'generation_time': generation_time
             })
+        elif deadline.bounded:
+            return jsonify({
+                'success': False,
+                'error': 'Image generation skipped or failed within the deadline',
+                'deadline_exceeded': deadline.expired(),
+                'deadline': deadline.to_dict()
+            }), 504
         else:
             return jsonify({
                 'success': False,
@@ -295,21 +1053,215 @@ def generate_image():
         }), 500
 
 
+# ============= PIPELINE ENDPOINT =============
+
+@app.route('/api/pipeline', methods=['POST'])
+@admission_controlled('pipeline')
+def run_pipeline():
+    """
+    Retrieval plus concurrent text and image generation in one request.
+    Streams Server-Sent Events: retrieval, text, image (as each finishes), done.
+    """
+    temp_path = None
+    try:
+        if request.files or request.form:
+            params = request.form
+        else:
+            params = request.json or {}
+        
+        query_mode = params.get('query_mode', 'text')
+        query_text = params.get('query')
+        text_weight = float(params.get('text_weight', 0.5))
+        top_k = int(params.get('top_k', 5))
+        generate_text_flag = str(params.get('generate_text', 'true')).lower() in ('1', 'true', 'yes')
+        generate_image_flag = str(params.get('generate_image', 'false')).lower() in ('1', 'true', 'yes')
+        deadline = request_deadline()
+        
+        if query_mode in ('image', 'multimodal'):
+            if 'image' not in request.files:
+                return jsonify({'success': False, 'error': 'No image provided'}), 400
+            temp_path = save_upload(request.files['image'])
+        elif not query_text:
+            return jsonify({'success': False, 'error': 'No query provided'}), 400
+        
+        # Stages a repeat query can be served from history instead of running
+        query_image = read_file_bytes(temp_path) if temp_path else None
+        match = find_history_match(query_mode, query_text, query_image, text_weight, top_k)
+        reused_text = match['generated_text'] if match and generate_text_flag else None
+        reused_image = None
+        if match and generate_image_flag and match['generated_image_path']:
+            reused_image = load_history_image(match['generated_image_path'])
+    
+    except Exception as e:
+        remove_upload(temp_path)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    def sse(event, payload):
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    
+    def event_stream():
+        result_handle = None
+        try:
+            if match is not None:
+                REUSE_STAGES.labels('retrieval').inc()
+                if (not generate_text_flag or reused_text) and (not generate_image_flag or reused_image):
+                    REUSE_RUNS_SAVED.labels('pipeline').inc()
+            
+            events = components.get('pipeline').run(
+                query_mode,
+                query_text=query_text,
+                query_image=temp_path,
+                text_weight=text_weight,
+                top_k=top_k,
+                generate_text=generate_text_flag and not reused_text,
+                generate_image=generate_image_flag and reused_image is None,
+                results={'results': match['retrieval_results']} if match else None,
+                deadline=deadline
+            )
+            for event in events:
+                stage = event['stage']
+                
+                if stage == 'retrieval':
+                    results = event['results']
+                    metrics = compute_retrieval_metrics(results)
+                    metrics['retrieval_time'] = event['time']
+                    result_handle = store_search_result(
+                        query_mode, results['results'], metrics,
+                        query_text=query_text,
+                        text_weight=text_weight if query_mode == 'multimodal' else None,
+                        top_k=top_k,
+                        query_image=query_image,
+                        history_match=match
+                    )
+                    # Only retrieval reads the upload
+                    remove_upload(temp_path)
+                    encode_result_images(results['results'])
+                    yield sse('retrieval', {
+                        'query_type': query_mode,
+                        'results': results['results'],
+                        'captions': event['captions'],
+                        'metrics': metrics,
+                        'result_handle': result_handle,
+                        'history_match': history_match_summary(match)
+                    })
+                    
+                    if reused_text:
+                        REUSE_STAGES.labels('text').inc()
+                        text_metrics = calc.calculate_text_metrics(reused_text)
+                        update_search_result(result_handle, {
+                            'generated_text': reused_text,
+                            'text_metrics': text_metrics,
+                            'text_gen_time': 0.0
+                        })
+                        yield sse('text', {
+                            'generation_time': 0.0,
+                            'description': reused_text,
+                            'metrics': text_metrics,
+                            'prompt_tokens': 0,
+                            'from_history': match['id']
+                        })
+                    if reused_image is not None:
+                        REUSE_STAGES.labels('image').inc()
+                        update_search_result(result_handle, {'image_gen_time': 0.0}, generated_image=reused_image)
+                        yield sse('image', {
+                            'generation_time': 0.0,
+                            'prompt': None,
+                            'image_base64': jpeg_to_base64(reused_image),
+                            'from_history': match['id']
+                        })
+                
+                elif stage == 'text':
+                    payload = {'generation_time': event['time']}
+                    if 'error' in event:
+                        payload['error'] = event['error']
+                    else:
+                        payload['description'] = event['description']
+                        payload['metrics'] = calc.calculate_text_metrics(event['description'])
+                        payload['prompt_tokens'] = event['prompt_tokens']
+                        update_search_result(result_handle, {
+                            'generated_text': event['description'],
+                            'text_metrics': payload['metrics'],
+                            'text_gen_time': event['time']
+                        })
+                    yield sse('text', payload)
+                
+                elif stage == 'image':
+                    payload = {'generation_time': event['time'], 'prompt': event.get('prompt')}
+                    if event.get('image') is not None:
+                        with span('image.base64'):
+                            jpeg = pil_to_jpeg(event['image'])
+                            payload['image_base64'] = jpeg_to_base64(jpeg)
+                        update_search_result(result_handle, {'image_gen_time': event['time']}, generated_image=jpeg)
+                    else:
+                        payload['error'] = event.get('error', 'Image generation failed')
+                    yield sse('image', payload)
+                
+                elif stage == 'done':
+                    yield sse('done', add_stream_trace({
+                        'success': True,
+                        'timings': event['timings'],
+                        'total_time': event['total_time'],
+                        'deadline': event['deadline']
+                    }))
+        
+        except DeadlineExceeded as e:
+            yield sse('error', {'error': str(e), 'deadline_exceeded': True, 'stage': e.stage})
+        except Exception as e:
+            yield sse('error', {'error': str(e)})
+    
+    response = Response(
+        stream_with_context(event_stream()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+    # Runs even if the stream is never iterated or is abandoned mid-way
+    response.call_on_close(lambda: remove_upload(temp_path))
+    return response
+
+
 # ============= HISTORY ENDPOINTS =============
 
 @app.route('/api/history', methods=['GET'])
 def get_history():
-    """Get all queries from history"""
+    """
+    Page through history, newest first
+    
+    Query params: limit, cursor (next_cursor of the previous page), mode, since, until,
+    min_similarity, max_similarity, q (full-text search), fields=full for every column
+    """
     try:
-        limit = int(request.args.get('limit', 20))
-        queries = history_manager.get_all_queries(limit=limit)
+        args = request.args
+        page = components.get('history_manager').list_queries(
+            limit=min(int(args.get('limit', 20)), 500),
+            cursor=args.get('cursor'),
+            mode=args.get('mode'),
+            since=args.get('since'),
+            until=args.get('until'),
+            min_similarity=args.get('min_similarity', type=float),
+            max_similarity=args.get('max_similarity', type=float),
+            search=args.get('q'),
+            full=args.get('fields') == 'full'
+        )
         
         return jsonify({
             'success': True,
-            'queries': queries,
-            'total': len(queries)
+            'queries': page['queries'],
+            'total': len(page['queries']),
+            'next_cursor': page['next_cursor']
         })
     
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
     except Exception as e:
         return jsonify({
             'success': False,
@@ -321,7 +1273,7 @@ def get_history():
 def get_query(query_id):
     """Get specific query by ID"""
     try:
-        query = history_manager.get_query_by_id(query_id)
+        query = components.get('history_manager').get_query_by_id(query_id)
         
         if not query:
             return jsonify({
@@ -330,37 +1282,15 @@ def get_query(query_id):
             }), 404
         
         # Convert images to base64
-        for result in query['retrieval_results']:
-            try:
-                with Image.open(result['image_path']) as img:
-                    buffered = io.BytesIO()
-                    img.save(buffered, format="JPEG")
-                    img_str = base64.b64encode(buffered.getvalue()).decode()
-                    result['image_base64'] = f"data:image/jpeg;base64,{img_str}"
-            except Exception as e:
-                result['image_base64'] = None
+        encode_result_images(query['retrieval_results'])
         
         # Load query image if exists
         if query['query_image_path']:
-            try:
-                with Image.open(query['query_image_path']) as img:
-                    buffered = io.BytesIO()
-                    img.save(buffered, format="JPEG")
-                    img_str = base64.b64encode(buffered.getvalue()).decode()
-                    query['query_image_base64'] = f"data:image/jpeg;base64,{img_str}"
-            except Exception as e:
-                query['query_image_base64'] = None
+            query['query_image_base64'] = image_file_to_base64(query['query_image_path'])
         
         # Load generated image if exists
         if query['generated_image_path']:
-            try:
-                with Image.open(query['generated_image_path']) as img:
-                    buffered = io.BytesIO()
-                    img.save(buffered, format="JPEG")
-                    img_str = base64.b64encode(buffered.getvalue()).decode()
-                    query['generated_image_base64'] = f"data:image/jpeg;base64,{img_str}"
-            except Exception as e:
-                query['generated_image_base64'] = None
+            query['generated_image_base64'] = image_file_to_base64(query['generated_image_path'])
         
         return jsonify({
             'success': True,
@@ -374,11 +1304,34 @@ def get_query(query_id):
         }), 500
 
 
+@app.route('/api/history/images/<image_hash>', methods=['GET'])
+def get_history_image(image_hash):
+    """Serve a stored history image (?thumb=1 for its thumbnail); content-addressed, so cacheable forever"""
+    if not all(c in '0123456789abcdef' for c in image_hash) or len(image_hash) != 64:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid image hash'
+        }), 400
+    
+    path = components.get('history_manager').get_image_path(
+        image_hash, thumbnail=request.args.get('thumb', '').lower() in ('1', 'true', 'yes')
+    )
+    if not path:
+        return jsonify({
+            'success': False,
+            'error': 'Image not found'
+        }), 404
+    
+    response = send_file(os.path.abspath(path), max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
 @app.route('/api/history/<int:query_id>', methods=['DELETE'])
 def delete_query(query_id):
     """Delete query from history"""
     try:
-        success = history_manager.delete_query(query_id)
+        success = components.get('history_manager').delete_query(query_id)
         
         if success:
             return jsonify({
@@ -402,7 +1355,7 @@ def delete_query(query_id):
 def get_stats():
     """Get history statistics"""
     try:
-        stats = history_manager.get_statistics()
+        stats = components.get('history_manager').get_statistics()
         
         return jsonify({
             'success': True,
@@ -416,12 +1369,47 @@ def get_stats():
         }), 500
 
 
+@app.route('/api/history/stats/timeseries', methods=['GET'])
+def get_stats_timeseries():
+    """Per-hour or per-day query volume, averages and latency percentiles (granularity, since, until, mode)"""
+    try:
+        series = components.get('history_manager').get_timeseries(
+            granularity=request.args.get('granularity', 'hour'),
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            mode=request.args.get('mode')
+        )
+        
+        return jsonify({
+            'success': True,
+            'series': series
+        })
+    
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
 @app.route('/api/history/save', methods=['POST'])
 def save_to_history():
-    """Save query to history"""
+    """
+    Save query to history, either by 'result_handle' (the server persists the result it
+    already holds) or from the full result sent by the client
+    """
     try:
         data = request.json
         
+        if data.get('result_handle'):
+            return save_result_handle(data['result_handle'], data.get('performance') or {})
+        
         # Extract data
         query_data = data['query_data']
         results = data['results']
@@ -438,6 +1426,7 @@ def save_to_history():
             img_bytes = base64.b64decode(img_data)
             query_image = Image.open(io.BytesIO(img_bytes))
             query_data['query_image'] = query_image
+        query_data.setdefault('index_version', current_index_version())
         
         # Handle generated image if base64
         generated_image = None
@@ -447,7 +1436,7 @@ def save_to_history():
             generated_image = Image.open(io.BytesIO(img_bytes))
         
         # Save to history
-        query_id = history_manager.save_query(
+        query_id = components.get('history_manager').save_query(
             query_data=query_data,
             results={'results': results},
             retrieval_metrics=retrieval_metrics,
@@ -470,20 +1459,130 @@ def save_to_history():
         }), 500
 
 
+def save_result_handle(result_handle: str, client_performance: dict):
+    """Save a stored search result, with any generation output added to its handle"""
+    result_store = components.get('result_store')
+    # Claimed (removed) up front so concurrent saves of one handle can't both succeed
+    stored = result_store.claim(result_handle)
+    if stored is None:
+        return jsonify({
+            'success': False,
+            'error': 'Result handle expired or unknown; send the full result instead',
+            'handle_expired': True
+        }), 410
+    
+    try:
+        payload = stored['payload']
+        query_data = {
+            'query_mode': HISTORY_MODE_LABELS.get(payload['query_type'], payload['query_type']),
+            'query_text': payload.get('query_text'),
+            'text_weight': payload.get('text_weight'),
+            'top_k': payload['top_k'],
+            'index_version': payload.get('index_version')
+        }
+        if stored['query_image']:
+            query_data['query_image'] = Image.open(io.BytesIO(stored['query_image']))
+        generated_image = None
+        if stored['generated_image']:
+            generated_image = Image.open(io.BytesIO(stored['generated_image']))
+        
+        # Server-side timings; the client's (e.g. end-to-end total_time) take precedence
+        performance = {
+            'retrieval_time': payload['metrics'].get('retrieval_time', 0),
+            'text_gen_time': payload.get('text_gen_time', 0),
+            'image_gen_time': payload.get('image_gen_time', 0)
+        }
+        performance['total_time'] = sum(performance.values())
+        performance.update(client_performance)
+        
+        query_id = components.get('history_manager').save_query(
+            query_data=query_data,
+            results={'results': payload['results']},
+            retrieval_metrics=payload['metrics'],
+            performance=performance,
+            generated_text=payload.get('generated_text'),
+            text_metrics=payload.get('text_metrics'),
+            generated_image=generated_image
+        )
+    except Exception:
+        # Let the client retry with the same handle
+        result_store.restore(result_handle, stored)
+        raise
+    
+    return jsonify({
+        'success': True,
+        'query_id': query_id,
+        'message': f'Saved as Query #{query_id}'
+    })
+
+
 # ============= UTILITY ENDPOINTS =============
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
+    """Health check endpoint (does not trigger component loading)"""
+    status = components.status()
     return jsonify({
         'success': True,
         'status': 'healthy',
-        'components': {
-            'retriever': retriever is not None,
-            'text_generator': text_gen is not None,
-            'image_generator': image_gen is not None,
-            'history_manager': history_manager is not None
-        }
+        'components': {name: info['state'] == 'ready' for name, info in status.items()},
+        'component_status': status,
+        'admission': admission.get_statistics()
+    })
+
+
+@app.route('/api/health/live', methods=['GET'])
+def liveness():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'success': True, 'status': 'alive'})
+
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness():
+    """Readiness: READY_COMPONENTS are loaded; starts loading them (or retrying failed ones) if needed"""
+    if components.ready(READY_COMPONENTS):
+        return jsonify({'success': True, 'status': 'ready', 'components': components.status()})
+    
+    if not any(components.state(name) == 'loading' for name in READY_COMPONENTS):
+        # Failed components are retried once their backoff has passed
+        pending = [
+            name for name in READY_COMPONENTS
+            if components.state(name) == 'not_loaded'
+            or (components.state(name) == 'failed' and components.retry_due(name))
+        ]
+        if pending:
+            components.warm_up(pending, background=True)
+    
+    return jsonify({
+        'success': False,
+        'status': 'not_ready',
+        'components': components.status()
+    }), 503
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of all in-process metrics"""
+    return Response(metrics.render(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route('/api/llm/stats', methods=['GET'])
+def llm_stats():
+    """Per-provider latency/error statistics in multi-provider mode"""
+    text_gen = components.get('text_generator')
+    if not hasattr(text_gen, 'get_statistics'):
+        return jsonify({
+            'success': True,
+            'mode': 'single',
+            'provider': f"{text_gen.provider}/{text_gen.model}",
+            'rate_limits': get_rate_limit_statistics()
+        })
+    
+    return jsonify({
+        'success': True,
+        'mode': 'hedged',
+        'stats': text_gen.get_statistics(),
+        'rate_limits': get_rate_limit_statistics()
     })
 
 
@@ -508,4 +1607,11 @@ if __name__ == '__main__':
     print("Frontend: http://localhost:5000")
     print("="*50 + "\n")
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # The debug reloader imports this module twice (loading CLIP and FAISS twice);
+    # opt in with FLASK_RELOAD=1. For production use backend/serve.py
+    app.run(
+        debug=True,
+        use_reloader=os.getenv("FLASK_RELOAD") == "1",
+        host='0.0.0.0',
+        port=5000
+    )
@@ -0,0 +1,173 @@
+"""
+Production Server for the Multimodal RAG API
+Prefork Gunicorn server that loads models and the FAISS index once in the master process
+
+Workers are forked after the models are loaded, so CLIP weights, the FAISS index
+and metadata are shared copy-on-write instead of being loaded once per worker.
+
+Usage (Linux/macOS):
+    python backend/serve.py --workers 4 --threads-per-worker 2
+
+Graceful reload:
+    kill -HUP <master pid>     # restart workers, keeping the preloaded models
+    kill -USR2 <master pid>    # start a new master (reloads code + models), then
+    kill -TERM <old master>    # stop the old one once the new one is healthy
+
+/metrics merges all workers: each writes its values to METRICS_MULTIPROC_DIR every
+METRICS_FLUSH_SECONDS (default 5), and once more on exit, and the worker that
+serves the scrape sums them.
+"""
+
+import argparse
+import gc
+import multiprocessing
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from gunicorn.app.base import BaseApplication
+
+sys.path.insert(0, str(Path(__file__).parent))
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.utils import telemetry
+
+
+def configure_threads(num_threads: int):
+    """
+    Limit math library thread pools for one worker
+
+    Args:
+        num_threads: Threads for torch, FAISS (OpenMP) and BLAS
+    """
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(num_threads)
+
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+        torch.set_num_interop_threads(1)
+    except (ImportError, RuntimeError):
+        # set_num_interop_threads raises if the pool was already used in this process
+        pass
+
+    try:
+        import faiss
+        faiss.omp_set_num_threads(num_threads)
+    except ImportError:
+        pass
+
+
+class RAGServer(BaseApplication):
+    """Gunicorn application that preloads backend.app in the master"""
+
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key.lower(), value)
+
+    def load(self):
+        # Imported here so that, with preload_app, it runs once in the master
+        import app as backend_app
+
+        # Components are lazy by default; load them all before forking so workers share them
+        backend_app.components.warm_up(
+            ['retriever', 'context_builder', 'text_generator', 'image_generator', 'history_manager', 'pipeline'],
+            background=False
+        )
+
+        # Move everything allocated so far (models, index, metadata) out of the
+        # garbage collector's generations: GC passes in workers then no longer
+        # touch those objects' pages, which keeps them shared copy-on-write
+        gc.collect()
+        gc.freeze()
+        return backend_app.app
+
+
+def build_options(args) -> dict:
+    threads_per_worker = args.threads_per_worker
+
+    metrics_dir = args.metrics_dir
+
+    def post_fork(server, worker):
+        configure_threads(threads_per_worker)
+        telemetry.registry.enable_multiprocess(metrics_dir, args.metrics_flush_seconds)
+        server.log.info(f"Worker {worker.pid}: {threads_per_worker} math threads")
+
+    def when_ready(server):
+        # Counts recorded while preloading belong to the master; archive them once
+        # (workers zero the copies they inherit)
+        telemetry.write_snapshot(metrics_dir)
+        telemetry.mark_process_dead(metrics_dir, os.getpid())
+        server.log.info(f"Models preloaded in master {os.getpid()}; serving with {args.workers} workers")
+
+    def worker_exit(server, worker):
+        # Runs in the exiting worker: flush what it counted since its last periodic
+        # write, before the master archives its file in child_exit
+        try:
+            telemetry.write_snapshot(metrics_dir)
+        except Exception as e:
+            server.log.warning(f"Worker {worker.pid}: final metrics write failed: {e}")
+
+    def child_exit(server, worker):
+        telemetry.mark_process_dead(metrics_dir, worker.pid)
+
+    return {
+        'bind': f"{args.host}:{args.port}",
+        'workers': args.workers,
+        'threads': args.worker_threads,
+        'worker_class': 'gthread',
+        'preload_app': True,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests // 10 if args.max_requests else 0,
+        'post_fork': post_fork,
+        'when_ready': when_ready,
+        'worker_exit': worker_exit,
+        'child_exit': child_exit,
+        'accesslog': '-' if args.access_log else None
+    }
+
+
+if __name__ == '__main__':
+    cpu_count = multiprocessing.cpu_count()
+
+    parser = argparse.ArgumentParser(description="Run the API with a prefork production server")
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=max(1, cpu_count // 2),
+                        help="Worker processes")
+    parser.add_argument("--worker-threads", type=int, default=4,
+                        help="Request threads per worker (I/O-bound endpoints)")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="torch/FAISS threads per worker (default: cores / workers)")
+    parser.add_argument("--timeout", type=int, default=180,
+                        help="Seconds before a silent worker is restarted")
+    parser.add_argument("--graceful-timeout", type=int, default=60,
+                        help="Seconds workers get to finish requests on reload/shutdown")
+    parser.add_argument("--max-requests", type=int, default=0,
+                        help="Recycle workers after this many requests (0 = never)")
+    parser.add_argument("--access-log", action="store_true")
+    parser.add_argument("--metrics-dir", type=str, default=os.getenv("METRICS_MULTIPROC_DIR"),
+                        help="Directory where workers share metrics (default: a temp dir per port)")
+    parser.add_argument("--metrics-flush-seconds", type=float,
+                        default=float(os.getenv("METRICS_FLUSH_SECONDS", "5")),
+                        help="How often workers write their metrics for /metrics")
+
+    args = parser.parse_args()
+    if args.threads_per_worker is None:
+        args.threads_per_worker = max(1, cpu_count // args.workers)
+    if args.metrics_dir is None:
+        args.metrics_dir = os.path.join(tempfile.gettempdir(), f"rag-metrics-{args.port}")
+    telemetry.clear_multiprocess_dir(args.metrics_dir)
+
+    # Keep the master's own thread pools small; workers set theirs after fork
+    configure_threads(1)
+
+    RAGServer(build_options(args)).run()
@@ -77,7 +77,7 @@ class API {
     /**
      * Generate text description
      */
-    async generateText(query, captions, queryMode = 'text') {
+    async generateText(query, captions, queryMode = 'text', resultHandle = null, scores = {}) {
         const response = await fetch(`${this.baseUrl}/generate/text`, {
             method: 'POST',
             headers: {
@@ -86,7 +86,10 @@ class API {
             body: JSON.stringify({
                 query: query,
                 captions: captions,
-                query_mode: queryMode
+                query_mode: queryMode,
+                result_handle: resultHandle,
+                relevance: scores.relevance,
+                groups: scores.groups
             })
         });
 
@@ -100,7 +103,7 @@ class API {
     /**
      * Generate image
      */
-    async generateImage(query, captions) {
+    async generateImage(query, captions, resultHandle = null) {
         const response = await fetch(`${this.baseUrl}/generate/image`, {
             method: 'POST',
             headers: {
@@ -108,7 +111,8 @@ class API {
             },
             body: JSON.stringify({
                 query: query,
-                captions: captions
+                captions: captions,
+                result_handle: resultHandle
             })
         });
 
@@ -121,10 +125,16 @@ class API {
     }
 
     /**
-     * Get history
+     * Get a page of history (filters: cursor, mode, since, until, min_similarity, max_similarity, q)
      */
-    async getHistory(limit = 20) {
-        const response = await fetch(`${this.baseUrl}/history?limit=${limit}`);
+    async getHistory(limit = 20, filters = {}) {
+        const params = new URLSearchParams({ limit });
+        Object.entries(filters).forEach(([key, value]) => {
+            if (value !== undefined && value !== null && value !== '') {
+                params.append(key, value);
+            }
+        });
+        const response = await fetch(`${this.baseUrl}/history?${params}`);
 
         if (!response.ok) {
             throw new Error('Failed to load history');
@@ -201,6 +211,32 @@ class API {
         return await response.json();
     }
 
+    /**
+     * Save a search to history by its result handle; the server already holds the results
+     * and images. Returns null if the handle has expired (save with saveToHistory instead)
+     */
+    async saveResultToHistory(resultHandle, performance) {
+        const response = await fetch(`${this.baseUrl}/history/save`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                result_handle: resultHandle,
+                performance: performance
+            })
+        });
+
+        if (response.status === 410) {
+            return null;
+        }
+        if (!response.ok) {
+            throw new Error('Failed to save to history');
+        }
+
+        return await response.json();
+    }
+
     /**
      * Health check
      */
@@ -220,13 +220,19 @@ async function performSearch() {
 
         // Extract captions for generation
         const allCaptions = searchResult.results.flatMap(r => r.captions);
+        const captionScores = {
+            relevance: searchResult.results.flatMap(r => r.captions.map(() => r.similarity_score)),
+            groups: searchResult.results.flatMap((r, i) => r.captions.map(() => i))
+        };
 
         // Generate text if enabled
         let textGenData = null;
         if (generateText) {
             showLoading('Generating description...');
             try {
-                textGenData = await api.generateText(textQuery || '', allCaptions, currentMode);
+                textGenData = await api.generateText(
+                    textQuery || '', allCaptions, currentMode, searchResult.result_handle, captionScores
+                );
                 if (textGenData.success) {
                     renderGeneratedText(textGenData);
                     currentSearchData.generatedText = textGenData.description;
@@ -244,7 +250,7 @@ async function performSearch() {
         if (generateImage) {
             showLoading('Generating image...');
             try {
-                imageGenData = await api.generateImage(textQuery || '', allCaptions);
+                imageGenData = await api.generateImage(textQuery || '', allCaptions, searchResult.result_handle);
                 if (imageGenData.success) {
                     renderGeneratedImage(imageGenData);
                     currentSearchData.generatedImage = imageGenData.image_base64;
@@ -264,34 +270,25 @@ async function performSearch() {
         // Auto-save to history
         if (autoSave) {
             try {
-                // Prepare query image base64 if exists
-                let queryImageBase64 = null;
-                if (uploadedImage) {
-                    queryImageBase64 = await fileToBase64(uploadedImage);
+                const performanceData = {
+                    retrieval_time: retrievalTime,
+                    text_gen_time: textGenData ? textGenData.generation_time : 0,
+                    image_gen_time: imageGenData ? imageGenData.generation_time : 0,
+                    total_time: totalTime
+                };
+
+                // Save by handle: the server already has the results and images
+                let saveResult = null;
+                if (searchResult.result_handle) {
+                    saveResult = await api.saveResultToHistory(searchResult.result_handle, performanceData);
                 }
 
-                const saveResult = await api.saveToHistory(
-                    {
-                        query_mode: currentMode === 'text' ? 'Text Only' :
-                            currentMode === 'image' ? 'Image Only' : 'Text + Image (Multimodal)',
-                        query_text: textQuery,
-                        query_image_base64: queryImageBase64,
-                        text_weight: currentMode === 'multimodal' ?
-                            parseFloat(document.getElementById('text-weight-slider').value) : null,
-                        top_k: topK
-                    },
-                    searchResult.results,
-                    searchResult.metrics,
-                    {
-                        retrieval_time: retrievalTime,
-                        text_gen_time: textGenData ? textGenData.generation_time : 0,
-                        image_gen_time: imageGenData ? imageGenData.generation_time : 0,
-                        total_time: totalTime
-                    },
-                    textGenData ? textGenData.description : null,
-                    textGenData ? textGenData.metrics : null,
-                    imageGenData ? imageGenData.image_base64 : null
-                );
+                // No handle, or it expired: send the full result
+                if (!saveResult) {
+                    saveResult = await saveFullResultToHistory(
+                        textQuery, topK, searchResult, performanceData, textGenData, imageGenData
+                    );
+                }
 
                 if (saveResult.success) {
                     showToast(`Saved as Query #${saveResult.query_id}`, 'success');
@@ -312,6 +309,34 @@ async function performSearch() {
     }
 }
 
+/**
+ * Save a search by re-sending its results and images (when no result handle is available)
+ */
+async function saveFullResultToHistory(textQuery, topK, searchResult, performanceData, textGenData, imageGenData) {
+    let queryImageBase64 = null;
+    if (uploadedImage) {
+        queryImageBase64 = await fileToBase64(uploadedImage);
+    }
+
+    return await api.saveToHistory(
+        {
+            query_mode: currentMode === 'text' ? 'Text Only' :
+                currentMode === 'image' ? 'Image Only' : 'Text + Image (Multimodal)',
+            query_text: textQuery,
+            query_image_base64: queryImageBase64,
+            text_weight: currentMode === 'multimodal' ?
+                parseFloat(document.getElementById('text-weight-slider').value) : null,
+            top_k: topK
+        },
+        searchResult.results,
+        searchResult.metrics,
+        performanceData,
+        textGenData ? textGenData.description : null,
+        textGenData ? textGenData.metrics : null,
+        imageGenData ? imageGenData.image_base64 : null
+    );
+}
+
 /**
  * Load history
  */
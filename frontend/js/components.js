@@ -38,6 +38,7 @@ function renderResults(data) {
                     <div class="metric-label">Retrieval Time</div>
                 </div>
             </div>
+            ${renderEmbeddingMetrics(data.metrics)}
         </div>
     `;
 
@@ -93,6 +94,32 @@ function renderResults(data) {
     container.innerHTML = html;
 }
 
+/**
+ * Render embedding-space result-set metrics (only present when stored vectors are available)
+ */
+function renderEmbeddingMetrics(metrics) {
+    if (metrics.embedding_diversity === undefined) {
+        return '';
+    }
+
+    return `
+        <div class="grid grid-cols-3 gap-4 mt-4">
+            <div class="metric-card">
+                <div class="metric-value">${metrics.embedding_diversity.toFixed(3)}</div>
+                <div class="metric-label">Embedding Diversity</div>
+            </div>
+            <div class="metric-card">
+                <div class="metric-value">${(metrics.embedding_coverage * 100).toFixed(0)}%</div>
+                <div class="metric-label">Coverage</div>
+            </div>
+            <div class="metric-card">
+                <div class="metric-value">${(metrics.redundancy * 100).toFixed(0)}%</div>
+                <div class="metric-label">Redundancy</div>
+            </div>
+        </div>
+    `;
+}
+
 /**
  * Render generated text
  */
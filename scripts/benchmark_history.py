@@ -0,0 +1,186 @@
+"""
+History Database Benchmark
+Concurrent read/write throughput of HistoryManager: per-call connections with the
+default rollback journal (the previous behaviour) vs pooled WAL connections, with and
+without the write-behind queue
+
+    python scripts/benchmark_history.py --threads 1 4 16 --operations 2000
+"""
+
+import argparse
+import json
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.utils.history_manager import HistoryManager
+from src.utils.sqlite_pool import SQLitePool
+
+
+class PerCallConnections:
+    """Opens a fresh connection per operation with default pragmas, as HistoryManager used to"""
+
+    def __init__(self, db_path: str, busy_timeout: float = 5.0):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def transaction(self):
+        conn = self._connect()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def close(self):
+        pass
+
+
+def make_query(i: int, top_k: int = 5):
+    """Synthetic save_query arguments"""
+    results = {'results': [
+        {
+            'rank': rank + 1,
+            'image_path': f"data/images/{i}_{rank}.jpg",
+            'file_name': f"{i}_{rank}.jpg",
+            'similarity_score': random.random(),
+            'captions': [f"caption {rank} for query {i}"] * 5
+        }
+        for rank in range(top_k)
+    ]}
+    metrics = {
+        'avg_similarity': 0.3, 'diversity': 0.1, 'min_similarity': 0.2,
+        'max_similarity': 0.4, 'std_similarity': 0.05
+    }
+    return (
+        {'query_mode': 'text', 'query_text': f"query {i}", 'top_k': top_k},
+        results,
+        metrics,
+        {'retrieval_time': 0.05, 'total_time': 0.1}
+    )
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q / 100.0 * len(samples)))]
+
+
+def run_benchmark(manager: HistoryManager, operations: int, threads: int, write_ratio: float) -> dict:
+    """
+    Run a mixed workload of saves, list/detail reads and statistics
+
+    Args:
+        manager: History manager under test
+        operations: Total operations
+        threads: Concurrent threads
+        write_ratio: Fraction of operations that are save_query
+
+    Returns:
+        Dictionary with throughput, latency percentiles and errors
+    """
+    for i in range(50):
+        manager.save_query(*make_query(i))
+
+    rng = random.Random(0)
+    plan = ['write' if rng.random() < write_ratio else rng.choice(['list', 'get', 'stats']) for _ in range(operations)]
+
+    def one_operation(i):
+        kind = plan[i]
+        start = time.perf_counter()
+        try:
+            if kind == 'write':
+                manager.save_query(*make_query(i))
+            elif kind == 'list':
+                manager.get_all_queries(limit=50)
+            elif kind == 'get':
+                manager.get_query_by_id(1 + i % 50)
+            else:
+                manager.get_statistics()
+            return kind, time.perf_counter() - start, True
+        except sqlite3.OperationalError:
+            return kind, time.perf_counter() - start, False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        outcomes = list(pool.map(one_operation, range(operations)))
+    wall_time = time.perf_counter() - start
+
+    reads = [latency for kind, latency, ok in outcomes if ok and kind != 'write']
+    writes = [latency for kind, latency, ok in outcomes if ok and kind == 'write']
+    return {
+        'threads': threads,
+        'operations': operations,
+        'errors': sum(1 for _, _, ok in outcomes if not ok),
+        'throughput_ops': (len(reads) + len(writes)) / wall_time if wall_time else 0.0,
+        'read_p50_ms': percentile(reads, 50) * 1000,
+        'read_p95_ms': percentile(reads, 95) * 1000,
+        'write_p50_ms': percentile(writes, 50) * 1000,
+        'write_p95_ms': percentile(writes, 95) * 1000
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark HistoryManager database access")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--operations", type=int, default=2000)
+    parser.add_argument("--write_ratio", type=float, default=0.2)
+    parser.add_argument("--pool_size", type=int, default=8)
+    parser.add_argument("--output", type=str, default="experiments/history_benchmark.json")
+
+    args = parser.parse_args()
+
+    # label -> (connection factory, write-behind)
+    configs = {
+        'per_call_rollback': (lambda path: PerCallConnections(path), False),
+        'pooled_wal': (lambda path: SQLitePool(path, max_connections=args.pool_size), False),
+        'pooled_write_behind': (lambda path: SQLitePool(path, max_connections=args.pool_size), True)
+    }
+
+    all_results = {}
+    for label, (make_pool, write_behind) in configs.items():
+        all_results[label] = []
+        for threads in args.threads:
+            # Fresh database per run; HistoryManager writes images under ./history
+            db_path = str(Path(tempfile.mkdtemp()) / 'queries.db')
+            manager = HistoryManager(db_path, pool=make_pool(db_path), write_behind=write_behind)
+            result = run_benchmark(manager, args.operations, threads, args.write_ratio)
+            manager.close()
+            all_results[label].append(result)
+            print(
+                f"{label:>20} threads={threads:<3} {result['throughput_ops']:8.1f} ops/s  "
+                f"read p50/p95 {result['read_p50_ms']:.2f}/{result['read_p95_ms']:.2f}ms  "
+                f"write p50/p95 {result['write_p50_ms']:.2f}/{result['write_p95_ms']:.2f}ms  "
+                f"errors {result['errors']}"
+            )
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(all_results, f, indent=2)
+    print(f"\nResults saved to {output}")
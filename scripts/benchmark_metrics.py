@@ -0,0 +1,119 @@
+"""
+Metrics Calculator Benchmark
+Per-item MetricsCalculator calls vs the vectorised batch APIs on synthetic result sets
+and descriptions, checking that both give identical metrics
+
+    python scripts/benchmark_metrics.py --sizes 1000 10000 --top_k 5
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.utils.metrics_calculator import MetricsCalculator
+
+
+WORDS = (
+    "a dog cat man woman child ball park street beach red brown green small large "
+    "running playing sitting standing near with on in the of happy sunny old young"
+).split()
+
+
+def make_sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(3, 12))]
+    return " ".join(words).capitalize() + rng.choice([".", "!", "?", "..."])
+
+
+def make_dataset(n: int, top_k: int, seed: int = 0):
+    """Synthetic result sets (some empty or shorter than top_k) and descriptions"""
+    rng = random.Random(seed)
+    result_sets, texts = [], []
+    for i in range(n):
+        k = 0 if i % 97 == 0 else rng.randint(1, top_k)
+        result_sets.append({'results': [
+            {
+                'similarity_score': rng.uniform(0.1, 0.4),
+                'captions': [make_sentence(rng).rstrip('.!?').lower() for _ in range(5)]
+            }
+            for _ in range(k)
+        ]})
+        texts.append(" ".join(make_sentence(rng) for _ in range(rng.randint(0, 5))))
+    return result_sets, texts
+
+
+def best_of(func, repeats: int):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+def run_benchmark(n: int, top_k: int, repeats: int) -> dict:
+    calc = MetricsCalculator()
+    result_sets, texts = make_dataset(n, top_k)
+
+    scores = [[r['similarity_score'] for r in rs['results']] for rs in result_sets]
+    captions = [[c for r in rs['results'] for c in r['captions']] for rs in result_sets]
+
+    single_retrieval, single_retrieval_time = best_of(
+        lambda: [calc.calculate_retrieval_metrics(rs) for rs in result_sets], repeats
+    )
+    batch_retrieval, batch_retrieval_time = best_of(
+        lambda: calc.batch_to_list(calc.calculate_retrieval_metrics_batch(scores, captions)), repeats
+    )
+    single_text, single_text_time = best_of(
+        lambda: [calc.calculate_text_metrics(text) for text in texts], repeats
+    )
+    batch_text, batch_text_time = best_of(
+        lambda: calc.batch_to_list(calc.calculate_text_metrics_batch(texts)), repeats
+    )
+
+    if batch_retrieval != single_retrieval:
+        raise AssertionError("Batch retrieval metrics differ from the single-item results")
+    if batch_text != single_text:
+        raise AssertionError("Batch text metrics differ from the single-item results")
+
+    return {
+        'items': n,
+        'top_k': top_k,
+        'retrieval_single_s': single_retrieval_time,
+        'retrieval_batch_s': batch_retrieval_time,
+        'retrieval_speedup': single_retrieval_time / batch_retrieval_time,
+        'text_single_s': single_text_time,
+        'text_batch_s': batch_text_time,
+        'text_speedup': single_text_time / batch_text_time
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark MetricsCalculator batch APIs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--top_k", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", type=str, default="experiments/metrics_benchmark.json")
+
+    args = parser.parse_args()
+
+    all_results = []
+    for n in args.sizes:
+        result = run_benchmark(n, args.top_k, args.repeats)
+        all_results.append(result)
+        print(
+            f"n={n:<7} retrieval {result['retrieval_single_s'] * 1000:8.1f}ms -> "
+            f"{result['retrieval_batch_s'] * 1000:7.1f}ms ({result['retrieval_speedup']:.1f}x)  "
+            f"text {result['text_single_s'] * 1000:8.1f}ms -> "
+            f"{result['text_batch_s'] * 1000:7.1f}ms ({result['text_speedup']:.1f}x)  identical"
+        )
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(all_results, f, indent=2)
+    print(f"\nResults saved to {output}")
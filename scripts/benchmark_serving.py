@@ -0,0 +1,115 @@
+"""
+Serving Throughput Benchmark
+Compares the Flask dev server with the prefork production server on /api/search/text
+
+Start each server, then point this script at it:
+    python backend/app.py                               # dev server on :5000
+    python backend/serve.py --workers 4 --port 5001     # production server
+    python scripts/benchmark_serving.py --url http://localhost:5000 --label dev
+    python scripts/benchmark_serving.py --url http://localhost:5001 --label prefork
+"""
+
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+
+QUERIES = [
+    "a dog playing in the park",
+    "a man riding a wave on a surfboard",
+    "a plate of food on a table",
+    "a red bus on a city street",
+    "two cats sleeping on a couch",
+    "a kitchen with white cabinets",
+    "people skiing down a snowy slope",
+    "a train at a station platform"
+]
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q / 100.0 * len(samples)))]
+
+
+def run_benchmark(url: str, num_requests: int, concurrency: int, top_k: int, warmup: int) -> dict:
+    """
+    Send text search requests and measure throughput and latency
+
+    Args:
+        url: Server base URL
+        num_requests: Measured requests
+        concurrency: Concurrent clients
+        top_k: Results per search
+        warmup: Unmeasured requests sent first
+
+    Returns:
+        Dictionary with throughput and latency percentiles
+    """
+    session = requests.Session()
+    endpoint = f"{url}/api/search/text"
+
+    def one_request(i):
+        start = time.perf_counter()
+        response = session.post(endpoint, json={'query': QUERIES[i % len(QUERIES)], 'top_k': top_k}, timeout=120)
+        return time.perf_counter() - start, response.status_code == 200
+
+    for i in range(warmup):
+        one_request(i)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one_request, range(num_requests)))
+    wall_time = time.perf_counter() - start
+
+    latencies = [latency for latency, ok in outcomes if ok]
+    return {
+        'requests': num_requests,
+        'concurrency': concurrency,
+        'errors': sum(1 for _, ok in outcomes if not ok),
+        'wall_time': wall_time,
+        'throughput_rps': len(latencies) / wall_time if wall_time else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark API serving throughput")
+    parser.add_argument("--url", type=str, default="http://localhost:5000")
+    parser.add_argument("--label", type=str, default="server", help="Name for this run in the results file")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--top_k", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--output", type=str, default="experiments/serving_benchmark.json")
+
+    args = parser.parse_args()
+
+    runs = []
+    for concurrency in args.concurrency:
+        result = run_benchmark(args.url, args.requests, concurrency, args.top_k, args.warmup)
+        result['label'] = args.label
+        runs.append(result)
+        print(f"[{args.label}] c={concurrency:<3} {result['throughput_rps']:7.1f} req/s  "
+              f"p50={result['p50_ms']:.0f}ms p95={result['p95_ms']:.0f}ms p99={result['p99_ms']:.0f}ms "
+              f"errors={result['errors']}")
+
+    # Append to a shared results file so dev and prefork runs can be compared side by side
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    previous = json.loads(output.read_text()) if output.exists() else []
+    output.write_text(json.dumps(previous + runs, indent=2))
+
+    labels = sorted({r['label'] for r in previous + runs})
+    if len(labels) > 1:
+        print("\nComparison (max throughput per server):")
+        for label in labels:
+            best = max((r for r in previous + runs if r['label'] == label), key=lambda r: r['throughput_rps'])
+            print(f"  {label:<10} {best['throughput_rps']:7.1f} req/s at c={best['concurrency']}")
@@ -0,0 +1,50 @@
+"""
+History Retention
+Archive and delete old history queries, then reclaim database space
+
+    python scripts/history_retention.py --max_age_days 90 --max_queries 50000
+    python scripts/history_retention.py --vacuum        # once, for databases created before auto-vacuum
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.utils.history_manager import HistoryManager
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the history retention policy")
+    parser.add_argument("--db_path", type=str, default="history/queries.db")
+    parser.add_argument("--max_age_days", type=float, default=None,
+                        help="Delete queries older than this (default: HISTORY_RETENTION_DAYS)")
+    parser.add_argument("--max_queries", type=int, default=None,
+                        help="Keep only the newest N queries (default: HISTORY_MAX_QUERIES)")
+    parser.add_argument("--no_archive", action="store_true",
+                        help="Delete without writing Parquet/Arrow archive files")
+    parser.add_argument("--batch_size", type=int, default=500)
+    parser.add_argument("--vacuum", action="store_true",
+                        help="Rewrite the database afterwards (blocks writers)")
+
+    args = parser.parse_args()
+
+    manager = HistoryManager(args.db_path, write_behind=False)
+    summary = manager.apply_retention(
+        max_age_days=args.max_age_days,
+        max_queries=args.max_queries,
+        archive=False if args.no_archive else None,
+        batch_size=args.batch_size
+    )
+    print(f"Deleted queries: {summary['deleted']}")
+    print(f"Orphaned results removed: {summary['orphaned_results']}")
+    print(f"Pages freed: {summary['pages_freed']}")
+    for path in summary['archive_files']:
+        print(f"  Archived: {path}")
+
+    if args.vacuum:
+        size_before = Path(args.db_path).stat().st_size
+        manager.vacuum()
+        print(f"Vacuumed: {size_before / 1e6:.1f}MB -> {Path(args.db_path).stat().st_size / 1e6:.1f}MB")
+    manager.close()
@@ -0,0 +1,80 @@
+"""
+Load test for the Stable Diffusion API server
+Fires concurrent ImageGenerator API-mode requests and reports latency/throughput
+"""
+
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.models.image_generator import ImageGenerator
+
+
+def run_load_test(api_url: str, num_requests: int, concurrency: int, steps: int, size: int):
+    """
+    Send num_requests prompts with the given concurrency and print a summary
+
+    Args:
+        api_url: Base URL of the SD server
+        num_requests: Total number of prompts
+        concurrency: Number of concurrent clients
+        steps: num_inference_steps per request
+        size: Image height and width
+    """
+    generator = ImageGenerator(use_local=False, api_url=api_url)
+
+    def one_request(i):
+        start = time.time()
+        image = generator.txt2img(
+            f"load test prompt {i}, a dog playing in the park",
+            num_inference_steps=steps,
+            height=size,
+            width=size
+        )
+        return time.time() - start, image is not None
+
+    print(f"Sending {num_requests} requests with concurrency {concurrency} to {api_url}")
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one_request, range(num_requests)))
+    wall_time = time.time() - start
+
+    latencies = sorted(latency for latency, ok in outcomes if ok)
+    failures = sum(1 for _, ok in outcomes if not ok)
+
+    print("\n" + "=" * 50)
+    print("LOAD TEST RESULTS")
+    print("=" * 50)
+    print(f"Succeeded:   {len(latencies)}/{num_requests} ({failures} failed)")
+    print(f"Wall time:   {wall_time:.2f}s")
+    print(f"Throughput:  {len(latencies) / wall_time:.2f} images/s")
+    if latencies:
+        print(f"Latency p50: {latencies[len(latencies) // 2]:.3f}s")
+        print(f"Latency p95: {latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]:.3f}s")
+        print(f"Latency max: {latencies[-1]:.3f}s")
+
+    try:
+        server_stats = requests.get(f"{api_url}/metrics", timeout=5).json()
+        print(f"Server avg batch size: {server_stats['avg_batch_size']:.2f}")
+        print(f"Server avg queue wait: {server_stats['avg_queue_wait']:.3f}s")
+    except Exception as e:
+        print(f"Could not fetch server metrics: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the SD generation server")
+    parser.add_argument("--api_url", type=str, default="http://localhost:7860")
+    parser.add_argument("--num_requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--size", type=int, default=256)
+
+    args = parser.parse_args()
+
+    run_load_test(args.api_url, args.num_requests, args.concurrency, args.steps, args.size)
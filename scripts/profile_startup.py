@@ -0,0 +1,85 @@
+"""
+Startup Import Profile
+Runs `python -X importtime` on the backend and reports the slowest imports
+
+Exit code is 1 when total import time exceeds --budget_ms, so startup
+regressions (e.g. torch creeping back into module-level imports) are caught.
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+
+ROOT = Path(__file__).parent.parent
+
+# Modules that must only be imported lazily, on first use of a component
+HEAVY_MODULES = ['torch', 'transformers', 'diffusers', 'faiss', 'openai', 'groq', 'google.generativeai']
+
+
+def profile_imports(module: str = "app", cwd: Path = ROOT / "backend"):
+    """
+    Import a module under -X importtime in a fresh interpreter
+
+    Args:
+        module: Module to import
+        cwd: Working directory for the import
+
+    Returns:
+        List of (cumulative_us, self_us, module_name) tuples
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=str(cwd),
+        capture_output=True,
+        text=True
+    )
+    if proc.returncode != 0:
+        print(proc.stderr[-2000:])
+        raise SystemExit(f"Importing {module} failed")
+
+    entries = []
+    pattern = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\| (.*)$")
+    for line in proc.stderr.splitlines():
+        match = pattern.match(line)
+        if match:
+            self_us, cumulative_us, name = int(match.group(1)), int(match.group(2)), match.group(3)
+            entries.append((cumulative_us, self_us, name.rstrip()))
+    return entries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile backend import time")
+    parser.add_argument("--module", type=str, default="app")
+    parser.add_argument("--top", type=int, default=20, help="Number of slowest imports to show")
+    parser.add_argument("--budget_ms", type=float, default=1500.0, help="Fail if total import time exceeds this")
+
+    args = parser.parse_args()
+
+    entries = profile_imports(args.module)
+
+    # Top-level entries (no leading indentation) sum to the total import time
+    top_level = [e for e in entries if not e[2].startswith(" ")]
+    total_ms = sum(e[0] for e in top_level) / 1000.0
+
+    print("=" * 60)
+    print(f"IMPORT PROFILE: {args.module}")
+    print("=" * 60)
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for cumulative_us, self_us, name in sorted(entries, reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:10.1f}ms {self_us / 1000:8.1f}ms  {name}")
+
+    loaded = {e[2].strip() for e in entries}
+    eager_heavy = [m for m in HEAVY_MODULES if m in loaded]
+
+    print("-" * 60)
+    print(f"Total import time: {total_ms:.1f}ms (budget {args.budget_ms:.0f}ms)")
+    if eager_heavy:
+        print(f"Heavy modules imported eagerly: {', '.join(eager_heavy)}")
+
+    if total_ms > args.budget_ms or eager_heavy:
+        print("❌ Startup regression")
+        raise SystemExit(1)
+    print("✅ Startup within budget")
@@ -9,6 +9,18 @@ from PIL import Image
 import numpy as np
 from typing import Union, List
 import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from src.utils.tracing import span
+from src.utils.telemetry import registry
+
+
+ENCODE_SECONDS = registry.histogram('clip_encode_seconds', 'CLIP encode latency per call', ['kind'])
+ENCODED_ITEMS = registry.counter('clip_encoded_items_total', 'Texts/images encoded by CLIP', ['kind'])
 
 
 class CLIPEncoder:
@@ -42,17 +54,21 @@ class CLIPEncoder:
         """
         if isinstance(texts, str):
             texts = [texts]
+        ENCODED_ITEMS.labels(kind='text').inc(len(texts))
             
-        with torch.no_grad():
-            inputs = self.processor(text=texts, return_tensors="pt", padding=True, truncation=True)
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        with ENCODE_SECONDS.labels(kind='text').time(), torch.no_grad():
+            with span('clip.tokenize', batch=len(texts)):
+                inputs = self.processor(text=texts, return_tensors="pt", padding=True, truncation=True)
+                inputs = {k: v.to(self.device) for k, v in inputs.items()}
             
-            text_features = self.model.get_text_features(**inputs)
+            with span('clip.text_forward', batch=len(texts)):
+                text_features = self.model.get_text_features(**inputs)
+                
+                # Normalize embeddings
+                text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+                text_features = text_features.cpu().numpy()
             
-            # Normalize embeddings
-            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
-            
-        return text_features.cpu().numpy()
+        return text_features
     
     def encode_image(self, images: Union[str, Image.Image, List[Union[str, Image.Image]]]) -> np.ndarray:
         """
@@ -66,25 +82,32 @@ class CLIPEncoder:
         """
         if not isinstance(images, list):
             images = [images]
+        ENCODED_ITEMS.labels(kind='image').inc(len(images))
+        start = time.perf_counter()
             
         # Load images if paths are provided
-        pil_images = []
-        for img in images:
-            if isinstance(img, str):
-                pil_images.append(Image.open(img).convert("RGB"))
-            else:
-                pil_images.append(img)
+        with span('clip.load_images', batch=len(images)):
+            pil_images = []
+            for img in images:
+                if isinstance(img, str):
+                    pil_images.append(Image.open(img).convert("RGB"))
+                else:
+                    pil_images.append(img)
         
         with torch.no_grad():
-            inputs = self.processor(images=pil_images, return_tensors="pt", padding=True)
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            image_features = self.model.get_image_features(**inputs)
+            with span('clip.preprocess', batch=len(pil_images)):
+                inputs = self.processor(images=pil_images, return_tensors="pt", padding=True)
+                inputs = {k: v.to(self.device) for k, v in inputs.items()}
             
-            # Normalize embeddings
-            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-            
-        return image_features.cpu().numpy()
+            with span('clip.image_forward', batch=len(pil_images)):
+                image_features = self.model.get_image_features(**inputs)
+                
+                # Normalize embeddings
+                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+                image_features = image_features.cpu().numpy()
+        
+        ENCODE_SECONDS.labels(kind='image').observe(time.perf_counter() - start)
+        return image_features
     
     def encode_images_batch(self, image_paths: List[str], batch_size: int = 32) -> np.ndarray:
         """
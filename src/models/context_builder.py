@@ -4,12 +4,46 @@ Combines user query with retrieved captions to create LLM context
 Optimized for longer, more detailed descriptions
 """
 
-from typing import List, Dict
+import re
+import sys
+import numpy as np
+from pathlib import Path
+from typing import List, Dict, Optional
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from src.utils.tracing import traced
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate LLM token count (words and punctuation, ~1.3 tokens per word piece)
+    
+    Args:
+        text: Input text
+        
+    Returns:
+        Approximate token count
+    """
+    pieces = re.findall(r"\w+|[^\w\s]", text)
+    return int(round(len(pieces) * 1.3))
+
+
+def _normalize_caption(caption: str) -> str:
+    return " ".join(re.findall(r"\w+", caption.lower()))
 
 
 class ContextBuilder:
-    def __init__(self):
-        """Initialize context builder"""
+    def __init__(self, encoder=None):
+        """
+        Initialize context builder
+        
+        Args:
+            encoder: Optional CLIPEncoder used for caption similarity in
+                     build_budgeted_context (falls back to lexical similarity)
+        """
+        self.encoder = encoder
+        
         # System message for detailed descriptions
         self.system_template = """You are an expert image description assistant. Create rich, detailed, and engaging descriptions based on the captions provided."""
         
@@ -58,6 +92,179 @@ Description:"""
             'user': user_message
         }
     
+    def _similarity_matrix(self, query: str, captions: List[str]):
+        """
+        Cosine similarities between captions, and of each caption to the query
+        
+        Uses one batched CLIP text encoding pass when an encoder is available,
+        otherwise bag-of-words vectors.
+        
+        Returns:
+            Tuple of (caption x caption similarity matrix, query similarity vector or None)
+        """
+        if self.encoder is not None:
+            embeddings = self.encoder.encode_text([query] + captions)
+            sims = embeddings @ embeddings.T
+            return sims[1:, 1:], sims[0, 1:]
+        
+        vocab = {}
+        rows = []
+        for caption in captions:
+            row = {}
+            for word in _normalize_caption(caption).split():
+                idx = vocab.setdefault(word, len(vocab))
+                row[idx] = row.get(idx, 0) + 1
+            rows.append(row)
+        
+        vectors = np.zeros((len(captions), max(len(vocab), 1)), dtype=np.float32)
+        for i, row in enumerate(rows):
+            for idx, count in row.items():
+                vectors[i, idx] = count
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-8)
+        
+        return vectors @ vectors.T, None
+    
+    def assemble_captions(
+        self,
+        query: str,
+        captions: List[str],
+        relevance: Optional[List[float]] = None,
+        groups: Optional[List[int]] = None,
+        token_budget: int = 120,
+        max_captions: int = 8,
+        dedup_threshold: float = 0.9,
+        mmr_lambda: float = 0.7
+    ) -> Dict:
+        """
+        Select a de-duplicated, diverse subset of captions within a token budget
+        
+        Args:
+            query: User query
+            captions: Retrieved captions, best results first
+            relevance: Optional per-caption relevance (e.g. result similarity score);
+                       defaults to query similarity, or retrieval order
+            groups: Optional per-caption result index; each result first gets its most
+                    relevant caption (if it fits and isn't a near-duplicate), then the
+                    rest of the budget is filled by MMR
+            token_budget: Maximum estimated tokens for the selected captions
+            max_captions: Maximum number of captions to select
+            dedup_threshold: Captions this similar to a selected one are dropped
+            mmr_lambda: MMR trade-off, 1.0 = relevance only, 0.0 = diversity only
+            
+        Returns:
+            Dictionary with 'captions', 'token_count', 'duplicates_removed' and 'candidates'
+        """
+        # Exact duplicates (ignoring case and punctuation) never need embedding
+        unique, unique_relevance, unique_groups, seen = [], [], [], set()
+        for i, caption in enumerate(captions):
+            key = _normalize_caption(caption)
+            if key and key not in seen:
+                seen.add(key)
+                unique.append(caption)
+                unique_relevance.append(relevance[i] if relevance is not None else None)
+                unique_groups.append(groups[i] if groups is not None else None)
+        
+        if not unique:
+            return {'captions': [], 'token_count': 0, 'duplicates_removed': len(captions), 'candidates': len(captions)}
+        
+        sims, query_sims = self._similarity_matrix(query, unique)
+        
+        if relevance is not None:
+            rel = np.asarray(unique_relevance, dtype=np.float32)
+        elif query_sims is not None:
+            rel = np.asarray(query_sims, dtype=np.float32)
+        else:
+            rel = 1.0 - np.arange(len(unique), dtype=np.float32) / len(unique)
+        
+        tokens = [estimate_tokens(c) for c in unique]
+        selected = []
+        available = np.ones(len(unique), dtype=bool)
+        max_sim = np.zeros(len(unique), dtype=np.float32)
+        used_tokens = 0
+        near_duplicates = 0
+        
+        if groups is not None:
+            # One caption per retrieved result, best results first, before MMR
+            members = {}
+            for i, group in enumerate(unique_groups):
+                members.setdefault(group, []).append(i)
+            tie_break = query_sims if query_sims is not None else np.zeros(len(unique))
+            for indices in members.values():
+                if len(selected) >= max_captions:
+                    break
+                for i in sorted(indices, key=lambda i: (-rel[i], -tie_break[i], i)):
+                    if selected and max_sim[i] >= dedup_threshold:
+                        continue
+                    if used_tokens + tokens[i] > token_budget:
+                        continue
+                    selected.append(i)
+                    available[i] = False
+                    used_tokens += tokens[i]
+                    max_sim = np.maximum(max_sim, sims[i])
+                    break
+        
+        while len(selected) < max_captions and available.any():
+            scores = mmr_lambda * rel - (1.0 - mmr_lambda) * max_sim
+            scores[~available] = -np.inf
+            best = int(np.argmax(scores))
+            available[best] = False
+            
+            if selected and max_sim[best] >= dedup_threshold:
+                near_duplicates += 1
+                continue
+            if used_tokens + tokens[best] > token_budget:
+                continue
+            
+            selected.append(best)
+            used_tokens += tokens[best]
+            max_sim = np.maximum(max_sim, sims[best])
+        
+        # Keep retrieval order in the prompt
+        selected.sort()
+        
+        return {
+            'captions': [unique[i] for i in selected],
+            'token_count': used_tokens,
+            'duplicates_removed': (len(captions) - len(unique)) + near_duplicates,
+            'candidates': len(captions)
+        }
+    
+    @traced('context.build')
+    def build_budgeted_context(
+        self,
+        query: str,
+        captions: List[str],
+        relevance: Optional[List[float]] = None,
+        groups: Optional[List[int]] = None,
+        token_budget: int = 120,
+        **kwargs
+    ) -> Dict:
+        """
+        Build LLM context from a de-duplicated, token-budgeted caption selection
+        
+        Args:
+            query: User query
+            captions: Retrieved captions (e.g. from Retriever.get_captions_from_results)
+            relevance: Optional per-caption relevance scores
+            groups: Optional per-caption result index (at least one caption per result)
+            token_budget: Maximum estimated tokens for the captions block
+            **kwargs: Passed to assemble_captions
+            
+        Returns:
+            Dictionary with system and user messages, plus 'token_count'
+            (estimated prompt tokens) and 'caption_selection' details
+        """
+        selection = self.assemble_captions(
+            query, captions, relevance=relevance, groups=groups, token_budget=token_budget, **kwargs
+        )
+        
+        context = self.build_context(query, selection['captions'], max_captions=len(selection['captions']))
+        context['token_count'] = estimate_tokens(context['system']) + estimate_tokens(context['user'])
+        context['caption_selection'] = selection
+        
+        return context
+    
     def build_image_generation_prompt(self, query: str, captions: List[str], max_captions: int = 5) -> str:
         """
         Build prompt for image generation
@@ -97,5 +304,9 @@ if __name__ == "__main__":
     print("System:", context['system'])
     print("\nUser:", context['user'])
     
+    budgeted = builder.build_budgeted_context(query, captions + ["A brown dog playing with a ball in the park."])
+    print(f"\nBudgeted context: {budgeted['token_count']} tokens, "
+          f"{budgeted['caption_selection']['duplicates_removed']} duplicates removed")
+    
     img_prompt = builder.build_image_generation_prompt(query, captions)
     print("\nImage prompt:", img_prompt)
@@ -0,0 +1,421 @@
+"""
+CLIP Encoder Service
+One process owns CLIPEncoder and serves batched encode requests from web workers
+
+Requests travel over a Unix socket (a named pipe on Windows); embeddings are written
+into a shared-memory ring buffer owned by the calling thread, so they come back as
+zero-copy NumPy views instead of being serialised.
+
+Usage:
+    python -m src.models.encoder_service --address /tmp/clip-encoder.sock
+    ENCODER_ADDRESS=/tmp/clip-encoder.sock python backend/serve.py
+"""
+
+import argparse
+import itertools
+import os
+import queue
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from typing import Dict, List, Union
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from src.utils.deadline import Deadline, NO_DEADLINE
+from src.utils.tracing import span
+from src.utils.telemetry import registry
+
+
+REQUEST_SECONDS = registry.histogram(
+    'encoder_service_request_seconds', 'Round trip to the encoder service, including batching wait', ['kind']
+)
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Attach to a client's block without letting this process's tracker unlink it"""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    return shm
+
+
+class EncoderServer:
+    """Serves encode_text/encode_image requests, batching across all connected clients"""
+
+    def __init__(
+        self,
+        address: str,
+        model_name: str = "openai/clip-vit-base-patch32",
+        device: str = None,
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5.0,
+        authkey: bytes = None,
+        slot_items: int = 64
+    ):
+        """
+        Initialize encoder server
+
+        Args:
+            address: Unix socket path (or \\\\.\\pipe\\name on Windows)
+            model_name: CLIP model name
+            device: Device for CLIP (default: cuda if available)
+            max_batch_size: Maximum texts/images per forward pass
+            max_wait_ms: How long to wait for more requests before running a batch
+            authkey: Shared secret for client connections
+            slot_items: Most rows written into a client's shared memory per reply
+                        (bounded by the client's own slot size; larger replies go inline)
+        """
+        from src.models.clip_encoder import CLIPEncoder
+
+        self.address = address
+        self.encoder = CLIPEncoder(model_name=model_name, device=device)
+        self.embedding_dim = self.encoder.embedding_dim
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.slot_bytes = slot_items * self.embedding_dim * 4
+        self.authkey = authkey or os.getenv("ENCODER_AUTHKEY", "clip-encoder").encode()
+
+        self.requests = queue.Queue()
+        # Attached client blocks, per connection; closed when that client disconnects
+        self._segments: Dict[object, Dict[str, shared_memory.SharedMemory]] = {}
+        self._segments_lock = threading.Lock()
+        self.stats = {'requests': 0, 'batches': 0, 'items': 0, 'encode_seconds': 0.0}
+
+    def _segment(self, conn, name: str) -> shared_memory.SharedMemory:
+        """A connection's attached block (caller holds _segments_lock)"""
+        segments = self._segments.get(conn)
+        if segments is None:
+            raise OSError("client disconnected")
+        if name not in segments:
+            segments[name] = _attach_shared_memory(name)
+        return segments[name]
+
+    def _release_segments(self, conn):
+        with self._segments_lock:
+            segments = self._segments.pop(conn, {})
+        for segment in segments.values():
+            segment.close()
+
+    def _read_requests(self, conn):
+        """Per-connection thread: forward requests to the batcher"""
+        with self._segments_lock:
+            self._segments[conn] = {}
+        try:
+            while True:
+                kind, items, shm_name, offset, slot_bytes = conn.recv()
+                self.requests.put((conn, kind, items, (shm_name, offset, slot_bytes)))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+            self._release_segments(conn)
+
+    def _collect_batch(self, first) -> List:
+        """Gather queued requests of the same kind up to max_batch_size items"""
+        batch = [first]
+        count = len(first[2])
+        deadline = time.monotonic() + self.max_wait
+        deferred = []
+
+        while count < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                req = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if req[1] == first[1] and count + len(req[2]) <= self.max_batch_size:
+                batch.append(req)
+                count += len(req[2])
+            else:
+                deferred.append(req)
+
+        for req in deferred:
+            self.requests.put(req)
+        return batch
+
+    def _send(self, conn, message):
+        """Send to one client; a client that has gone away never affects the others"""
+        try:
+            conn.send(message)
+        except Exception as e:
+            print(f"Error replying to client: {e}")
+
+    def _reply(self, conn, embeddings: np.ndarray, target):
+        shm_name, offset, client_slot_bytes = target
+        written = False
+        if embeddings.nbytes <= min(self.slot_bytes, client_slot_bytes):
+            # Held while writing so a disconnect can't close the block under us
+            with self._segments_lock:
+                segment = self._segment(conn, shm_name)
+                if offset + embeddings.nbytes <= segment.size:
+                    view = np.ndarray(embeddings.shape, dtype=np.float32, buffer=segment.buf, offset=offset)
+                    view[:] = embeddings
+                    del view
+                    written = True
+        # Larger than the client's ring slot: fall back to sending the array
+        self._send(conn, ('shm', embeddings.shape) if written else ('inline', embeddings))
+
+    def _run_batch(self, batch: List):
+        kind = batch[0][1]
+
+        if kind == 'info':
+            for conn, _, _, _ in batch:
+                self._send(conn, ('info', {'embedding_dim': self.embedding_dim, 'stats': dict(self.stats)}))
+            return
+
+        items = [item for req in batch for item in req[2]]
+        start = time.monotonic()
+        try:
+            if kind == 'text':
+                embeddings = self.encoder.encode_text(items)
+            else:
+                embeddings = self.encoder.encode_image(items)
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        except Exception as e:
+            for conn, _, _, _ in batch:
+                self._send(conn, ('error', str(e)))
+            return
+
+        self.stats['requests'] += len(batch)
+        self.stats['batches'] += 1
+        self.stats['items'] += len(items)
+        self.stats['encode_seconds'] += time.monotonic() - start
+
+        offset = 0
+        for conn, _, req_items, target in batch:
+            try:
+                self._reply(conn, embeddings[offset:offset + len(req_items)], target)
+            except Exception as e:
+                print(f"Error replying to client: {e}")
+                self._send(conn, ('error', str(e)))
+            offset += len(req_items)
+
+    def _batch_loop(self):
+        while True:
+            batch = [self.requests.get()]
+            try:
+                batch = self._collect_batch(batch[0])
+                self._run_batch(batch)
+            except Exception as e:
+                # Keep serving: one bad batch must not leave every client waiting forever
+                print(f"Encoder batch failed: {e}")
+                for conn, _, _, _ in batch:
+                    self._send(conn, ('error', str(e)))
+
+    def serve_forever(self):
+        """Accept client connections until interrupted"""
+        if os.name != 'nt' and os.path.exists(self.address):
+            os.unlink(self.address)
+
+        listener = Listener(self.address, authkey=self.authkey)
+        threading.Thread(target=self._batch_loop, name="encoder-batcher", daemon=True).start()
+        print(f"Encoder service listening on {self.address} (dim={self.embedding_dim})")
+
+        try:
+            while True:
+                conn = listener.accept()
+                threading.Thread(target=self._read_requests, args=(conn,), daemon=True).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+            for conn in list(self._segments):
+                self._release_segments(conn)
+
+
+class _Channel:
+    """
+    One connection plus a shared-memory ring buffer the server writes results into.
+    Each call uses the next slot, so a returned view stays valid for the following
+    ring_slots - 1 calls made by the same thread.
+    """
+
+    def __init__(self, address: str, authkey: bytes, slot_bytes: int, ring_slots: int):
+        self.conn = Client(address, authkey=authkey)
+        self.shm = shared_memory.SharedMemory(create=True, size=slot_bytes * ring_slots)
+        self.slot_bytes = slot_bytes
+        self.ring_slots = ring_slots
+        self.next_slot = 0
+
+    def claim_slot(self) -> int:
+        """Byte offset of the next ring slot"""
+        offset = self.next_slot * self.slot_bytes
+        self.next_slot = (self.next_slot + 1) % self.ring_slots
+        return offset
+
+    def close(self):
+        self.conn.close()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class RemoteCLIPEncoder:
+    """
+    Drop-in replacement for CLIPEncoder backed by one or more EncoderServer processes.
+    Every thread gets its own channel, so requests from all threads of all workers
+    are batched together by the server.
+
+    Returned arrays are views into shared memory. They stay valid for the next
+    ring_slots - 1 encode calls on the same thread; copy them to keep them longer.
+    """
+
+    def __init__(
+        self,
+        addresses: Union[str, List[str]],
+        authkey: bytes = None,
+        slot_items: int = 64,
+        ring_slots: int = 4,
+        timeout: float = None
+    ):
+        """
+        Initialize remote encoder
+
+        Args:
+            addresses: Server address, or several to spread threads round-robin
+            authkey: Shared secret (default: ENCODER_AUTHKEY env var)
+            slot_items: Rows per ring slot (larger replies come back inline)
+            ring_slots: Slots per thread's ring buffer
+            timeout: Seconds to wait for a reply (default: ENCODER_TIMEOUT env var, 30)
+        """
+        if isinstance(addresses, str):
+            addresses = [a.strip() for a in addresses.split(',') if a.strip()]
+        self.addresses = addresses
+        self.authkey = authkey or os.getenv("ENCODER_AUTHKEY", "clip-encoder").encode()
+        self.slot_items = slot_items
+        self.ring_slots = ring_slots
+        self.timeout = timeout if timeout is not None else float(os.getenv("ENCODER_TIMEOUT", "30"))
+        self.device = "remote"
+
+        self._next_address = itertools.cycle(self.addresses)
+        self._local = threading.local()
+        self._channels: List[_Channel] = []
+        self._lock = threading.Lock()
+
+        # Ask the server for the dimension over a temporary channel sized for one row
+        probe = _Channel(self.addresses[0], self.authkey, 4, 1)
+        try:
+            probe.conn.send(('info', [], probe.shm.name, 0, probe.slot_bytes))
+            status, info = self._receive(probe, NO_DEADLINE)
+        finally:
+            probe.close()
+        self._embedding_dim = info['embedding_dim']
+
+    def _channel(self) -> _Channel:
+        channel = getattr(self._local, 'channel', None)
+        if channel is None:
+            with self._lock:
+                address = next(self._next_address)
+            channel = _Channel(address, self.authkey, self.slot_items * self._embedding_dim * 4, self.ring_slots)
+            self._local.channel = channel
+            with self._lock:
+                self._channels.append(channel)
+        return channel
+
+    def _receive(self, channel: _Channel, deadline: Deadline):
+        """Wait for the reply, at most self.timeout (capped by the deadline)"""
+        timeout = deadline.timeout(self.timeout)
+        if not channel.conn.poll(timeout):
+            raise TimeoutError(f"Encoder service did not reply within {timeout:.1f}s")
+        return channel.conn.recv()
+
+    def _request(self, kind: str, items: List, deadline: Deadline = None) -> np.ndarray:
+        with span(f'encoder_service.{kind}', batch=len(items)), REQUEST_SECONDS.labels(kind=kind).time():
+            return self._request_untraced(kind, items, deadline or NO_DEADLINE)
+
+    def _request_untraced(self, kind: str, items: List, deadline: Deadline) -> np.ndarray:
+        channel = self._channel()
+        offset = channel.claim_slot()
+        try:
+            channel.conn.send((kind, items, channel.shm.name, offset, channel.slot_bytes))
+            # A late reply would answer the next request, so a timeout drops the channel too
+            status, payload = self._receive(channel, deadline)
+        except Exception:
+            # Drop the broken channel; the next call on this thread reconnects
+            self._local.channel = None
+            with self._lock:
+                self._channels.remove(channel)
+            channel.close()
+            raise
+
+        if status == 'error':
+            raise RuntimeError(f"Encoder service error: {payload}")
+        if status == 'inline':
+            return payload
+        return np.ndarray(payload, dtype=np.float32, buffer=channel.shm.buf, offset=offset)
+
+    def encode_text(self, texts: Union[str, List[str]], deadline: Deadline = None) -> np.ndarray:
+        """Encode text(s) to normalized embeddings via the encoder service"""
+        if isinstance(texts, str):
+            texts = [texts]
+        return self._request('text', list(texts), deadline)
+
+    def encode_image(
+        self,
+        images: Union[str, Image.Image, List[Union[str, Image.Image]]],
+        deadline: Deadline = None
+    ) -> np.ndarray:
+        """Encode image(s) to normalized embeddings via the encoder service"""
+        if not isinstance(images, list):
+            images = [images]
+        # Paths are resolved by the server (same host); PIL images are sent as RGB
+        items = [img if isinstance(img, str) else img.convert("RGB") for img in images]
+        return self._request('image', items, deadline)
+
+    def encode_images_batch(self, image_paths: List[str], batch_size: int = 32) -> np.ndarray:
+        """Encode multiple images in batches"""
+        return np.vstack([
+            self.encode_image(image_paths[i:i + batch_size])
+            for i in range(0, len(image_paths), batch_size)
+        ])
+
+    @property
+    def embedding_dim(self) -> int:
+        """Get embedding dimension"""
+        return self._embedding_dim
+
+    def close(self):
+        """Close all channels and release shared memory"""
+        with self._lock:
+            for channel in self._channels:
+                channel.close()
+            self._channels.clear()
+        self._local = threading.local()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the CLIP encoder service")
+    parser.add_argument("--address", type=str, default=os.getenv("ENCODER_ADDRESS", "/tmp/clip-encoder.sock"))
+    parser.add_argument("--model", type=str, default="openai/clip-vit-base-patch32")
+    parser.add_argument("--device", type=str, default=None)
+    parser.add_argument("--max_batch_size", type=int, default=64)
+    parser.add_argument("--max_wait_ms", type=float, default=5.0)
+    parser.add_argument("--slot_items", type=int, default=64, help="Most rows written to a client's shared memory per reply")
+    parser.add_argument("--num_threads", type=int, default=None, help="torch threads for this process")
+
+    args = parser.parse_args()
+
+    if args.num_threads:
+        import torch
+        torch.set_num_threads(args.num_threads)
+
+    server = EncoderServer(
+        args.address,
+        model_name=args.model,
+        device=args.device,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        slot_items=args.slot_items
+    )
+    server.serve_forever()
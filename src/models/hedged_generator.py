@@ -0,0 +1,472 @@
+"""
+Hedged Text Generator
+Multi-provider LLM generation with hedged requests, fallback and latency-ranked providers
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from src.utils.deadline import Deadline, NO_DEADLINE
+from src.utils.tracing import run_in_context
+
+
+class ProviderStats:
+    """Rolling latency and error statistics for one provider"""
+
+    def __init__(self, window: int = 200):
+        """
+        Args:
+            window: Number of recent calls kept for latency percentiles
+        """
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.wins = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool):
+        with self._lock:
+            self.calls += 1
+            self.outcomes.append(ok)
+            if ok:
+                self.latencies.append(latency)
+            else:
+                self.errors += 1
+
+    def record_win(self):
+        with self._lock:
+            self.wins += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Latency percentile (0-100) over successful calls in the window"""
+        with self._lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        idx = min(len(samples) - 1, int(round(q / 100.0 * (len(samples) - 1))))
+        return samples[idx]
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            outcomes = list(self.outcomes)
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def score(self) -> float:
+        """
+        Expected cost of using this provider as primary (lower is better)
+
+        p95 latency inflated by the recent error rate; providers without
+        samples score 0 so they get tried and measured.
+        """
+        p95 = self.percentile(95)
+        if p95 is None:
+            return 0.0 if not self.outcomes else float('inf')
+        return p95 / max(1.0 - self.error_rate, 0.05)
+
+    def to_dict(self) -> Dict:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'wins': self.wins,
+            'error_rate': self.error_rate,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99)
+        }
+
+
+class MockProvider:
+    """Local stand-in for TextGenerator with configurable latency and failures"""
+
+    def __init__(
+        self,
+        name: str,
+        latency: float = 0.5,
+        jitter: float = 0.0,
+        tail_latency: float = 0.0,
+        tail_probability: float = 0.0,
+        error_rate: float = 0.0
+    ):
+        """
+        Args:
+            name: Provider name
+            latency: Base latency in seconds
+            jitter: Uniform random latency added on top
+            tail_latency: Extra latency for slow calls
+            tail_probability: Probability of a slow call
+            error_rate: Probability of returning a fallback (ok=False)
+        """
+        self.provider = name
+        self.model = f"mock-{name}"
+        self.latency = latency
+        self.jitter = jitter
+        self.tail_latency = tail_latency
+        self.tail_probability = tail_probability
+        self.error_rate = error_rate
+
+    def generate_with_status(
+        self,
+        system_message: str,
+        user_message: str,
+        bypass_cache: bool = False,
+        deadline: Deadline = None
+    ) -> Tuple[str, bool]:
+        delay = self.latency + random.uniform(0, self.jitter)
+        if random.random() < self.tail_probability:
+            delay += self.tail_latency
+        deadline = deadline or NO_DEADLINE
+        # Sleep in small steps so a cancelled (or expired) deadline ends the call early
+        finish = time.monotonic() + delay
+        while time.monotonic() < finish:
+            if deadline.expired():
+                return f"⚠️ API Error: {self.provider} timed out", False
+            time.sleep(min(0.01, max(0.0, finish - time.monotonic())))
+
+        if random.random() < self.error_rate:
+            return f"⚠️ API Error: {self.provider} unavailable", False
+        return f"[{self.provider}] description for: {user_message[:40]}", True
+
+    def generate_stream_with_status(
+        self,
+        system_message: str,
+        user_message: str,
+        bypass_cache: bool = False,
+        deadline: Deadline = None
+    ) -> Iterator[Tuple[str, Optional[bool]]]:
+        yield self.generate_with_status(system_message, user_message, deadline=deadline)
+
+    def generate_stream(
+        self,
+        system_message: str,
+        user_message: str,
+        bypass_cache: bool = False,
+        deadline: Deadline = None
+    ) -> Iterator[str]:
+        text, _ = self.generate_with_status(system_message, user_message, deadline=deadline)
+        yield text
+
+
+class _Attempt:
+    """One provider call of a hedged request, with its own cancellable deadline"""
+
+    __slots__ = ('generator', 'deadline', 'started_at')
+
+    def __init__(self, generator, deadline: Deadline):
+        self.generator = generator
+        self.deadline = deadline.derive()
+        self.started_at = None
+
+
+class HedgedTextGenerator:
+    """
+    Sends each request to the best-ranked provider and, if it has not answered
+    within hedge_delay of the call starting, fires the same request at the next
+    provider. The first successful answer wins. Losing calls are aborted: each
+    attempt streams under its own deadline, which is cancelled so the provider
+    stream is closed at its next chunk and the pool thread is freed (the time it
+    ran is recorded as a lower bound of its latency). Failed answers trigger the
+    next provider immediately.
+    """
+
+    # How often to check whether a queued attempt has started (its hedge timer starts then)
+    START_POLL_SECONDS = 0.01
+
+    def __init__(
+        self,
+        generators: List,
+        hedge_delay: Optional[float] = 1.0,
+        hedge_percentile: float = 95,
+        timeout: float = 60.0,
+        max_workers: int = 8
+    ):
+        """
+        Initialize hedged generator
+
+        Args:
+            generators: TextGenerator (or MockProvider) instances, one per provider
+            hedge_delay: Seconds to wait for the primary before hedging. None means
+                         adaptive: the primary's hedge_percentile latency
+            hedge_percentile: Percentile used for the adaptive hedge delay
+            timeout: Overall seconds to wait for any answer
+            max_workers: Thread pool size shared by all requests
+        """
+        if not generators:
+            raise ValueError("At least one generator is required")
+
+        self.generators = generators
+        self.hedge_delay = hedge_delay
+        self.hedge_percentile = hedge_percentile
+        self.timeout = timeout
+        self.stats = {self._name(g): ProviderStats() for g in generators}
+        self.hedges_fired = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge")
+
+        # Exposed for compatibility with TextGenerator callers
+        self.provider = "hedged"
+        self.model = ",".join(self._name(g) for g in generators)
+
+    @classmethod
+    def from_providers(cls, providers: List[str], **kwargs):
+        """
+        Build a hedged generator with one TextGenerator per provider
+
+        Each entry is 'provider' or 'provider:model'. Without a model, a provider uses
+        <PROVIDER>_MODEL, then LLM_MODEL if it is the first (primary) provider, then
+        its own default, so e.g. a Gemini LLM_MODEL is never sent to Groq.
+
+        Args:
+            providers: Provider entries, e.g. ['gemini', 'groq:llama-3.1-8b-instant']
+            **kwargs: Passed to HedgedTextGenerator
+
+        Returns:
+            HedgedTextGenerator, or a single TextGenerator (configured from the
+            environment) if no provider could be initialized
+        """
+        from src.models.text_generator import TextGenerator, DEFAULT_MODELS
+
+        generators = []
+        for i, entry in enumerate(providers):
+            provider, _, model = entry.partition(':')
+            model = (
+                model
+                or os.getenv(f"{provider.upper()}_MODEL")
+                or (os.getenv("LLM_MODEL") if i == 0 else None)
+                or DEFAULT_MODELS.get(provider)
+            )
+            try:
+                generators.append(TextGenerator(provider=provider, model=model))
+            except Exception as e:
+                print(f"Skipping provider {entry}: {e}")
+
+        if not generators:
+            print("No provider in LLM_PROVIDERS could be initialized; using a single TextGenerator")
+            return TextGenerator()
+        return cls(generators, **kwargs)
+
+    @staticmethod
+    def _name(generator) -> str:
+        return f"{generator.provider}/{generator.model}"
+
+    def ranked_generators(self) -> List:
+        """Generators ordered by expected latency, best first"""
+        return sorted(self.generators, key=lambda g: self.stats[self._name(g)].score())
+
+    def _hedge_delay_for(self, generator) -> float:
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        p = self.stats[self._name(generator)].percentile(self.hedge_percentile)
+        return p if p is not None else 1.0
+
+    def _call(self, attempt: _Attempt, system_message: str, user_message: str, bypass_cache: bool):
+        generator = attempt.generator
+        if attempt.deadline.cancelled:
+            # Lost before it left the queue
+            return generator, None, False
+        attempt.started_at = start = time.monotonic()
+
+        # Streamed so that cancelling the attempt's deadline stops it between chunks
+        chunks, ok = [], True
+        try:
+            stream = generator.generate_stream_with_status(
+                system_message, user_message, bypass_cache=bypass_cache, deadline=attempt.deadline
+            )
+            try:
+                for chunk, chunk_ok in stream:
+                    # A stream cut at the token limit (chunk_ok None) is still an answer
+                    if chunk_ok is False:
+                        ok = False
+                    chunks.append(chunk)
+            finally:
+                stream.close()
+            text = "".join(chunks)
+        except Exception as e:
+            text, ok = f"⚠️ API Error: {str(e)}", False
+
+        elapsed = time.monotonic() - start
+        if attempt.deadline.cancelled:
+            # Aborted loser: it took at least this long, and didn't fail
+            self.stats[self._name(generator)].record(elapsed, True)
+            return generator, text, False
+        self.stats[self._name(generator)].record(elapsed, ok)
+        return generator, text, ok
+
+    def _launch(self, attempt: _Attempt, system_message: str, user_message: str, bypass_cache: bool):
+        # run_in_context carries the request's trace into the pool threads
+        return self._executor.submit(
+            run_in_context(self._call), attempt, system_message, user_message, bypass_cache
+        )
+
+    @staticmethod
+    def _abort(running: Dict):
+        for future, attempt in running.items():
+            attempt.deadline.cancel()
+            future.cancel()
+
+    def generate_with_status(
+        self,
+        system_message: str,
+        user_message: str,
+        bypass_cache: bool = False,
+        deadline: Deadline = None
+    ) -> Tuple[str, bool]:
+        """
+        Generate text with hedging and fallback across providers
+
+        Args:
+            deadline: Request deadline, passed to every provider call and capping the overall wait
+
+        Returns:
+            Tuple of (text, ok); if every provider fails, the primary's fallback text
+        """
+        with self._lock:
+            self.requests += 1
+        deadline = deadline or NO_DEADLINE
+        timeout = deadline.timeout(self.timeout)
+        pending_generators = self.ranked_generators()
+        give_up_at = time.monotonic() + timeout
+
+        last = _Attempt(pending_generators.pop(0), deadline)
+        running = {self._launch(last, system_message, user_message, bypass_cache): last}
+        first_failure = None
+
+        while running:
+            now = time.monotonic()
+            if now >= give_up_at:
+                break
+
+            # The hedge timer runs from when the last call started, not from when it was queued
+            if not pending_generators:
+                wait_until = give_up_at
+            elif last.started_at is None:
+                wait_until = min(give_up_at, now + self.START_POLL_SECONDS)
+            else:
+                wait_until = min(give_up_at, last.started_at + self._hedge_delay_for(last.generator))
+            done, _ = wait(list(running), timeout=max(0.0, wait_until - now), return_when=FIRST_COMPLETED)
+
+            launch_next = False
+            for future in done:
+                running.pop(future)
+                generator, text, ok = future.result()
+                if ok:
+                    self.stats[self._name(generator)].record_win()
+                    self._abort(running)
+                    return text, True
+                if first_failure is None and text is not None:
+                    first_failure = text
+                launch_next = True
+
+            # Hedge on timeout, fall back immediately on failure
+            hedge_due = last.started_at is not None and \
+                time.monotonic() >= last.started_at + self._hedge_delay_for(last.generator)
+            if pending_generators and (launch_next or hedge_due):
+                if not launch_next:
+                    with self._lock:
+                        self.hedges_fired += 1
+                last = _Attempt(pending_generators.pop(0), deadline)
+                running[self._launch(last, system_message, user_message, bypass_cache)] = last
+
+        self._abort(running)
+
+        if first_failure is None:
+            first_failure = f"⚠️ API Error: no provider answered within {timeout:.1f}s"
+        return first_failure, False
+
+    def generate(
+        self,
+        system_message: str,
+        user_message: str,
+        bypass_cache: bool = False,
+        deadline: Deadline = None
+    ) -> str:
+        """Generate text using the fastest healthy provider"""
+        text, _ = self.generate_with_status(system_message, user_message, bypass_cache=bypass_cache, deadline=deadline)
+        return text
+
+    def generate_from_context(self, context: dict, bypass_cache: bool = False, deadline: Deadline = None) -> str:
+        """Generate text from context dictionary"""
+        return self.generate(context['system'], context['user'], bypass_cache=bypass_cache, deadline=deadline)
+
+    def generate_stream(
+        self,
+        system_message: str,
+        user_message: str,
+        bypass_cache: bool = False,
+        deadline: Deadline = None
+    ) -> Iterator[str]:
+        """Stream from the best-ranked provider (streams are not hedged)"""
+        generator = self.ranked_generators()[0]
+        start = time.monotonic()
+        ok = True
+        stream = generator.generate_stream_with_status(
+            system_message, user_message, bypass_cache=bypass_cache, deadline=deadline
+        )
+        try:
+            for chunk, chunk_ok in stream:
+                # A fallback or blocked answer counts against the provider; a stream
+                # cut at the token limit (chunk_ok None) does not
+                if chunk_ok is False:
+                    ok = False
+                if chunk:
+                    yield chunk
+        finally:
+            stream.close()
+        self.stats[self._name(generator)].record(time.monotonic() - start, ok)
+
+    def generate_stream_from_context(
+        self,
+        context: dict,
+        bypass_cache: bool = False,
+        deadline: Deadline = None
+    ) -> Iterator[str]:
+        """Stream generated text from context dictionary"""
+        return self.generate_stream(context['system'], context['user'], bypass_cache=bypass_cache, deadline=deadline)
+
+    def get_statistics(self) -> Dict:
+        """Per-provider latency/error stats plus hedge counters"""
+        with self._lock:
+            requests, hedges_fired = self.requests, self.hedges_fired
+        return {
+            'requests': requests,
+            'hedges_fired': hedges_fired,
+            'providers': {name: stats.to_dict() for name, stats in self.stats.items()}
+        }
+
+
+if __name__ == "__main__":
+    # Compare tail latency with and without hedging on mock providers
+    def run(generator, n=100):
+        latencies = []
+        for i in range(n):
+            start = time.monotonic()
+            generator.generate("system", f"query {i}")
+            latencies.append(time.monotonic() - start)
+        latencies.sort()
+        return latencies[n // 2], latencies[int(n * 0.99) - 1]
+
+    def providers():
+        return [
+            MockProvider("fast-but-spiky", latency=0.05, jitter=0.02, tail_latency=1.0, tail_probability=0.05),
+            MockProvider("steady", latency=0.12, jitter=0.02, error_rate=0.02)
+        ]
+
+    single = HedgedTextGenerator(providers()[:1], hedge_delay=None)
+    p50, p99 = run(single)
+    print(f"Single provider: p50={p50 * 1000:.0f}ms p99={p99 * 1000:.0f}ms")
+
+    hedged = HedgedTextGenerator(providers(), hedge_delay=0.15)
+    p50, p99 = run(hedged)
+    print(f"Hedged (150ms):  p50={p50 * 1000:.0f}ms p99={p99 * 1000:.0f}ms")
+    print(hedged.get_statistics())
@@ -4,21 +4,96 @@ Supports local generation and API endpoints
 """
 
 import os
+import sys
+import time
 import requests
+from collections import deque
 from PIL import Image
 from io import BytesIO
-from typing import Optional, Union
+from pathlib import Path
+from typing import Optional, Tuple, Union
 from dotenv import load_dotenv
 
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from src.utils.deadline import Deadline, NO_DEADLINE
+from src.utils.tracing import span
+from src.utils.telemetry import registry
+
 load_dotenv()
 
+# SD latency spans seconds to minutes, so use wider buckets than the defaults
+GENERATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300)
+GENERATIONS = registry.counter(
+    'sd_generations_total', 'Image generations by backend and outcome (ok, failed, deadline)', ['backend', 'outcome']
+)
+GENERATION_SECONDS = registry.histogram(
+    'sd_generation_seconds', 'Image generation latency', ['backend'], buckets=GENERATION_BUCKETS
+)
+
+
+# Generation profile for machines without a GPU: few DPM-Solver++ steps with
+# Karras sigmas keep quality acceptable at a fraction of the default 50 steps
+CPU_PROFILE = {
+    'num_inference_steps': 12,
+    'guidance_scale': 7.0,
+    'height': 512,
+    'width': 512
+}
+
+
+def get_peak_rss_mb() -> Optional[float]:
+    """
+    Peak resident set size of this process in MB
+
+    Returns:
+        Peak RSS in MB, or None if it cannot be measured on this platform
+    """
+    try:
+        import resource
+        import sys
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is bytes on macOS and kilobytes on Linux
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+
+    try:
+        import psutil
+
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+# Assumed seconds per denoising step until a generation has been measured
+DEFAULT_SECONDS_PER_STEP = {
+    'cuda': 0.05,
+    'mps': 0.3,
+    'cpu': 1.5,
+    'api': 0.1
+}
+
 
 class ImageGenerator:
+    # Under a deadline, skip generation rather than run fewer steps than this
+    MIN_DEADLINE_STEPS = 4
+    # Time reserved for VAE decoding and transfer on top of the denoising steps,
+    # until runs at two different step counts let it be measured
+    DEADLINE_OVERHEAD_SECONDS = 1.0
+    # Recent (steps, seconds) runs used to fit overhead and per-step cost
+    TIMING_SAMPLES = 20
+    
     def __init__(
         self,
         use_local: bool = False,
         api_url: str = None,
-        model: str = None
+        model: str = None,
+        cpu_optimized: bool = False,
+        num_threads: int = None,
+        use_bf16: bool = False
     ):
         """
         Initialize image generator
@@ -27,10 +102,22 @@ class ImageGenerator:
             use_local: Whether to use local Stable Diffusion
             api_url: API endpoint URL (for Colab or external API)
             model: Model name/path
+            cpu_optimized: Use the CPU generation profile (few-step scheduler,
+                          attention slicing, VAE tiling, channels-last)
+            num_threads: Torch intra-op threads for CPU generation (default: all cores)
+            use_bf16: Run the local pipeline under bfloat16 autocast on CPU
         """
         self.use_local = use_local
         self.api_url = api_url or os.getenv("SD_API_URL")
         self.model = model or os.getenv("SD_MODEL", "stabilityai/stable-diffusion-2-1")
+        self.cpu_optimized = cpu_optimized
+        self.num_threads = num_threads
+        self.use_bf16 = use_bf16
+        self.device = None
+        
+        # Stats of the most recent local generation (seconds_per_image, peak_rss_mb, ...)
+        self.last_generation_stats = {}
+        self.step_timings = deque(maxlen=self.TIMING_SAMPLES)
         
         if use_local:
             self._init_local_model()
@@ -51,13 +138,24 @@ class ImageGenerator:
             )
             
             # Use DPM solver for faster generation
-            self.pipe.scheduler = DPMSolverMultistepScheduler.from_config(
-                self.pipe.scheduler.config
-            )
+            if self.cpu_optimized:
+                self.pipe.scheduler = DPMSolverMultistepScheduler.from_config(
+                    self.pipe.scheduler.config,
+                    algorithm_type="dpmsolver++",
+                    use_karras_sigmas=True
+                )
+            else:
+                self.pipe.scheduler = DPMSolverMultistepScheduler.from_config(
+                    self.pipe.scheduler.config
+                )
             
             # Move to GPU if available
             device = "cuda" if torch.cuda.is_available() else "cpu"
             self.pipe = self.pipe.to(device)
+            self.device = device
+            
+            if self.cpu_optimized:
+                self._apply_cpu_optimizations()
             
             print(f"Model loaded on {device}")
             
@@ -65,14 +163,33 @@ class ImageGenerator:
             print(f"Error loading local model: {e}")
             self.use_local = False
     
+    def _apply_cpu_optimizations(self):
+        """Bound memory and speed up the loaded pipeline for CPU inference"""
+        import torch
+        
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        
+        # Compute attention in slices and decode the VAE in tiles to cap peak memory
+        self.pipe.enable_attention_slicing()
+        if hasattr(self.pipe, 'enable_vae_tiling'):
+            self.pipe.enable_vae_tiling()
+        
+        # oneDNN convolutions are faster in NHWC layout
+        self.pipe.unet.to(memory_format=torch.channels_last)
+        self.pipe.vae.to(memory_format=torch.channels_last)
+        
+        print(f"CPU profile enabled (threads={torch.get_num_threads()}, bf16={self.use_bf16})")
+    
     def txt2img(
         self,
         prompt: str,
         negative_prompt: str = "blurry, bad quality, distorted",
-        num_inference_steps: int = 50,
-        guidance_scale: float = 7.5,
-        height: int = 512,
-        width: int = 512
+        num_inference_steps: int = None,
+        guidance_scale: float = None,
+        height: int = None,
+        width: int = None,
+        deadline: Deadline = None
     ) -> Optional[Image.Image]:
         """
         Generate image from text prompt
@@ -80,28 +197,103 @@ class ImageGenerator:
         Args:
             prompt: Text prompt
             negative_prompt: Negative prompt
-            num_inference_steps: Number of denoising steps
-            guidance_scale: Guidance scale
-            height: Image height
-            width: Image width
+            num_inference_steps: Number of denoising steps (default: 50, or CPU profile)
+            guidance_scale: Guidance scale (default: 7.5, or CPU profile)
+            height: Image height (default: 512)
+            width: Image width (default: 512)
+            deadline: Request deadline; steps are reduced to fit it, and generation is
+                      skipped (None returned) if even MIN_DEADLINE_STEPS would not fit
             
         Returns:
             PIL Image or None
         """
+        defaults = CPU_PROFILE if self.cpu_optimized else {
+            'num_inference_steps': 50,
+            'guidance_scale': 7.5,
+            'height': 512,
+            'width': 512
+        }
+        num_inference_steps = num_inference_steps or defaults['num_inference_steps']
+        guidance_scale = guidance_scale if guidance_scale is not None else defaults['guidance_scale']
+        height = height or defaults['height']
+        width = width or defaults['width']
+        
+        deadline = deadline or NO_DEADLINE
+        num_inference_steps = self._fit_steps(num_inference_steps, deadline)
+        if num_inference_steps is None:
+            print("Skipping image generation: deadline too short")
+            GENERATIONS.labels(backend='local' if self.use_local else 'api', outcome='deadline').inc()
+            return None
+        
         if self.use_local:
-            return self._generate_local(
-                prompt, negative_prompt, num_inference_steps,
-                guidance_scale, height, width
-            )
+            with span('sd.generate_local', steps=num_inference_steps, height=height, width=width), \
+                    GENERATION_SECONDS.labels(backend='local').time():
+                image = self._generate_local(
+                    prompt, negative_prompt, num_inference_steps,
+                    guidance_scale, height, width
+                )
+            GENERATIONS.labels(backend='local', outcome='ok' if image is not None else 'failed').inc()
+            return image
         elif self.api_url:
-            return self._generate_api(
-                prompt, negative_prompt, num_inference_steps,
-                guidance_scale, height, width
-            )
+            with span('sd.generate_api', steps=num_inference_steps, height=height, width=width), \
+                    GENERATION_SECONDS.labels(backend='api').time():
+                image = self._generate_api(
+                    prompt, negative_prompt, num_inference_steps,
+                    guidance_scale, height, width, timeout=deadline.timeout(120)
+                )
+            GENERATIONS.labels(backend='api', outcome='ok' if image is not None else 'failed').inc()
+            return image
         else:
             print("No generation method available. Set use_local=True or provide api_url")
             return None
     
+    def _fit_steps(self, num_inference_steps: int, deadline: Deadline) -> Optional[int]:
+        """
+        Denoising steps that fit in the remaining budget
+        
+        Returns:
+            Step count, or None if fewer than MIN_DEADLINE_STEPS would fit
+        """
+        if not deadline.bounded:
+            return num_inference_steps
+        
+        overhead, seconds_per_step = self._timing_model()
+        available = deadline.remaining() - overhead
+        steps = min(num_inference_steps, int(available / seconds_per_step))
+        if steps < min(self.MIN_DEADLINE_STEPS, num_inference_steps):
+            return None
+        return steps
+    
+    def _timing_model(self) -> Tuple[float, float]:
+        """
+        Fixed overhead and per-step cost, least-squares fitted to recent runs
+        
+        Dividing a run's time by its steps would charge the fixed overhead to the steps,
+        so every deadline-shortened run would look slower per step than the last. Until
+        runs at two step counts exist, the longest runs set the per-step cost and
+        DEADLINE_OVERHEAD_SECONDS is reserved on top.
+        
+        Returns:
+            Tuple of (overhead seconds, seconds per step)
+        """
+        samples = list(self.step_timings)
+        if not samples:
+            device = self.device if self.use_local else 'api'
+            return self.DEADLINE_OVERHEAD_SECONDS, DEFAULT_SECONDS_PER_STEP.get(device, DEFAULT_SECONDS_PER_STEP['cpu'])
+        
+        n = len(samples)
+        mean_steps = sum(steps for steps, _ in samples) / n
+        mean_seconds = sum(seconds for _, seconds in samples) / n
+        var_steps = sum((steps - mean_steps) ** 2 for steps, _ in samples)
+        if var_steps > 0:
+            slope = sum((steps - mean_steps) * (seconds - mean_seconds) for steps, seconds in samples) / var_steps
+            if slope > 0:
+                return max(0.0, mean_seconds - slope * mean_steps), slope
+        
+        most_steps = max(steps for steps, _ in samples)
+        longest = [seconds for steps, seconds in samples if steps == most_steps]
+        return self.DEADLINE_OVERHEAD_SECONDS, sum(longest) / len(longest) / most_steps
+    
     def _generate_local(
         self,
         prompt: str,
@@ -113,14 +305,36 @@ class ImageGenerator:
     ) -> Optional[Image.Image]:
         """Generate image using local model"""
         try:
-            image = self.pipe(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                num_inference_steps=num_inference_steps,
-                guidance_scale=guidance_scale,
-                height=height,
-                width=width
-            ).images[0]
+            import contextlib
+            import torch
+            
+            if self.use_bf16 and self.device == "cpu":
+                autocast = torch.autocast("cpu", dtype=torch.bfloat16)
+            else:
+                autocast = contextlib.nullcontext()
+            
+            start_time = time.time()
+            with torch.inference_mode(), autocast:
+                image = self.pipe(
+                    prompt=prompt,
+                    negative_prompt=negative_prompt,
+                    num_inference_steps=num_inference_steps,
+                    guidance_scale=guidance_scale,
+                    height=height,
+                    width=width
+                ).images[0]
+            elapsed = time.time() - start_time
+            self.step_timings.append((num_inference_steps, elapsed))
+            
+            self.last_generation_stats = {
+                'seconds_per_image': elapsed,
+                'seconds_per_step': elapsed / num_inference_steps,
+                'peak_rss_mb': get_peak_rss_mb(),
+                'num_inference_steps': num_inference_steps,
+                'device': self.device,
+                'cpu_optimized': self.cpu_optimized,
+                'bf16': self.use_bf16 and self.device == "cpu"
+            }
             
             return image
             
@@ -135,7 +349,8 @@ class ImageGenerator:
         num_inference_steps: int,
         guidance_scale: float,
         height: int,
-        width: int
+        width: int,
+        timeout: float = 120
     ) -> Optional[Image.Image]:
         """Generate image using API endpoint"""
         try:
@@ -148,14 +363,23 @@ class ImageGenerator:
                 "width": width
             }
             
+            start_time = time.time()
             response = requests.post(
                 f"{self.api_url}/generate",
                 json=payload,
-                timeout=120
+                timeout=timeout
             )
             
             if response.status_code == 200:
                 image = Image.open(BytesIO(response.content))
+                elapsed = time.time() - start_time
+                self.step_timings.append((num_inference_steps, elapsed))
+                self.last_generation_stats = {
+                    'seconds_per_image': elapsed,
+                    'seconds_per_step': elapsed / num_inference_steps,
+                    'num_inference_steps': num_inference_steps,
+                    'device': 'api'
+                }
                 return image
             else:
                 print(f"API error: {response.status_code}")
@@ -219,6 +443,31 @@ class ImageGenerator:
 
 
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Benchmark the CPU generation profile")
+    parser.add_argument("--benchmark_cpu", action="store_true", help="Generate locally with the CPU profile")
+    parser.add_argument("--num_images", type=int, default=3)
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--bf16", action="store_true")
+    args = parser.parse_args()
+    
+    if args.benchmark_cpu:
+        generator = ImageGenerator(
+            use_local=True,
+            cpu_optimized=True,
+            num_threads=args.num_threads,
+            use_bf16=args.bf16
+        )
+        for i in range(args.num_images):
+            image = generator.txt2img("a dog playing in the park, photorealistic")
+            stats = generator.last_generation_stats
+            if image is None or 'seconds_per_image' not in stats:
+                raise SystemExit("Local generation failed (is the model installed and loadable?); no stats to report")
+            print(f"Image {i + 1}: {stats['seconds_per_image']:.1f}s/image, "
+                  f"{stats['seconds_per_step']:.2f}s/step, peak RSS {stats['peak_rss_mb']} MB")
+        raise SystemExit(0)
+    
     # Test image generator
     generator = ImageGenerator(use_local=False)
     
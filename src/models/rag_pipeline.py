@@ -0,0 +1,219 @@
+"""
+RAG Pipeline
+Runs retrieval once, then text and image generation concurrently, yielding each stage as it finishes
+"""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, as_completed
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from src.utils.deadline import Deadline, NO_DEADLINE
+from src.utils.tracing import run_in_context, span
+
+
+class RAGPipeline:
+    # Extra time given to stages past the deadline to return their own fallback
+    DEADLINE_GRACE_SECONDS = 0.5
+
+    def __init__(
+        self,
+        retriever,
+        context_builder,
+        text_gen=None,
+        image_gen=None,
+        max_workers: int = 8
+    ):
+        """
+        Initialize pipeline
+
+        Args:
+            retriever: Retriever instance
+            context_builder: ContextBuilder instance
+            text_gen: TextGenerator (or HedgedTextGenerator), optional
+            image_gen: ImageGenerator, optional
+            max_workers: Threads shared by concurrent generation stages
+        """
+        self.retriever = retriever
+        self.context_builder = context_builder
+        self.text_gen = text_gen
+        self.image_gen = image_gen
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-stage")
+
+    def retrieve(
+        self,
+        query_mode: str,
+        query_text: str = None,
+        query_image: str = None,
+        text_weight: float = 0.5,
+        top_k: int = 5,
+        deadline: Deadline = None
+    ) -> Dict:
+        """
+        Run retrieval for a query mode
+
+        Args:
+            query_mode: 'text', 'image' or 'multimodal'
+            query_text: Text query
+            query_image: Path to query image
+            text_weight: Text weight for multimodal fusion
+            top_k: Number of results
+            deadline: Request deadline
+
+        Returns:
+            Retriever results dictionary
+        """
+        if query_mode == 'text':
+            return self.retriever.search_by_text(query_text, k=top_k, deadline=deadline)
+        elif query_mode == 'image':
+            return self.retriever.search_by_image(query_image, k=top_k, deadline=deadline)
+        elif query_mode == 'multimodal':
+            return self.retriever.search_by_multimodal(
+                query_text=query_text,
+                query_image=query_image,
+                text_weight=text_weight,
+                k=top_k,
+                deadline=deadline
+            )
+        raise ValueError(f"Unsupported query mode: {query_mode}")
+
+    def _generate_text(self, query_mode: str, query_text: str, captions, relevance, groups, deadline: Deadline) -> Dict:
+        start = time.time()
+        if query_mode == 'text':
+            query_str = query_text
+        elif query_mode == 'image':
+            query_str = "the uploaded image"
+        else:
+            query_str = f"{query_text} (with reference image)"
+
+        with span('pipeline.text'):
+            context = self.context_builder.build_budgeted_context(
+                query_str, captions, relevance=relevance, groups=groups
+            )
+            description = self.text_gen.generate_from_context(context, deadline=deadline)
+        return {
+            'stage': 'text',
+            'description': description,
+            'prompt_tokens': context['token_count'],
+            'time': time.time() - start
+        }
+
+    def _generate_image(self, query_mode: str, query_text: str, captions, deadline: Deadline) -> Dict:
+        start = time.time()
+        query_str = query_text if query_mode != 'image' else ""
+        with span('pipeline.image'):
+            prompt = self.context_builder.build_image_generation_prompt(query_str, captions)
+            image = self.image_gen.txt2img(prompt, deadline=deadline)
+        result = {
+            'stage': 'image',
+            'image': image,
+            'prompt': prompt,
+            'time': time.time() - start
+        }
+        if image is None:
+            result['error'] = 'Image generation skipped or failed within the deadline' if deadline.bounded else 'Image generation failed'
+        return result
+
+    def run(
+        self,
+        query_mode: str,
+        query_text: str = None,
+        query_image: str = None,
+        text_weight: float = 0.5,
+        top_k: int = 5,
+        generate_text: bool = True,
+        generate_image: bool = True,
+        results: Optional[Dict] = None,
+        deadline: Deadline = None
+    ) -> Iterator[Dict]:
+        """
+        Run the full pipeline, yielding stage events as they complete
+
+        Events (dicts with a 'stage' key):
+            retrieval: 'results', 'captions', 'time'
+            text:      'description', 'prompt_tokens', 'time' (or 'error')
+            image:     'image' (PIL), 'prompt', 'time' (or 'error')
+            done:      'timings' per stage, 'total_time' and 'deadline'
+
+        Args:
+            query_mode: 'text', 'image' or 'multimodal'
+            query_text: Text query
+            query_image: Path to query image
+            text_weight: Text weight for multimodal fusion
+            top_k: Number of results
+            generate_text: Run LLM generation
+            generate_image: Run Stable Diffusion generation
+            results: Precomputed retrieval results (skips retrieval)
+            deadline: Request deadline shared by all stages. Retrieval raises
+                      DeadlineExceeded once it is spent; generation stages shrink
+                      or skip their work, and any still running past the deadline
+                      are reported with an error instead of being waited for
+
+        Yields:
+            Stage event dictionaries
+        """
+        total_start = time.time()
+        timings = {}
+        deadline = deadline or NO_DEADLINE
+
+        if results is None:
+            start = time.time()
+            results = self.retrieve(query_mode, query_text, query_image, text_weight, top_k, deadline)
+            timings['retrieval'] = time.time() - start
+
+        captions, relevance, groups = [], [], []
+        for i, result in enumerate(results['results']):
+            captions.extend(result['captions'])
+            relevance.extend([result['similarity_score']] * len(result['captions']))
+            groups.extend([i] * len(result['captions']))
+
+        yield {
+            'stage': 'retrieval',
+            'results': results,
+            'captions': captions,
+            'time': timings.get('retrieval', 0.0)
+        }
+
+        # Generation stages only depend on retrieval, so run them side by side
+        futures = {}
+        if generate_text and self.text_gen is not None:
+            futures[self.executor.submit(
+                run_in_context(self._generate_text), query_mode, query_text, captions, relevance, groups, deadline
+            )] = 'text'
+        if generate_image and self.image_gen is not None:
+            futures[self.executor.submit(
+                run_in_context(self._generate_image), query_mode, query_text, captions, deadline
+            )] = 'image'
+
+        wait_timeout = deadline.timeout(None)
+        if wait_timeout is not None:
+            wait_timeout += self.DEADLINE_GRACE_SECONDS
+
+        pending = set(futures)
+        try:
+            for future in as_completed(futures, timeout=wait_timeout):
+                pending.discard(future)
+                stage = futures[future]
+                try:
+                    event = future.result()
+                except Exception as e:
+                    event = {'stage': stage, 'error': str(e), 'time': time.time() - total_start}
+                timings[stage] = event['time']
+                yield event
+        except FuturesTimeout:
+            # Stages still running are abandoned; their results are discarded
+            for future in pending:
+                future.cancel()
+                stage = futures[future]
+                timings[stage] = time.time() - total_start
+                yield {'stage': stage, 'error': 'Deadline exceeded', 'time': timings[stage]}
+
+        yield {
+            'stage': 'done',
+            'timings': timings,
+            'total_time': time.time() - total_start,
+            'deadline': deadline.to_dict()
+        }
@@ -0,0 +1,343 @@
+"""
+Stable Diffusion Generation Server
+Batching HTTP server compatible with ImageGenerator API mode (replaces the Colab notebook)
+"""
+
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from io import BytesIO
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+from flask import Flask, request, jsonify, send_file
+from PIL import Image, ImageDraw
+
+
+# Request fields that must match for two prompts to share one pipeline call
+BATCH_KEY_FIELDS = ('negative_prompt', 'num_inference_steps', 'guidance_scale', 'height', 'width')
+
+DEFAULT_PARAMS = {
+    'negative_prompt': 'blurry, bad quality, distorted',
+    'num_inference_steps': 30,
+    'guidance_scale': 7.5,
+    'height': 512,
+    'width': 512
+}
+
+
+class GenerationRequest:
+    """A single queued prompt waiting for a batch slot"""
+
+    def __init__(self, prompt: str, params: Dict):
+        self.prompt = prompt
+        self.params = params
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def batch_key(self) -> Tuple:
+        """Requests with the same key can be generated in one pipeline call"""
+        return tuple(self.params[field] for field in BATCH_KEY_FIELDS)
+
+
+class MockPipeline:
+    """CPU stand-in for StableDiffusionPipeline that renders the prompt as an image"""
+
+    def __init__(self, latency_per_step: float = 0.0):
+        """
+        Args:
+            latency_per_step: Simulated seconds per denoising step (for load tests)
+        """
+        self.latency_per_step = latency_per_step
+
+    def __call__(self, prompt: List[str], num_inference_steps: int, height: int, width: int, **kwargs):
+        # One batched call costs the same as a single image, like a real GPU pipeline
+        time.sleep(self.latency_per_step * num_inference_steps)
+
+        images = []
+        for text in prompt:
+            seed = sum(ord(c) for c in text)
+            color = (seed * 37 % 256, seed * 91 % 256, seed * 53 % 256)
+            image = Image.new('RGB', (width, height), color)
+            ImageDraw.Draw(image).text((10, 10), text[:60], fill=(255, 255, 255))
+            images.append(image)
+
+        return SimpleNamespace(images=images)
+
+
+def load_pipeline(model: str, device: str = None):
+    """
+    Load a diffusers pipeline for serving
+
+    Args:
+        model: HuggingFace model id, or 'mock' for the CPU mock pipeline
+        device: Device to run on (defaults to cuda when available)
+
+    Returns:
+        Callable pipeline
+    """
+    if model == 'mock':
+        return MockPipeline()
+
+    from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler
+    import torch
+
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    pipe = StableDiffusionPipeline.from_pretrained(
+        model,
+        torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+        safety_checker=None
+    )
+    pipe.scheduler = DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
+    pipe = pipe.to(device)
+    print(f"Pipeline {model} loaded on {device}")
+    return pipe
+
+
+class BatchingGenerationServer:
+    """Request queue plus a worker thread that groups compatible prompts into batches"""
+
+    def __init__(
+        self,
+        pipeline,
+        max_batch_size: int = 4,
+        max_wait_ms: float = 50.0,
+        max_queue_size: int = 64
+    ):
+        """
+        Initialize generation server
+
+        Args:
+            pipeline: Callable pipeline (diffusers or MockPipeline)
+            max_batch_size: Maximum prompts per pipeline call
+            max_wait_ms: How long to wait for more compatible prompts before running a batch
+            max_queue_size: Requests beyond this are rejected
+        """
+        self.pipeline = pipeline
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue(maxsize=max_queue_size)
+
+        # Requests pulled off the queue that did not fit the current batch
+        self._deferred: List[GenerationRequest] = []
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'requests_total': 0,
+            'requests_failed': 0,
+            'requests_rejected': 0,
+            'batches_total': 0,
+            'images_total': 0,
+            'queue_wait_seconds_total': 0.0,
+            'generation_seconds_total': 0.0
+        }
+        self._started_at = time.time()
+
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="sd-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, prompt: str, params: Dict) -> Future:
+        """
+        Queue a prompt for generation
+
+        Args:
+            prompt: Text prompt
+            params: Generation parameters (see DEFAULT_PARAMS)
+
+        Returns:
+            Future resolving to a PIL Image
+
+        Raises:
+            queue.Full: If the request queue is full
+        """
+        merged = dict(DEFAULT_PARAMS)
+        merged.update({k: v for k, v in params.items() if k in DEFAULT_PARAMS})
+        req = GenerationRequest(prompt, merged)
+        try:
+            self.queue.put_nowait(req)
+        except queue.Full:
+            with self._lock:
+                self._stats['requests_rejected'] += 1
+            raise
+        return req.future
+
+    def _next_request(self, timeout: float) -> Optional[GenerationRequest]:
+        if self._deferred:
+            return self._deferred.pop(0)
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _collect_batch(self, first: GenerationRequest) -> List[GenerationRequest]:
+        """Gather up to max_batch_size requests sharing the first request's batch key"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+
+        # Deferred requests with a matching key go first (they have waited longest)
+        remaining = []
+        for req in self._deferred:
+            if len(batch) < self.max_batch_size and req.batch_key == first.batch_key:
+                batch.append(req)
+            else:
+                remaining.append(req)
+        self._deferred = remaining
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                req = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if req.batch_key == first.batch_key:
+                batch.append(req)
+            else:
+                self._deferred.append(req)
+
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            first = self._next_request(timeout=0.1)
+            if first is None:
+                continue
+
+            batch = self._collect_batch(first)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: List[GenerationRequest]):
+        params = batch[0].params
+        started = time.monotonic()
+        wait_total = sum(started - req.enqueued_at for req in batch)
+
+        try:
+            output = self.pipeline(
+                prompt=[req.prompt for req in batch],
+                negative_prompt=[params['negative_prompt']] * len(batch),
+                num_inference_steps=params['num_inference_steps'],
+                guidance_scale=params['guidance_scale'],
+                height=params['height'],
+                width=params['width']
+            )
+            for req, image in zip(batch, output.images):
+                req.future.set_result(image)
+            failed = 0
+        except Exception as e:
+            print(f"Error generating batch of {len(batch)}: {e}")
+            for req in batch:
+                req.future.set_exception(e)
+            failed = len(batch)
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._stats['requests_total'] += len(batch)
+            self._stats['requests_failed'] += failed
+            self._stats['batches_total'] += 1
+            self._stats['images_total'] += len(batch) - failed
+            self._stats['queue_wait_seconds_total'] += wait_total
+            self._stats['generation_seconds_total'] += elapsed
+
+    def stats(self) -> Dict:
+        """Snapshot of server counters plus derived averages"""
+        with self._lock:
+            stats = dict(self._stats)
+        batches = stats['batches_total']
+        requests_done = stats['requests_total']
+        stats['queue_depth'] = self.queue.qsize() + len(self._deferred)
+        stats['avg_batch_size'] = requests_done / batches if batches else 0.0
+        stats['avg_queue_wait'] = stats['queue_wait_seconds_total'] / requests_done if requests_done else 0.0
+        stats['avg_batch_time'] = stats['generation_seconds_total'] / batches if batches else 0.0
+        stats['uptime'] = time.time() - self._started_at
+        return stats
+
+    def shutdown(self):
+        """Stop the worker thread"""
+        self._stop.set()
+        self._worker.join(timeout=5)
+
+
+def create_app(server: BatchingGenerationServer, model_name: str, request_timeout: float = 300.0) -> Flask:
+    """
+    Create the Flask app exposing /generate, /health and /metrics
+
+    Args:
+        server: Batching server instance
+        model_name: Model name reported by /health
+        request_timeout: Seconds a /generate call waits for its image
+
+    Returns:
+        Flask app
+    """
+    app = Flask(__name__)
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        return jsonify({
+            "status": "healthy",
+            "model": model_name,
+            "queue_depth": server.stats()['queue_depth']
+        })
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return jsonify(server.stats())
+
+    @app.route('/generate', methods=['POST'])
+    def generate():
+        data = request.json or {}
+        prompt = data.get('prompt', '')
+
+        try:
+            future = server.submit(prompt, data)
+        except queue.Full:
+            return jsonify({"error": "Server busy, queue is full"}), 503
+
+        try:
+            image = future.result(timeout=request_timeout)
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+        img_io = BytesIO()
+        image.save(img_io, 'PNG')
+        img_io.seek(0)
+        return send_file(img_io, mimetype='image/png')
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the batching Stable Diffusion server")
+    parser.add_argument("--model", type=str, default="runwayml/stable-diffusion-v1-5",
+                        help="Model id, or 'mock' for a CPU mock pipeline")
+    parser.add_argument("--device", type=str, default=None, help="cuda or cpu")
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=7860)
+    parser.add_argument("--max_batch_size", type=int, default=4)
+    parser.add_argument("--max_wait_ms", type=float, default=50.0)
+    parser.add_argument("--max_queue_size", type=int, default=64)
+    parser.add_argument("--mock_latency", type=float, default=0.0,
+                        help="Simulated seconds per step in mock mode")
+
+    args = parser.parse_args()
+
+    pipeline = load_pipeline(args.model, args.device)
+    if isinstance(pipeline, MockPipeline):
+        pipeline.latency_per_step = args.mock_latency
+
+    server = BatchingGenerationServer(
+        pipeline,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_queue_size=args.max_queue_size
+    )
+    app = create_app(server, args.model)
+
+    print(f"SD server running on http://{args.host}:{args.port} (model={args.model})")
+    print(f"Set SD_API_URL=http://localhost:{args.port} to use it from ImageGenerator")
+    app.run(host=args.host, port=args.port, threaded=True)
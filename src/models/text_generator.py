@@ -5,21 +5,57 @@ Optimized for Gemini safety filters
 """
 
 import os
-from typing import Optional
+import sys
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
 from dotenv import load_dotenv
 
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from src.utils.response_cache import ResponseCache
+from src.utils.rate_limiter import get_rate_limiter, RateLimitTimeout
+from src.utils.deadline import Deadline, NO_DEADLINE
+from src.utils.tracing import span
+from src.utils.telemetry import registry
+from src.models.context_builder import estimate_tokens
+
 # Load environment variables
 load_dotenv()
 
+REQUESTS = registry.counter(
+    'llm_requests_total', 'LLM generations by outcome (ok, truncated, error, rate_limited, deadline, cache_hit)',
+    ['provider', 'outcome']
+)
+PROVIDER_SECONDS = registry.histogram('llm_provider_seconds', 'LLM provider call or full stream duration', ['provider', 'mode'])
+QUEUE_WAIT_SECONDS = registry.histogram('llm_queue_wait_seconds', 'Wait for rate-limit quota before a provider call', ['provider'])
+
+# Model used when neither the caller nor LLM_MODEL names one
+DEFAULT_MODELS = {
+    'openai': 'gpt-4o-mini',
+    'groq': 'llama3-70b-8192',
+    'gemini': 'gemini-1.5-flash'
+}
+
 
 class TextGenerator:
+    # Under a deadline, skip the call if it could not produce at least this many tokens
+    MIN_DEADLINE_TOKENS = 16
+    
     def __init__(
         self,
         provider: str = None,
         model: str = None,
         api_key: str = None,
         temperature: float = 0.7,
-        max_tokens: int = 200
+        max_tokens: int = 200,
+        use_cache: bool = None,
+        cache: Optional[ResponseCache] = None,
+        requests_per_minute: float = None,
+        tokens_per_minute: float = None,
+        max_concurrent: int = None,
+        queue_timeout: float = None,
+        tokens_per_second: float = None,
+        first_token_latency: float = None
     ):
         """
         Initialize text generator
@@ -30,26 +66,45 @@ class TextGenerator:
             api_key: API key (optional, will use env var)
             temperature: Sampling temperature
             max_tokens: Maximum tokens to generate
+            use_cache: Cache responses (default: LLM_CACHE_ENABLED env var, on)
+            cache: Response cache instance (default: ResponseCache from env settings)
+            requests_per_minute: Provider request quota (default: <PROVIDER>_RPM or LLM_RPM env var)
+            tokens_per_minute: Provider token quota (default: <PROVIDER>_TPM or LLM_TPM env var)
+            max_concurrent: Maximum in-flight calls (default: <PROVIDER>_MAX_CONCURRENT or LLM_MAX_CONCURRENT)
+            queue_timeout: Seconds a call may wait for quota before falling back (default: LLM_QUEUE_TIMEOUT, 30)
+            tokens_per_second: Expected decode speed, used to fit max_tokens to a deadline (default: LLM_TOKENS_PER_SECOND, 50)
+            first_token_latency: Expected seconds before the first token (default: LLM_FIRST_TOKEN_LATENCY, 0.5)
         """
         self.provider = provider or os.getenv("LLM_PROVIDER", "gemini")
         self.temperature = temperature
         self.max_tokens = max_tokens
         
+        if use_cache is None:
+            use_cache = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+        if use_cache:
+            self.cache = cache or ResponseCache(
+                db_path=os.getenv("LLM_CACHE_PATH", "history/llm_cache.db"),
+                ttl_seconds=float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600)),
+                max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", 10000))
+            )
+        else:
+            self.cache = None
+        
         if self.provider == "openai":
             from openai import OpenAI
-            self.model = model or os.getenv("LLM_MODEL", "gpt-4o-mini")
+            self.model = model or os.getenv("LLM_MODEL", DEFAULT_MODELS["openai"])
             api_key = api_key or os.getenv("OPENAI_API_KEY")
             self.client = OpenAI(api_key=api_key)
             
         elif self.provider == "groq":
             from groq import Groq
-            self.model = model or os.getenv("LLM_MODEL", "llama3-70b-8192")
+            self.model = model or os.getenv("LLM_MODEL", DEFAULT_MODELS["groq"])
             api_key = api_key or os.getenv("GROQ_API_KEY")
             self.client = Groq(api_key=api_key)
             
         elif self.provider == "gemini":
             import google.generativeai as genai
-            self.model = model or os.getenv("LLM_MODEL", "gemini-1.5-flash")
+            self.model = model or os.getenv("LLM_MODEL", DEFAULT_MODELS["gemini"])
             api_key = api_key or os.getenv("GEMINI_API_KEY")
             genai.configure(api_key=api_key)
             
@@ -81,19 +136,173 @@ class TextGenerator:
         else:
             raise ValueError(f"Unsupported provider: {self.provider}")
         
+        # Quotas are shared by every generator using the same provider/model
+        def limit_setting(value, suffix, cast):
+            if value is not None:
+                return value
+            env = os.getenv(f"{self.provider.upper()}_{suffix}") or os.getenv(f"LLM_{suffix}")
+            return cast(env) if env else None
+        
+        self.rate_limiter = get_rate_limiter(
+            f"{self.provider}/{self.model}",
+            requests_per_minute=limit_setting(requests_per_minute, "RPM", float),
+            tokens_per_minute=limit_setting(tokens_per_minute, "TPM", float),
+            max_concurrent=limit_setting(max_concurrent, "MAX_CONCURRENT", int)
+        )
+        self.queue_timeout = limit_setting(queue_timeout, "QUEUE_TIMEOUT", float) or 30.0
+        self.tokens_per_second = tokens_per_second or float(os.getenv("LLM_TOKENS_PER_SECOND", 50))
+        self.first_token_latency = first_token_latency if first_token_latency is not None else float(os.getenv("LLM_FIRST_TOKEN_LATENCY", 0.5))
+        
         print(f"Text generator initialized: {self.provider}/{self.model}")
     
-    def generate(self, system_message: str, user_message: str) -> str:
+    def _estimate_call_tokens(self, system_message: str, user_message: str) -> int:
+        """Prompt tokens plus the completion budget, for token-per-minute quotas"""
+        return estimate_tokens(system_message) + estimate_tokens(user_message) + self.max_tokens
+    
+    def _max_tokens_for(self, deadline: Deadline) -> int:
+        """Completion budget that fits in the remaining time (self.max_tokens if unbounded)"""
+        if not deadline.bounded:
+            return self.max_tokens
+        decode_time = deadline.remaining() - self.first_token_latency
+        return min(self.max_tokens, int(decode_time * self.tokens_per_second))
+    
+    def _deadline_fallback(self, user_message: str) -> str:
+        return f"⏱️ Deadline too short for LLM generation\n\n📝 Fallback Description:\n{self._create_fallback_description(user_message)}"
+    
+    def generate(
+        self,
+        system_message: str,
+        user_message: str,
+        bypass_cache: bool = False,
+        deadline: Deadline = None
+    ) -> str:
         """
         Generate text using LLM
         
         Args:
             system_message: System prompt
             user_message: User message
+            bypass_cache: Skip the response cache lookup (fresh answers are still stored)
+            deadline: Request deadline; shortens max_tokens and caps the provider timeout
             
         Returns:
             Generated text
         """
+        text, _ = self.generate_with_status(system_message, user_message, bypass_cache=bypass_cache, deadline=deadline)
+        return text
+    
+    def generate_with_status(
+        self,
+        system_message: str,
+        user_message: str,
+        bypass_cache: bool = False,
+        deadline: Deadline = None
+    ) -> Tuple[str, bool]:
+        """
+        Generate text and report whether the provider actually answered
+        
+        Args:
+            system_message: System prompt
+            user_message: User message
+            bypass_cache: Skip the response cache lookup (fresh answers are still stored)
+            deadline: Request deadline; shortens max_tokens and caps the provider timeout
+            
+        Returns:
+            Tuple of (text, ok) where ok is False for fallback/error responses
+        """
+        deadline = deadline or NO_DEADLINE
+        cache_key = self._cache_key(system_message, user_message)
+        
+        if cache_key and not bypass_cache:
+            with span('llm.cache_lookup'):
+                cached = self.cache.get(cache_key)
+            if cached is not None:
+                REQUESTS.labels(provider=self.provider, outcome='cache_hit').inc()
+                return cached, True
+        
+        max_tokens = self._max_tokens_for(deadline)
+        if max_tokens < self.MIN_DEADLINE_TOKENS:
+            REQUESTS.labels(provider=self.provider, outcome='deadline').inc()
+            return self._deadline_fallback(user_message), False
+        
+        text, ok = self._generate_uncached(system_message, user_message, max_tokens, deadline)
+        
+        # Fallback, error, truncated (ok None) and deadline-shortened responses are never cached
+        if cache_key and ok and max_tokens == self.max_tokens:
+            self.cache.set(cache_key, text, self.provider, self.model)
+        
+        # A truncated answer is still an answer
+        return text, ok is not False
+    
+    def _cache_key(self, system_message: str, user_message: str) -> Optional[str]:
+        """Cache key for this request, or None if caching is disabled"""
+        if self.cache is None:
+            return None
+        return self.cache.make_key(
+            self.provider, self.model, self.temperature, self.max_tokens,
+            system_message, user_message
+        )
+    
+    def _generate_uncached(
+        self,
+        system_message: str,
+        user_message: str,
+        max_tokens: int = None,
+        deadline: Deadline = None
+    ) -> Tuple[str, Optional[bool]]:
+        """
+        Call the LLM provider once quota is available
+        
+        Returns:
+            Tuple of (text, ok) as from _call_provider
+        """
+        deadline = deadline or NO_DEADLINE
+        tokens = self._estimate_call_tokens(system_message, user_message)
+        try:
+            with span('llm.queue_wait'), QUEUE_WAIT_SECONDS.labels(provider=self.provider).time():
+                self.rate_limiter.acquire(tokens, timeout=deadline.timeout(self.queue_timeout))
+            try:
+                with span('llm.provider_call', provider=self.provider, max_tokens=max_tokens or self.max_tokens), \
+                        PROVIDER_SECONDS.labels(provider=self.provider, mode='call').time():
+                    text, ok = self._call_provider(system_message, user_message, max_tokens, deadline.timeout(None))
+            finally:
+                self.rate_limiter.release()
+        except RateLimitTimeout as e:
+            print(f"Rate limit queue timeout: {e}")
+            REQUESTS.labels(provider=self.provider, outcome='rate_limited').inc()
+            return f"⚠️ Rate limited: {str(e)}\n\n📝 Fallback Description:\n{self._create_fallback_description(user_message)}", False
+        
+        outcome = 'error' if ok is False else 'truncated' if ok is None else 'ok'
+        REQUESTS.labels(provider=self.provider, outcome=outcome).inc()
+        return text, ok
+    
+    def _request_options(self, timeout: Optional[float]) -> dict:
+        """Per-call timeout keyword arguments for the provider SDK"""
+        if timeout is None:
+            return {}
+        if self.provider == "gemini":
+            return {'request_options': {'timeout': timeout}}
+        return {'timeout': timeout}
+    
+    def _call_provider(
+        self,
+        system_message: str,
+        user_message: str,
+        max_tokens: int = None,
+        timeout: Optional[float] = None
+    ) -> Tuple[str, Optional[bool]]:
+        """
+        Call the LLM provider
+        
+        Args:
+            max_tokens: Completion budget (default: self.max_tokens)
+            timeout: Request timeout in seconds (default: SDK default)
+        
+        Returns:
+            Tuple of (text, ok) where ok is False for fallback/error responses and
+            None for an answer cut at the token limit (usable, but not cached)
+        """
+        max_tokens = max_tokens or self.max_tokens
         try:
             if self.provider == "gemini":
                 # Gemini uses a different API format
@@ -104,15 +313,16 @@ class TextGenerator:
                     full_prompt,
                     generation_config={
                         'temperature': self.temperature,
-                        'max_output_tokens': self.max_tokens,
-                    }
+                        'max_output_tokens': max_tokens,
+                    },
+                    **self._request_options(timeout)
                 )
                 
                 # Check if response was blocked
                 if not response.candidates:
                     error_msg = "❌ No candidates returned by Gemini API"
                     print(error_msg)
-                    return f"{error_msg}\n\n📝 Fallback:\n{self._create_fallback_description(user_message)}"
+                    return f"{error_msg}\n\n📝 Fallback:\n{self._create_fallback_description(user_message)}", False
                 
                 candidate = response.candidates[0]
                 
@@ -120,16 +330,15 @@ class TextGenerator:
                 finish_reason = candidate.finish_reason
                 
                 if finish_reason == 2:
-                    # Check safety ratings for more info
-                    safety_info = ""
-                    if hasattr(candidate, 'safety_ratings') and candidate.safety_ratings:
-                        safety_info = "\n🛡️ Safety Ratings:\n"
-                        for rating in candidate.safety_ratings:
-                            safety_info += f"  - {rating.category}: {rating.probability}\n"
-                    
-                    error_msg = f"⚠️ Gemini blocked response (finish_reason: 2 - SAFETY/MAX_TOKENS){safety_info}"
+                    # MAX_TOKENS: what was generated is a usable (truncated) answer
+                    parts = candidate.content.parts if candidate.content else []
+                    text = "".join(getattr(part, 'text', '') for part in parts)
+                    if text:
+                        print("⚠️ Gemini response truncated at max_output_tokens")
+                        return text, None
+                    error_msg = "⚠️ Gemini returned no text (finish_reason: 2 - MAX_TOKENS)"
                     print(error_msg)
-                    return f"{error_msg}\n📝 Fallback:\n{self._create_fallback_description(user_message)}"
+                    return f"{error_msg}\n📝 Fallback:\n{self._create_fallback_description(user_message)}", False
                 
                 if finish_reason == 3:
                     safety_info = ""
@@ -140,23 +349,23 @@ class TextGenerator:
                     
                     error_msg = f"⚠️ Gemini blocked response (finish_reason: 3 - SAFETY){safety_info}"
                     print(error_msg)
-                    return f"{error_msg}\n📝 Fallback:\n{self._create_fallback_description(user_message)}"
+                    return f"{error_msg}\n📝 Fallback:\n{self._create_fallback_description(user_message)}", False
                 
                 if finish_reason == 4:
                     error_msg = "⚠️ Gemini blocked response (finish_reason: 4 - RECITATION)"
                     print(error_msg)
-                    return f"{error_msg}\n📝 Fallback:\n{self._create_fallback_description(user_message)}"
+                    return f"{error_msg}\n📝 Fallback:\n{self._create_fallback_description(user_message)}", False
                 
                 # Try to get text
                 try:
-                    return response.text
+                    return response.text, True
                 except ValueError as e:
                     # If response.text fails, try to get from parts
                     if candidate.content and candidate.content.parts:
-                        return candidate.content.parts[0].text
+                        return candidate.content.parts[0].text, True
                     else:
                         # Use fallback
-                        return self._create_fallback_description(user_message)
+                        return self._create_fallback_description(user_message), False
                 
             else:
                 # OpenAI and Groq use the same format
@@ -169,28 +378,266 @@ class TextGenerator:
                     model=self.model,
                     messages=messages,
                     temperature=self.temperature,
-                    max_tokens=self.max_tokens
+                    max_tokens=max_tokens,
+                    **self._request_options(timeout)
                 )
                 
-                return response.choices[0].message.content
+                choice = response.choices[0]
+                if choice.finish_reason == "length":
+                    print("⚠️ Response truncated at max_tokens")
+                    return choice.message.content, None
+                return choice.message.content, True
             
         except Exception as e:
             error_msg = f"Error generating text: {str(e)}"
             print(error_msg)
             # Return error details for debugging
-            return f"⚠️ API Error: {str(e)}\n\n📝 Fallback Description:\n{self._create_fallback_description(user_message)}"
+            return f"⚠️ API Error: {str(e)}\n\n📝 Fallback Description:\n{self._create_fallback_description(user_message)}", False
+    
+    def generate_stream(
+        self,
+        system_message: str,
+        user_message: str,
+        bypass_cache: bool = False,
+        deadline: Deadline = None
+    ) -> Iterator[str]:
+        """
+        Generate text using LLM, yielding text chunks as the provider sends them
+        
+        Args:
+            system_message: System prompt
+            user_message: User message
+            bypass_cache: Skip the response cache lookup (fresh answers are still stored)
+            deadline: Request deadline; shortens max_tokens and stops the stream when spent
+            
+        Yields:
+            Generated text chunks (a fallback description if the provider fails)
+        """
+        stream = self.generate_stream_with_status(
+            system_message, user_message, bypass_cache=bypass_cache, deadline=deadline
+        )
+        try:
+            for chunk, _ in stream:
+                if chunk:
+                    yield chunk
+        finally:
+            stream.close()
+    
+    def generate_stream_with_status(
+        self,
+        system_message: str,
+        user_message: str,
+        bypass_cache: bool = False,
+        deadline: Deadline = None
+    ) -> Iterator[Tuple[str, Optional[bool]]]:
+        """
+        generate_stream that also reports, per chunk, whether the provider actually answered
+        
+        Yields:
+            Tuples of (chunk, ok): ok is False for fallback/error chunks and None for the
+            empty marker ending a stream cut at the token limit (see _stream_provider)
+        """
+        deadline = deadline or NO_DEADLINE
+        cache_key = self._cache_key(system_message, user_message)
+        
+        if cache_key and not bypass_cache:
+            with span('llm.cache_lookup'):
+                cached = self.cache.get(cache_key)
+            if cached is not None:
+                REQUESTS.labels(provider=self.provider, outcome='cache_hit').inc()
+                yield cached, True
+                return
+        
+        max_tokens = self._max_tokens_for(deadline)
+        if max_tokens < self.MIN_DEADLINE_TOKENS:
+            REQUESTS.labels(provider=self.provider, outcome='deadline').inc()
+            yield self._deadline_fallback(user_message), False
+            return
+        if max_tokens < self.max_tokens:
+            cache_key = None
+        
+        chunks = []
+        stream = self._stream_uncached(system_message, user_message, max_tokens, deadline)
+        try:
+            for chunk, ok in stream:
+                if not ok:
+                    cache_key = None
+                chunks.append(chunk)
+                yield chunk, ok
+                if deadline.expired():
+                    # Keep what was streamed so far; a truncated answer is not cached
+                    cache_key = None
+                    break
+        finally:
+            # Release the provider stream and rate-limit slot promptly
+            stream.close()
+        
+        # Fallback and error responses are never cached
+        if cache_key:
+            self.cache.set(cache_key, "".join(chunks), self.provider, self.model)
+    
+    def _stream_uncached(
+        self,
+        system_message: str,
+        user_message: str,
+        max_tokens: int = None,
+        deadline: Deadline = None
+    ) -> Iterator[Tuple[str, bool]]:
+        """
+        Stream from the LLM provider once quota is available, holding the slot for the whole stream
+        
+        Yields:
+            Tuples of (chunk, ok) as from _stream_provider
+        """
+        deadline = deadline or NO_DEADLINE
+        tokens = self._estimate_call_tokens(system_message, user_message)
+        try:
+            with span('llm.queue_wait'), QUEUE_WAIT_SECONDS.labels(provider=self.provider).time():
+                self.rate_limiter.acquire(tokens, timeout=deadline.timeout(self.queue_timeout))
+            outcome = 'ok'
+            try:
+                with span('llm.provider_stream', provider=self.provider, max_tokens=max_tokens or self.max_tokens), \
+                        PROVIDER_SECONDS.labels(provider=self.provider, mode='stream').time():
+                    for chunk, ok in self._stream_provider(system_message, user_message, max_tokens, deadline.timeout(None)):
+                        if ok is False:
+                            outcome = 'error'
+                        elif ok is None and outcome == 'ok':
+                            outcome = 'truncated'
+                        yield chunk, ok
+            finally:
+                self.rate_limiter.release()
+                REQUESTS.labels(provider=self.provider, outcome=outcome).inc()
+        except RateLimitTimeout as e:
+            print(f"Rate limit queue timeout: {e}")
+            REQUESTS.labels(provider=self.provider, outcome='rate_limited').inc()
+            yield f"⚠️ Rate limited: {str(e)}\n\n📝 Fallback Description:\n{self._create_fallback_description(user_message)}", False
+    
+    def _stream_provider(
+        self,
+        system_message: str,
+        user_message: str,
+        max_tokens: int = None,
+        timeout: Optional[float] = None
+    ) -> Iterator[Tuple[str, bool]]:
+        """
+        Stream from the LLM provider
+        
+        Args:
+            max_tokens: Completion budget (default: self.max_tokens)
+            timeout: Request timeout in seconds (default: SDK default)
+        
+        Yields:
+            Tuples of (chunk, ok) where ok is False for fallback/error chunks. A stream
+            that ends for any reason but a normal stop finishes with ("", None) when it
+            was cut at the token limit (a valid but truncated answer) or ("", False)
+            when it was blocked; neither is cached
+        """
+        max_tokens = max_tokens or self.max_tokens
+        produced = False
+        try:
+            if self.provider == "gemini":
+                full_prompt = f"{system_message}\n\n{user_message}"
+                
+                response = self.client.generate_content(
+                    full_prompt,
+                    generation_config={
+                        'temperature': self.temperature,
+                        'max_output_tokens': max_tokens,
+                    },
+                    stream=True,
+                    **self._request_options(timeout)
+                )
+                
+                finish_reason = None
+                for chunk in response:
+                    if chunk.candidates:
+                        finish_reason = chunk.candidates[0].finish_reason
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        # Chunk blocked by safety filters or has no text parts
+                        continue
+                    if text:
+                        produced = True
+                        yield text, True
+                
+                # Anything but STOP (1) means the answer was cut short (2 MAX_TOKENS) or
+                # blocked (3 SAFETY, 4 RECITATION)
+                if produced and finish_reason is not None and finish_reason != 1:
+                    print(f"⚠️ Gemini stream ended with finish_reason {finish_reason}")
+                    yield "", None if finish_reason == 2 else False
+                
+            else:
+                # OpenAI and Groq share the chat completions streaming format
+                messages = [
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": user_message}
+                ]
+                
+                stream = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=self.temperature,
+                    max_tokens=max_tokens,
+                    stream=True,
+                    **self._request_options(timeout)
+                )
+                
+                finish_reason = None
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    finish_reason = chunk.choices[0].finish_reason or finish_reason
+                    text = chunk.choices[0].delta.content
+                    if text:
+                        produced = True
+                        yield text, True
+                
+                if produced and finish_reason not in (None, "stop"):
+                    print(f"⚠️ Stream ended with finish_reason {finish_reason}")
+                    yield "", None if finish_reason == "length" else False
+            
+            if not produced:
+                print("⚠️ Stream finished without any text")
+                yield self._create_fallback_description(user_message), False
+            
+        except Exception as e:
+            print(f"Error streaming text: {str(e)}")
+            prefix = "\n\n" if produced else ""
+            yield f"{prefix}⚠️ API Error: {str(e)}\n\n📝 Fallback Description:\n{self._create_fallback_description(user_message)}", False
+    
+    def generate_stream_from_context(
+        self,
+        context: dict,
+        bypass_cache: bool = False,
+        deadline: Deadline = None
+    ) -> Iterator[str]:
+        """
+        Stream generated text from context dictionary
+        
+        Args:
+            context: Dictionary with 'system' and 'user' keys
+            bypass_cache: Skip the response cache lookup
+            deadline: Request deadline
+            
+        Yields:
+            Generated text chunks
+        """
+        return self.generate_stream(context['system'], context['user'], bypass_cache=bypass_cache, deadline=deadline)
     
-    def generate_from_context(self, context: dict) -> str:
+    def generate_from_context(self, context: dict, bypass_cache: bool = False, deadline: Deadline = None) -> str:
         """
         Generate text from context dictionary
         
         Args:
             context: Dictionary with 'system' and 'user' keys
+            bypass_cache: Skip the response cache lookup
+            deadline: Request deadline
             
         Returns:
             Generated text
         """
-        return self.generate(context['system'], context['user'])
+        return self.generate(context['system'], context['user'], bypass_cache=bypass_cache, deadline=deadline)
     
     def _create_fallback_description(self, user_message: str) -> str:
         """
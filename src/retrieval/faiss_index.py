@@ -8,6 +8,15 @@ import faiss
 from pathlib import Path
 from typing import Tuple, List
 import pickle
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from src.utils.tracing import span
+from src.utils.telemetry import registry
+
+
+SEARCH_SECONDS = registry.histogram('faiss_search_seconds', 'FAISS index search latency')
 
 
 class FAISSIndex:
@@ -41,7 +50,13 @@ class FAISSIndex:
         
         print(f"FAISS index built with {self.index.ntotal} vectors")
         
-    def search(self, query_embedding: np.ndarray, k: int = 5, normalize: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    def search(
+        self,
+        query_embedding: np.ndarray,
+        k: int = 5,
+        normalize: bool = True,
+        nprobe: int = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
         """
         Search for top-k similar embeddings
         
@@ -49,6 +64,8 @@ class FAISSIndex:
             query_embedding: Query embedding (1 x D or D)
             k: Number of results to return
             normalize: Whether to normalize query
+            nprobe: Inverted lists to visit for IVF indexes (None = index default;
+                    ignored by exact indexes)
             
         Returns:
             Tuple of (distances, indices)
@@ -64,10 +81,26 @@ class FAISSIndex:
             faiss.normalize_L2(query_embedding)
         
         # Search
-        distances, indices = self.index.search(query_embedding.astype('float32'), k)
+        with span('faiss.search', k=k, ntotal=self.index.ntotal, nprobe=nprobe), SEARCH_SECONDS.time():
+            params = self._search_params(nprobe)
+            if params is not None:
+                distances, indices = self.index.search(query_embedding.astype('float32'), k, params=params)
+            else:
+                distances, indices = self.index.search(query_embedding.astype('float32'), k)
         
         return distances[0], indices[0]
     
+    def _search_params(self, nprobe: int = None):
+        """Per-call IVF parameters, so concurrent searches don't share a mutable nprobe"""
+        if nprobe is None or not hasattr(faiss, 'SearchParametersIVF'):
+            return None
+        try:
+            faiss.extract_index_ivf(self.index)
+        except RuntimeError:
+            # Not an IVF index (e.g. IndexFlatIP): search is exact and has no probes
+            return None
+        return faiss.SearchParametersIVF(nprobe=max(1, int(nprobe)))
+    
     def save(self, index_path: str):
         """Save FAISS index to file"""
         if self.index is None:
@@ -85,6 +118,23 @@ class FAISSIndex:
         print(f"Index loaded from {index_path}")
         print(f"Index contains {self.index.ntotal} vectors")
     
+    def reconstruct(self, indices: List[int]) -> np.ndarray:
+        """
+        Stored vectors of the given index positions
+        
+        Args:
+            indices: Positions in the index
+            
+        Returns:
+            Array (len(indices) x D); raises RuntimeError for indexes that can't
+            reconstruct (e.g. IVF without a direct map)
+        """
+        if self.index is None:
+            raise ValueError("Index not built. Call build_index first.")
+        if not len(indices):
+            return np.empty((0, self.embedding_dim), dtype='float32')
+        return np.vstack([self.index.reconstruct(int(i)) for i in indices])
+    
     @property
     def size(self) -> int:
         """Get number of vectors in index"""
@@ -3,23 +3,54 @@ Retriever Module
 Main retrieval engine for text-to-image, image-to-image, and multimodal search
 """
 
+import hashlib
 import json
 import numpy as np
 from pathlib import Path
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Union
 import sys
 
 sys.path.append(str(Path(__file__).parent.parent.parent))
 
-from src.models.clip_encoder import CLIPEncoder
 from src.retrieval.faiss_index import FAISSIndex
+from src.utils.deadline import Deadline, NO_DEADLINE
+from src.utils.tracing import span, traced
+from src.utils.telemetry import registry, timed
+
+
+SEARCH_SECONDS = registry.histogram(
+    'retrieval_search_seconds', 'End-to-end retrieval latency (encode + FAISS + metadata)', ['mode']
+)
+
+
+def compute_index_version(embeddings_dir: str, clip_model: str = "") -> str:
+    """
+    Identifier of an index build: changes whenever the index or metadata file is rewritten
+    
+    Args:
+        embeddings_dir: Directory containing faiss_index.bin and meta.json
+        clip_model: Encoder name (results also depend on the query encoder)
+        
+    Returns:
+        Short hex digest
+    """
+    digest = hashlib.sha256(clip_model.encode())
+    for name in ("faiss_index.bin", "meta.json"):
+        stat = (Path(embeddings_dir) / name).stat()
+        digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:16]
 
 
 class Retriever:
+    # Below this much remaining budget, IVF searches visit only FAST_NPROBE lists
+    FAST_SEARCH_SECONDS = 0.05
+    FAST_NPROBE = 1
+    
     def __init__(
         self,
         embeddings_dir: str = "embeddings",
-        clip_model: str = "openai/clip-vit-base-patch32"
+        clip_model: str = "openai/clip-vit-base-patch32",
+        encoder=None
     ):
         """
         Initialize retriever
@@ -27,6 +58,7 @@ class Retriever:
         Args:
             embeddings_dir: Directory containing embeddings and index
             clip_model: CLIP model name
+            encoder: Pre-built encoder (e.g. RemoteCLIPEncoder); a local CLIPEncoder is created if None
         """
         self.embeddings_dir = Path(embeddings_dir)
         
@@ -36,9 +68,12 @@ class Retriever:
         with open(meta_file, 'r') as f:
             self.metadata = json.load(f)
         
-        # Initialize CLIP encoder
-        print("Initializing CLIP encoder...")
-        self.encoder = CLIPEncoder(model_name=clip_model)
+        # Initialize CLIP encoder (imported lazily so remote-encoder workers never load torch)
+        if encoder is None:
+            from src.models.clip_encoder import CLIPEncoder
+            print("Initializing CLIP encoder...")
+            encoder = CLIPEncoder(model_name=clip_model)
+        self.encoder = encoder
         
         # Load FAISS index
         print("Loading FAISS index...")
@@ -46,90 +81,116 @@ class Retriever:
         index_file = self.embeddings_dir / "faiss_index.bin"
         self.index.load(str(index_file))
         
+        # Stored results (e.g. in history) are only reusable under the same version
+        self.index_version = compute_index_version(
+            self.embeddings_dir, getattr(self.encoder, 'model_name', clip_model)
+        )
+        
+        # Stored image vectors by image_id, for metrics over result sets; the embeddings
+        # file is memory-mapped on first use, so only the rows looked up are read
+        self._row_by_image_id = {meta['image_id']: row for row, meta in enumerate(self.metadata)}
+        self._embeddings = None
+        
         print(f"Retriever initialized with {len(self.metadata)} images")
     
-    def search_by_text(self, query: str, k: int = 5) -> Dict:
+    def _search_index(self, query_embedding: np.ndarray, k: int, deadline: Deadline):
+        """FAISS search with fewer probes when the remaining budget is tight"""
+        deadline.check('index search')
+        nprobe = None
+        if deadline.bounded and not deadline.allows(self.FAST_SEARCH_SECONDS):
+            nprobe = self.FAST_NPROBE
+        return self.index.search(query_embedding, k=k, nprobe=nprobe)
+    
+    def _format_results(self, distances: np.ndarray, indices: np.ndarray) -> List[Dict]:
+        """Attach metadata to FAISS hits"""
+        with span('retrieval.metadata', k=len(indices)):
+            formatted = []
+            for idx, (distance, index) in enumerate(zip(distances, indices)):
+                if 0 <= index < len(self.metadata):
+                    meta = self.metadata[index]
+                    formatted.append({
+                        'rank': idx + 1,
+                        'image_path': meta['path'],
+                        'file_name': meta['file_name'],
+                        'captions': meta['captions'],
+                        'similarity_score': float(distance),
+                        'image_id': meta['image_id']
+                    })
+            return formatted
+    
+    @timed(SEARCH_SECONDS, mode='text')
+    @traced('retrieval.search_by_text')
+    def search_by_text(self, query: str, k: int = 5, deadline: Deadline = None) -> Dict:
         """
         Search images by text query
         
         Args:
             query: Text query
             k: Number of results to return
+            deadline: Request deadline (raises DeadlineExceeded once spent)
             
         Returns:
             Dictionary with results
         """
+        deadline = deadline or NO_DEADLINE
+        deadline.check('text encoding')
+        
         # Encode query
         query_embedding = self.encoder.encode_text(query)
         
         # Search
-        distances, indices = self.index.search(query_embedding, k=k)
+        distances, indices = self._search_index(query_embedding, k, deadline)
         
         # Prepare results
         results = {
             'query': query,
             'query_type': 'text',
-            'results': []
+            'results': self._format_results(distances, indices)
         }
         
-        for idx, (distance, index) in enumerate(zip(distances, indices)):
-            if index < len(self.metadata):
-                meta = self.metadata[index]
-                results['results'].append({
-                    'rank': idx + 1,
-                    'image_path': meta['path'],
-                    'file_name': meta['file_name'],
-                    'captions': meta['captions'],
-                    'similarity_score': float(distance),
-                    'image_id': meta['image_id']
-                })
-        
         return results
     
-    def search_by_image(self, image_path: str, k: int = 5) -> Dict:
+    @timed(SEARCH_SECONDS, mode='image')
+    @traced('retrieval.search_by_image')
+    def search_by_image(self, image_path: str, k: int = 5, deadline: Deadline = None) -> Dict:
         """
         Search images by image query
         
         Args:
             image_path: Path to query image
             k: Number of results to return
+            deadline: Request deadline (raises DeadlineExceeded once spent)
             
         Returns:
             Dictionary with results
         """
+        deadline = deadline or NO_DEADLINE
+        deadline.check('image encoding')
+        
         # Encode image
         query_embedding = self.encoder.encode_image(image_path)
         
         # Search
-        distances, indices = self.index.search(query_embedding, k=k)
+        distances, indices = self._search_index(query_embedding, k, deadline)
         
         # Prepare results
         results = {
             'query': image_path,
             'query_type': 'image',
-            'results': []
+            'results': self._format_results(distances, indices)
         }
         
-        for idx, (distance, index) in enumerate(zip(distances, indices)):
-            if index < len(self.metadata):
-                meta = self.metadata[index]
-                results['results'].append({
-                    'rank': idx + 1,
-                    'image_path': meta['path'],
-                    'file_name': meta['file_name'],
-                    'captions': meta['captions'],
-                    'similarity_score': float(distance),
-                    'image_id': meta['image_id']
-                })
-        
         return results
     
+    @timed(SEARCH_SECONDS, mode='multimodal')
+    @traced('retrieval.search_by_multimodal')
     def search_by_multimodal(
         self, 
         query_text: str = None, 
         query_image: str = None,
         text_weight: float = 0.5,
-        k: int = 5
+        k: int = 5,
+        deadline: Deadline = None
     ) -> Dict:
         """
         Search using both text and image queries (multimodal)
@@ -140,6 +201,8 @@ class Retriever:
             text_weight: Weight for text embedding (0.0-1.0). 
                         0.0 = image only, 1.0 = text only, 0.5 = balanced
             k: Number of results to return
+            deadline: Request deadline. If it runs out after the text is encoded,
+                      the image is skipped and the search is text-only
             
         Returns:
             Dictionary with results
@@ -148,15 +211,22 @@ class Retriever:
         if query_text is None and query_image is None:
             raise ValueError("At least one of query_text or query_image must be provided")
         
+        deadline = deadline or NO_DEADLINE
+        deadline.check('query encoding')
+        
         # Encode text if provided
         text_embedding = None
         if query_text:
             text_embedding = self.encoder.encode_text(query_text)
         
-        # Encode image if provided
+        # Encode image if provided (and there is still time for it)
         image_embedding = None
+        image_skipped = False
         if query_image:
-            image_embedding = self.encoder.encode_image(query_image)
+            if text_embedding is not None and deadline.expired():
+                image_skipped = True
+            else:
+                image_embedding = self.encoder.encode_image(query_image)
         
         # Fuse embeddings
         if text_embedding is not None and image_embedding is not None:
@@ -173,8 +243,11 @@ class Retriever:
             # Image only
             fused_embedding = image_embedding
         
-        # Search
-        distances, indices = self.index.search(fused_embedding, k=k)
+        # Search (a text-only fallback still gets its search, even past the deadline)
+        if image_skipped:
+            distances, indices = self.index.search(fused_embedding, k=k, nprobe=self.FAST_NPROBE)
+        else:
+            distances, indices = self._search_index(fused_embedding, k, deadline)
         
         # Prepare results
         results = {
@@ -182,20 +255,10 @@ class Retriever:
             'query_image': query_image,
             'query_type': 'multimodal',
             'text_weight': text_weight,
-            'results': []
+            'results': self._format_results(distances, indices)
         }
-        
-        for idx, (distance, index) in enumerate(zip(distances, indices)):
-            if index < len(self.metadata):
-                meta = self.metadata[index]
-                results['results'].append({
-                    'rank': idx + 1,
-                    'image_path': meta['path'],
-                    'file_name': meta['file_name'],
-                    'captions': meta['captions'],
-                    'similarity_score': float(distance),
-                    'image_id': meta['image_id']
-                })
+        if image_skipped:
+            results['degraded'] = 'image query skipped: deadline exceeded'
         
         return results
     
@@ -227,6 +290,38 @@ class Retriever:
         
         return fused
     
+    def get_embeddings(self, image_ids: List[int]) -> Optional[np.ndarray]:
+        """
+        Stored (L2-normalized) image vectors, without re-encoding
+        
+        Args:
+            image_ids: Image IDs, e.g. of a result set
+            
+        Returns:
+            Array (len(image_ids) x D), or None if any ID is unknown or no stored
+            vectors are available
+        """
+        rows = [self._row_by_image_id.get(image_id) for image_id in image_ids]
+        if any(row is None for row in rows):
+            return None
+        
+        with span('retrieval.embeddings', k=len(rows)):
+            if self._embeddings is None:
+                embeddings_file = self.embeddings_dir / "image_embeddings.npy"
+                self._embeddings = np.load(embeddings_file, mmap_mode='r') if embeddings_file.exists() else False
+            
+            if self._embeddings is not False and len(self._embeddings) == len(self.metadata):
+                vectors = np.asarray(self._embeddings[rows], dtype=np.float32)
+            else:
+                # No embeddings file (or one from another build): read the index itself
+                try:
+                    vectors = self.index.reconstruct(rows)
+                except RuntimeError:
+                    return None
+            
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            return vectors / np.maximum(norms, 1e-12)
+    
     def get_captions_from_results(self, results: Dict) -> List[str]:
         """Extract all captions from search results"""
         captions = []
@@ -263,19 +263,25 @@ def main():
         if generate_text and text_gen:
             st.markdown('<div class="section-header">📄 Generated Description</div>', unsafe_allow_html=True)
             
-            with st.spinner("Generating description..."):
-                # Build query string for context
-                if query_mode == "Text Only":
-                    query_str = query_text
-                elif query_mode == "Image Only":
-                    query_str = "the uploaded image"
-                else:  # Multimodal
-                    query_str = f"{query_text} (with reference image)"
-                
-                context = context_builder.build_context(query_str, all_captions)
-                description = text_gen.generate_from_context(context)
+            # Build query string for context
+            if query_mode == "Text Only":
+                query_str = query_text
+            elif query_mode == "Image Only":
+                query_str = "the uploaded image"
+            else:  # Multimodal
+                query_str = f"{query_text} (with reference image)"
+            
+            context = context_builder.build_context(query_str, all_captions)
+            
+            # Stream tokens as the provider sends them
+            description_box = st.empty()
+            description_box.caption("Generating description...")
+            description = ""
+            for chunk in text_gen.generate_stream_from_context(context):
+                description += chunk
+                description_box.markdown(f'<div class="result-card">{description}▌</div>', unsafe_allow_html=True)
             
-            st.markdown(f'<div class="result-card">{description}</div>', unsafe_allow_html=True)
+            description_box.markdown(f'<div class="result-card">{description}</div>', unsafe_allow_html=True)
         
         # Generate new image
         if generate_image and image_gen:
@@ -9,6 +9,7 @@ import sys
 from pathlib import Path
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Add parent directory to path
 sys.path.append(str(Path(__file__).parent.parent.parent))
@@ -213,6 +214,12 @@ def load_image_generator():
         return None
 
 
+@st.cache_resource
+def load_history_manager():
+    """Load history manager (cached, so one background writer serves every rerun)"""
+    return HistoryManager()
+
+
 def main():
     # Header Section
     st.markdown("""
@@ -231,12 +238,12 @@ def main():
         st.code("python scripts/setup.py")
         return
     
-    context_builder = ContextBuilder()
+    context_builder = ContextBuilder(encoder=retriever.encoder)
     text_gen = load_text_generator()
     image_gen = load_image_generator()
     
     # Initialize history manager
-    history_manager = HistoryManager()
+    history_manager = load_history_manager()
     
     # Check if loading from history
     if 'load_query_id' in st.session_state:
@@ -378,7 +385,7 @@ def main():
             st.markdown("#### Query History")
             
             # Get recent queries
-            queries = history_manager.get_all_queries(limit=20)
+            queries = history_manager.list_queries(limit=20)['queries']
             
             if queries:
                 st.caption(f"Showing {len(queries)} recent queries")
@@ -531,7 +538,9 @@ def main():
                 os.remove(temp_path)
         
         retrieval_time = time.time() - retrieval_start
-        retrieval_metrics = calc.calculate_retrieval_metrics(results)
+        retrieval_metrics = calc.calculate_retrieval_metrics(
+            results, embeddings=retriever.get_embeddings([r['image_id'] for r in results['results']])
+        )
         
         # --- Results Display ---
         st.markdown('<div class="section-header">🏆 Top Results</div>', unsafe_allow_html=True)
@@ -572,6 +581,20 @@ def main():
         # Two columns for generation outputs if both active
         gen_col1, gen_col2 = st.columns(2 if (generate_text and generate_image) else 1)
         
+        # Start image generation in the background so it overlaps the text stream
+        image_future = None
+        if generate_image and image_gen:
+            query_str = query_text if query_mode != "Image Only" else ""
+            img_prompt = context_builder.build_image_generation_prompt(query_str, all_captions)
+            
+            def timed_txt2img(prompt):
+                start = time.time()
+                return image_gen.txt2img(prompt), time.time() - start
+            
+            image_executor = ThreadPoolExecutor(max_workers=1)
+            image_future = image_executor.submit(timed_txt2img, img_prompt)
+            image_executor.shutdown(wait=False)
+        
         # Text Generation
         if generate_text and text_gen:
             with gen_col1:
@@ -579,21 +602,35 @@ def main():
                 st.markdown('<div class="section-header">🤖 AI Synthesis</div>', unsafe_allow_html=True)
                 
                 text_gen_start = time.time()
-                with st.spinner("Writing description..."):
-                    if query_mode == "Text Only":
-                        query_str = query_text
-                    elif query_mode == "Image Only":
-                        query_str = "the uploaded image"
-                    else:
-                        query_str = f"{query_text} (with reference image)"
-                    
-                    context = context_builder.build_context(query_str, all_captions)
-                    description = text_gen.generate_from_context(context)
+                if query_mode == "Text Only":
+                    query_str = query_text
+                elif query_mode == "Image Only":
+                    query_str = "the uploaded image"
+                else:
+                    query_str = f"{query_text} (with reference image)"
+                
+                relevance = [r['similarity_score'] for r in results['results'] for _ in r['captions']]
+                groups = [i for i, r in enumerate(results['results']) for _ in r['captions']]
+                context = context_builder.build_budgeted_context(
+                    query_str, all_captions, relevance=relevance, groups=groups
+                )
+                
+                # Stream tokens into the card as the provider sends them
+                description_box = st.empty()
+                description_box.caption("Writing description...")
+                description = ""
+                for chunk in text_gen.generate_stream_from_context(context):
+                    description += chunk
+                    description_box.markdown(f"""
+                        <div style="background: #F3F4F6; padding: 1rem; border-radius: 0.5rem; font-style: italic; color: #4B5563;">
+                            "{description}▌"
+                        </div>
+                    """, unsafe_allow_html=True)
                 
                 text_gen_time = time.time() - text_gen_start
                 text_metrics = calc.calculate_text_metrics(description)
                 
-                st.markdown(f"""
+                description_box.markdown(f"""
                     <div style="background: #F3F4F6; padding: 1rem; border-radius: 0.5rem; font-style: italic; color: #4B5563;">
                         "{description}"
                     </div>
@@ -607,22 +644,17 @@ def main():
                 st.markdown('<div class="css-card">', unsafe_allow_html=True)
                 st.markdown('<div class="section-header">🎨 Dreamed Image</div>', unsafe_allow_html=True)
                 
-                image_gen_start = time.time()
+                with st.expander("View Prompt"):
+                    st.caption(img_prompt)
+                
                 with st.spinner("Dreaming up visual..."):
-                    query_str = query_text if query_mode != "Image Only" else ""
-                    img_prompt = context_builder.build_image_generation_prompt(query_str, all_captions)
-                    
-                    with st.expander("View Prompt"):
-                        st.caption(img_prompt)
-                    
-                    generated_img = image_gen.txt2img(img_prompt)
+                    generated_img, image_gen_time = image_future.result()
                     
                     if generated_img:
                         st.image(generated_img, use_container_width=True)
                     else:
                         st.error("Generation failed.")
                 
-                image_gen_time = time.time() - image_gen_start
                 st.markdown('</div>', unsafe_allow_html=True)
 
         total_time = time.time() - total_start
@@ -638,6 +670,13 @@ def main():
                 st.markdown('<div class="metric-label">Avg Similarity</div>', unsafe_allow_html=True)
                 st.markdown(f'<div class="metric-value">{retrieval_metrics["avg_similarity"]:.3f}</div>', unsafe_allow_html=True)
                 st.markdown(f'<small style="color:#6B7280">Diversity: {retrieval_metrics["diversity"]:.1%}</small>', unsafe_allow_html=True)
+                if 'embedding_diversity' in retrieval_metrics:
+                    st.markdown(
+                        f'<small style="color:#6B7280">Embedding diversity: {retrieval_metrics["embedding_diversity"]:.3f} · '
+                        f'Coverage: {retrieval_metrics["embedding_coverage"]:.1%} · '
+                        f'Redundancy: {retrieval_metrics["redundancy"]:.0%}</small>',
+                        unsafe_allow_html=True
+                    )
                 st.markdown('</div>', unsafe_allow_html=True)
                 
             with m2:
@@ -654,7 +693,7 @@ def main():
                 st.markdown('<div class="metric-container">', unsafe_allow_html=True)
                 st.markdown('<div class="metric-label">Total Latency</div>', unsafe_allow_html=True)
                 st.markdown(f'<div class="metric-value">{total_time:.2f}s</div>', unsafe_allow_html=True)
-                st.markdown(f'<small style="color:#6B7280">Ret: {retrieval_time:.2f}s | Gen: {text_gen_time+image_gen_time:.2f}s</small>', unsafe_allow_html=True)
+                st.markdown(f'<small style="color:#6B7280">Ret: {retrieval_time:.2f}s | Text: {text_gen_time:.2f}s | Image: {image_gen_time:.2f}s (parallel)</small>', unsafe_allow_html=True)
                 st.markdown('</div>', unsafe_allow_html=True)
         
         # --- Save to History ---
@@ -668,7 +707,8 @@ def main():
                         'query_text': query_text,
                         'query_image': query_image,
                         'text_weight': text_weight if query_mode == "Text + Image (Multimodal)" else None,
-                        'top_k': top_k
+                        'top_k': top_k,
+                        'index_version': retriever.index_version
                     },
                     results=results,
                     retrieval_metrics=retrieval_metrics,
@@ -694,7 +734,8 @@ def main():
                             'query_text': query_text,
                             'query_image': query_image,
                             'text_weight': text_weight if query_mode == "Text + Image (Multimodal)" else None,
-                            'top_k': top_k
+                            'top_k': top_k,
+                            'index_version': retriever.index_version
                         },
                         results=results,
                         retrieval_metrics=retrieval_metrics,
@@ -179,12 +179,18 @@ def main():
         if generate_text and text_gen:
             st.markdown('<div class="section-header">📄 Generated Description</div>', unsafe_allow_html=True)
             
-            with st.spinner("Generating description..."):
-                query_str = query_text if query_type == "Text" else "the uploaded image"
-                context = context_builder.build_context(query_str, all_captions)
-                description = text_gen.generate_from_context(context)
+            query_str = query_text if query_type == "Text" else "the uploaded image"
+            context = context_builder.build_context(query_str, all_captions)
             
-            st.markdown(f'<div class="result-card">{description}</div>', unsafe_allow_html=True)
+            # Stream tokens as the provider sends them
+            description_box = st.empty()
+            description_box.caption("Generating description...")
+            description = ""
+            for chunk in text_gen.generate_stream_from_context(context):
+                description += chunk
+                description_box.markdown(f'<div class="result-card">{description}▌</div>', unsafe_allow_html=True)
+            
+            description_box.markdown(f'<div class="result-card">{description}</div>', unsafe_allow_html=True)
         
         # Generate new image
         if generate_image and image_gen:
@@ -416,21 +416,31 @@ def main():
                 st.markdown('<div class="section-header">🤖 AI Synthesis</div>', unsafe_allow_html=True)
                 
                 text_gen_start = time.time()
-                with st.spinner("Writing description..."):
-                    if query_mode == "Text Only":
-                        query_str = query_text
-                    elif query_mode == "Image Only":
-                        query_str = "the uploaded image"
-                    else:
-                        query_str = f"{query_text} (with reference image)"
-                    
-                    context = context_builder.build_context(query_str, all_captions)
-                    description = text_gen.generate_from_context(context)
+                if query_mode == "Text Only":
+                    query_str = query_text
+                elif query_mode == "Image Only":
+                    query_str = "the uploaded image"
+                else:
+                    query_str = f"{query_text} (with reference image)"
+                
+                context = context_builder.build_context(query_str, all_captions)
+                
+                # Stream tokens into the card as the provider sends them
+                description_box = st.empty()
+                description_box.caption("Writing description...")
+                description = ""
+                for chunk in text_gen.generate_stream_from_context(context):
+                    description += chunk
+                    description_box.markdown(f"""
+                        <div style="background: #F3F4F6; padding: 1rem; border-radius: 0.5rem; font-style: italic; color: #4B5563;">
+                            "{description}▌"
+                        </div>
+                    """, unsafe_allow_html=True)
                 
                 text_gen_time = time.time() - text_gen_start
                 text_metrics = calc.calculate_text_metrics(description)
                 
-                st.markdown(f"""
+                description_box.markdown(f"""
                     <div style="background: #F3F4F6; padding: 1rem; border-radius: 0.5rem; font-style: italic; color: #4B5563;">
                         "{description}"
                     </div>
@@ -0,0 +1,249 @@
+"""
+Admission Control for API Endpoints
+Per-endpoint concurrency limits with bounded, deadline-aware queues and priority classes
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+
+# Share of the process-wide slot budget each priority class may occupy. Lower
+# classes stop being admitted first, keeping headroom for cheap requests.
+PRIORITY_SHARES = {
+    'high': 1.0,
+    'normal': 0.75,
+    'low': 0.5
+}
+
+
+class Overloaded(RuntimeError):
+    """Raised when a request is shed instead of admitted"""
+
+    def __init__(self, message: str, status: int, retry_after: int):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class _Gate:
+    """Limits and counters for one endpoint class"""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float, priority: str):
+        if priority not in PRIORITY_SHARES:
+            raise ValueError(f"Unknown priority: {priority}")
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.priority = priority
+
+        self.queue = deque()
+        self.in_flight = 0
+        self.avg_service_time = 1.0
+
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.total_wait = 0.0
+
+
+class Admission:
+    """A granted slot; release it when the request finishes"""
+
+    def __init__(self, controller: 'AdmissionController', gate: _Gate, waited: float):
+        self._controller = controller
+        self._gate = gate
+        self._start = time.monotonic()
+        self._released = False
+        self.waited = waited
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self._gate, time.monotonic() - self._start)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """
+    Admits requests per endpoint class. A request starts when its class has a
+    free slot and the process-wide budget for its priority is not used up;
+    otherwise it waits in a bounded FIFO queue until its queue deadline.
+    """
+
+    def __init__(self, max_total: int = 16):
+        """
+        Initialize controller
+
+        Args:
+            max_total: Concurrent requests across all classes in this process
+        """
+        self.max_total = max_total
+        self.in_flight = 0
+        self._gates: Dict[str, _Gate] = {}
+        self._cond = threading.Condition()
+
+    def register(
+        self,
+        name: str,
+        max_concurrent: int,
+        max_queue: int = 0,
+        queue_timeout: float = 0.0,
+        priority: str = 'normal'
+    ):
+        """
+        Register an endpoint class
+
+        Args:
+            name: Class name (e.g. 'generate_image')
+            max_concurrent: In-flight requests of this class
+            max_queue: Requests allowed to wait for a slot (beyond that: 429)
+            queue_timeout: Seconds a request may wait before being shed (503)
+            priority: 'high', 'normal' or 'low'
+        """
+        with self._cond:
+            self._gates[name] = _Gate(name, max_concurrent, max_queue, queue_timeout, priority)
+
+    def _priority_cap(self, priority: str) -> int:
+        return max(1, int(self.max_total * PRIORITY_SHARES[priority]))
+
+    def _can_start(self, gate: _Gate) -> bool:
+        return (
+            gate.in_flight < gate.max_concurrent and
+            self.in_flight < self._priority_cap(gate.priority)
+        )
+
+    def _retry_after(self, gate: _Gate) -> int:
+        """Seconds until a retry is likely to be admitted, from the recent service time"""
+        backlog = len(gate.queue) + 1
+        return max(1, math.ceil(gate.avg_service_time * backlog / max(1, gate.max_concurrent)))
+
+    def acquire(self, name: str, timeout: Optional[float] = None) -> Admission:
+        """
+        Wait for a slot in an endpoint class
+
+        Args:
+            name: Class name
+            timeout: Cap on the queue wait in seconds, e.g. the request's remaining deadline
+
+        Returns:
+            Admission to release when the request completes
+
+        Raises:
+            KeyError: If the class is not registered
+            Overloaded: 429 if the queue is full, 503 if the queue deadline passes
+        """
+        gate = self._gates[name]
+        timeout = gate.queue_timeout if timeout is None else min(timeout, gate.queue_timeout)
+        start = time.monotonic()
+        deadline = start + timeout
+
+        with self._cond:
+            if not gate.queue and self._can_start(gate):
+                return self._admit(gate, start)
+
+            if len(gate.queue) >= gate.max_queue:
+                gate.rejected_queue_full += 1
+                raise Overloaded(
+                    f"{name} is saturated ({gate.in_flight} running, {len(gate.queue)} queued)",
+                    status=429,
+                    retry_after=self._retry_after(gate)
+                )
+
+            ticket = object()
+            gate.queue.append(ticket)
+            try:
+                while not (gate.queue[0] is ticket and self._can_start(gate)):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        gate.rejected_timeout += 1
+                        raise Overloaded(
+                            f"{name} had no free slot within {timeout:.1f}s",
+                            status=503,
+                            retry_after=self._retry_after(gate)
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                gate.queue.remove(ticket)
+                self._cond.notify_all()
+
+            return self._admit(gate, start)
+
+    def _admit(self, gate: _Gate, start: float) -> Admission:
+        waited = time.monotonic() - start
+        gate.in_flight += 1
+        self.in_flight += 1
+        gate.admitted += 1
+        gate.total_wait += waited
+        return Admission(self, gate, waited)
+
+    def _release(self, gate: _Gate, service_time: float):
+        with self._cond:
+            gate.in_flight = max(0, gate.in_flight - 1)
+            self.in_flight = max(0, self.in_flight - 1)
+            # Exponential moving average feeds the Retry-After estimate
+            gate.avg_service_time = 0.8 * gate.avg_service_time + 0.2 * service_time
+            self._cond.notify_all()
+
+    def get_statistics(self) -> Dict:
+        """
+        Get admission statistics
+
+        Returns:
+            Dictionary with process-wide and per-class load and shed counts
+        """
+        with self._cond:
+            return {
+                'max_total': self.max_total,
+                'in_flight': self.in_flight,
+                'classes': {
+                    gate.name: {
+                        'priority': gate.priority,
+                        'max_concurrent': gate.max_concurrent,
+                        'max_queue': gate.max_queue,
+                        'queue_timeout': gate.queue_timeout,
+                        'in_flight': gate.in_flight,
+                        'queued': len(gate.queue),
+                        'admitted': gate.admitted,
+                        'rejected_queue_full': gate.rejected_queue_full,
+                        'rejected_timeout': gate.rejected_timeout,
+                        'avg_wait': gate.total_wait / gate.admitted if gate.admitted else 0.0,
+                        'avg_service_time': gate.avg_service_time
+                    }
+                    for gate in self._gates.values()
+                }
+            }
+
+
+if __name__ == "__main__":
+    # Test admission control: slow generation saturates, text search stays responsive
+    from concurrent.futures import ThreadPoolExecutor
+
+    controller = AdmissionController(max_total=4)
+    controller.register('generate_image', max_concurrent=4, max_queue=2, queue_timeout=0.3, priority='low')
+    controller.register('search_text', max_concurrent=4, max_queue=8, queue_timeout=1.0, priority='high')
+
+    def call(name, duration):
+        try:
+            with controller.acquire(name) as admission:
+                time.sleep(duration)
+                return f"{name}: ok (waited {admission.waited:.2f}s)"
+        except Overloaded as e:
+            return f"{name}: {e.status} retry after {e.retry_after}s"
+
+    with ThreadPoolExecutor(max_workers=12) as pool:
+        futures = [pool.submit(call, 'generate_image', 0.5) for _ in range(6)]
+        time.sleep(0.05)
+        futures += [pool.submit(call, 'search_text', 0.05) for _ in range(4)]
+        for future in futures:
+            print(future.result())
+
+    print(f"Statistics: {controller.get_statistics()}")
@@ -0,0 +1,181 @@
+"""
+Component Registry
+Lazy, thread-safe, on-first-use initialisation of heavy components with optional background warm-up
+"""
+
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+class ComponentUnavailable(RuntimeError):
+    """Raised when a component failed to initialise"""
+
+
+class ComponentRegistry:
+    """
+    Holds factories for components (retriever, generators, ...) and builds each
+    one the first time it is requested. Concurrent callers of the same component
+    wait for a single initialisation. A failed component is retried after a
+    backoff that doubles with each consecutive failure.
+    """
+
+    def __init__(self, retry_seconds: float = 30.0, max_retry_seconds: float = 600.0):
+        """
+        Initialize component registry
+
+        Args:
+            retry_seconds: Delay before a failed component may be initialised again
+            max_retry_seconds: Cap on the doubling retry delay
+        """
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self._factories: Dict[str, Callable] = {}
+        self._instances: Dict[str, object] = {}
+        self._errors: Dict[str, str] = {}
+        self._failures: Dict[str, int] = {}
+        self._retry_at: Dict[str, float] = {}
+        self._load_times: Dict[str, float] = {}
+        self._loading = set()
+        self._locks: Dict[str, threading.Lock] = {}
+        self._registry_lock = threading.Lock()
+        self._warmup_threads: List[threading.Thread] = []
+
+    def register(self, name: str, factory: Callable):
+        """
+        Register a component factory
+
+        Args:
+            name: Component name
+            factory: Zero-argument callable building the component; it may
+                     call registry.get() for its own dependencies
+        """
+        with self._registry_lock:
+            self._factories[name] = factory
+            self._locks[name] = threading.Lock()
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def get(self, name: str):
+        """
+        Get a component, initialising it on first use
+
+        Args:
+            name: Component name
+
+        Returns:
+            Component instance (factories may return None for optional components)
+
+        Raises:
+            KeyError: If the component is not registered
+            ComponentUnavailable: If initialisation failed (until the retry backoff passes)
+        """
+        if name in self._instances:
+            return self._instances[name]
+        if name not in self._factories:
+            raise KeyError(f"Unknown component: {name}")
+
+        with self._locks[name]:
+            if name in self._instances:
+                return self._instances[name]
+            if name in self._errors and not self.retry_due(name):
+                raise ComponentUnavailable(f"{name} failed to initialise: {self._errors[name]}")
+
+            self._loading.add(name)
+            start = time.time()
+            try:
+                print(f"Initializing {name}...")
+                instance = self._factories[name]()
+            except Exception as e:
+                self._errors[name] = str(e)
+                self._failures[name] = self._failures.get(name, 0) + 1
+                delay = min(self.retry_seconds * 2 ** (self._failures[name] - 1), self.max_retry_seconds)
+                self._retry_at[name] = time.time() + delay
+                traceback.print_exc()
+                print(f"{name} will be retried in {delay:.0f}s")
+                raise ComponentUnavailable(f"{name} failed to initialise: {e}") from e
+            finally:
+                self._loading.discard(name)
+
+            self._load_times[name] = time.time() - start
+            self._instances[name] = instance
+            self._errors.pop(name, None)
+            self._failures.pop(name, None)
+            self._retry_at.pop(name, None)
+            print(f"{name} initialized in {self._load_times[name]:.2f}s")
+            return instance
+
+    def reset(self, name: str):
+        """Forget a failed (or loaded) component so the next get() retries"""
+        with self._locks[name]:
+            self._instances.pop(name, None)
+            self._errors.pop(name, None)
+            self._failures.pop(name, None)
+            self._retry_at.pop(name, None)
+
+    def retry_due(self, name: str) -> bool:
+        """True if a failed component's retry backoff has passed"""
+        return time.time() >= self._retry_at.get(name, 0.0)
+
+    def warm_up(self, names: Iterable[str], background: bool = True) -> Optional[threading.Thread]:
+        """
+        Initialise components ahead of the first request
+
+        Args:
+            names: Components to initialise, in order
+            background: Run in a daemon thread instead of blocking
+
+        Returns:
+            Warm-up thread if background, else None
+        """
+        names = [n for n in names if n]
+
+        def run():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    print(f"Warm-up of {name} failed: {e}")
+
+        if not background:
+            run()
+            return None
+
+        thread = threading.Thread(target=run, name="component-warmup", daemon=True)
+        thread.start()
+        self._warmup_threads.append(thread)
+        return thread
+
+    def state(self, name: str) -> str:
+        if name in self._instances:
+            return 'ready'
+        if name in self._loading:
+            return 'loading'
+        if name in self._errors:
+            return 'failed'
+        return 'not_loaded'
+
+    def status(self) -> Dict[str, Dict]:
+        """
+        Get per-component status
+
+        Returns:
+            Dictionary of name -> state, load time, error, failure count and
+            seconds until the next retry
+        """
+        return {
+            name: {
+                'state': self.state(name),
+                'load_time': self._load_times.get(name),
+                'error': self._errors.get(name),
+                'failures': self._failures.get(name, 0),
+                'retry_in': max(0.0, self._retry_at[name] - time.time()) if name in self._retry_at else None
+            }
+            for name in self._factories
+        }
+
+    def ready(self, names: Iterable[str]) -> bool:
+        """True if all named components are initialised"""
+        return all(self.state(name) == 'ready' for name in names)
@@ -0,0 +1,116 @@
+"""
+Request Deadlines
+A time budget created at the API layer and passed down through retrieval and generation
+"""
+
+import time
+from typing import Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a stage cannot start (or continue) within the remaining budget"""
+
+    def __init__(self, stage: str, budget: Optional[float]):
+        budget_str = f"{budget * 1000:.0f}ms" if budget is not None else "unbounded"
+        super().__init__(f"Deadline exceeded before {stage} (budget {budget_str})")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    Absolute point in time by which a request must finish. Stages read the
+    remaining time to pick cheaper settings, cap their own timeouts, or skip work.
+    """
+
+    def __init__(self, seconds: Optional[float] = None):
+        """
+        Initialize deadline
+
+        Args:
+            seconds: Budget from now (None = no deadline)
+        """
+        self.budget = seconds
+        self.start = time.monotonic()
+        self.expires_at = self.start + seconds if seconds is not None else None
+        self.cancelled = False
+
+    @classmethod
+    def from_ms(cls, milliseconds) -> 'Deadline':
+        """Deadline from a millisecond budget such as a request's deadline_ms (None/0 = no deadline)"""
+        if milliseconds in (None, '', 0, '0'):
+            return cls(None)
+        return cls(float(milliseconds) / 1000.0)
+
+    @property
+    def bounded(self) -> bool:
+        return self.expires_at is not None
+
+    def remaining(self) -> float:
+        """Seconds left (inf if unbounded, never negative)"""
+        if self.expires_at is None:
+            return float('inf')
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def allows(self, seconds: float) -> bool:
+        """True if at least this many seconds remain"""
+        return self.remaining() >= seconds
+
+    def check(self, stage: str):
+        """
+        Raise if the budget is spent
+
+        Args:
+            stage: Stage about to run, for the error message
+
+        Raises:
+            DeadlineExceeded: If no time remains
+        """
+        if self.expired():
+            raise DeadlineExceeded(stage, self.budget)
+
+    def timeout(self, default: Optional[float]) -> Optional[float]:
+        """
+        Timeout for a blocking call: the default, capped by the remaining budget
+
+        Args:
+            default: Stage's own timeout (None = none)
+
+        Returns:
+            Seconds to wait, or None if both are unbounded
+        """
+        if self.expires_at is None:
+            return default
+        if default is None:
+            return self.remaining()
+        return min(default, self.remaining())
+
+    def derive(self) -> 'Deadline':
+        """
+        Copy with the same expiry that can be cancelled on its own, e.g. one of
+        several attempts racing to answer the same request
+        """
+        child = Deadline(None)
+        child.budget, child.start, child.expires_at = self.budget, self.start, self.expires_at
+        return child
+
+    def cancel(self):
+        """Expire now, so stages checking this deadline stop at their next check"""
+        self.cancelled = True
+        self.expires_at = time.monotonic()
+
+    def to_dict(self) -> dict:
+        return {
+            'budget_ms': self.budget * 1000 if self.budget is not None else None,
+            'elapsed_ms': self.elapsed() * 1000,
+            'remaining_ms': self.remaining() * 1000 if self.bounded else None
+        }
+
+
+# Shared unbounded deadline for callers that did not pass one
+NO_DEADLINE = Deadline(None)
@@ -3,41 +3,151 @@ History Manager for Query Storage
 Manages SQLite database and file storage for query history
 """
 
-import sqlite3
+import atexit
+import base64
+import hashlib
+import os
 import json
-from datetime import datetime
+import sqlite3
+import threading
+import time
+import unicodedata
+from datetime import datetime, timezone
 from pathlib import Path
 import shutil
 from PIL import Image
 from typing import Dict, List, Optional
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from src.utils.telemetry import registry, timed
+from src.utils.sqlite_pool import PoolTimeout, SQLitePool
+from src.utils.write_behind import WriteBehindQueue
+from src.utils.image_store import ImageStore
+from src.utils import history_stats, history_retention
+
+
+OPERATION_SECONDS = registry.histogram('history_operation_seconds', 'History database operation latency', ['operation'])
+WRITE_RETRIES = registry.counter('history_write_retries_total', 'History save transactions retried after a transient error')
+WRITE_FAILURES = registry.counter('history_write_failures_total', 'Queued history saves dropped after their retries')
+
+# Errors worth retrying a save for (database locked or busy, pool exhausted)
+TRANSIENT_WRITE_ERRORS = (sqlite3.OperationalError, PoolTimeout)
+
+INSERT_QUERY_SQL = '''
+    INSERT INTO queries (
+        id, timestamp, query_mode, query_text, query_image_path, text_weight, top_k,
+        retrieval_time, avg_similarity, diversity,
+        min_similarity, max_similarity, std_similarity,
+        generated_text, generated_image_path,
+        word_count, sentence_count, vocabulary_richness, avg_word_length,
+        text_gen_time, image_gen_time, total_time,
+        query_image_hash, generated_image_hash, query_key, index_version, query_image_dhash
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Columns for history lists: enough for a sidebar entry, without the full generated text
+LIST_COLUMNS = '''
+    id, timestamp, query_mode, substr(query_text, 1, 200) AS query_text, text_weight, top_k,
+    avg_similarity, total_time, substr(generated_text, 1, 160) AS generated_preview,
+    query_image_path IS NOT NULL AS has_query_image,
+    generated_image_path IS NOT NULL AS has_generated_image,
+    query_image_hash, generated_image_hash
+'''
+
+INSERT_RESULT_SQL = '''
+    INSERT INTO retrieval_results (
+        query_id, rank, image_path, file_name,
+        similarity_score, captions, image_id
+    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Retrieval result fields in the shape the retriever returns them
+RESULT_FIELDS = ('rank', 'image_path', 'file_name', 'captions', 'similarity_score', 'image_id')
+
+# A near-exact image repeat shares the 8x8 hash in query_key and is confirmed with a
+# 16x16 hash within this many of its 256 bits (or identical pixels)
+VERIFY_HASH_SIZE = 16
+VERIFY_MAX_DISTANCE = 12
 
 
 class HistoryManager:
     """Manage query history with SQLite database"""
     
-    def __init__(self, db_path='history/queries.db'):
+    # Query IDs reserved from the database per allocation
+    ID_BLOCK_SIZE = 32
+    
+    def __init__(self, db_path='history/queries.db', pool: SQLitePool = None, write_behind: bool = None):
         """
         Initialize history manager
         
         Args:
             db_path: Path to SQLite database file
+            pool: Connection pool (default: WAL pool sized by HISTORY_POOL_SIZE, 8)
+            write_behind: Queue saves for a background writer (default: HISTORY_WRITE_BEHIND env var, on)
         """
         self.db_path = db_path
+        self.pool = pool or SQLitePool(
+            db_path,
+            max_connections=int(os.getenv("HISTORY_POOL_SIZE", 8)),
+            busy_timeout=float(os.getenv("HISTORY_BUSY_TIMEOUT", 5.0))
+        )
         self.history_dir = Path('history')
-        self.query_images_dir = self.history_dir / 'query_images'
-        self.generated_images_dir = self.history_dir / 'generated_images'
-        
-        # Create directories
         self.history_dir.mkdir(exist_ok=True)
-        self.query_images_dir.mkdir(exist_ok=True)
-        self.generated_images_dir.mkdir(exist_ok=True)
+        
+        # Query and generated images, stored once per distinct image
+        self.image_store = ImageStore(
+            root=str(self.history_dir / 'images'),
+            image_format=os.getenv("HISTORY_IMAGE_FORMAT", "JPEG"),
+            quality=int(os.getenv("HISTORY_IMAGE_QUALITY", 90)),
+            thumbnail_size=int(os.getenv("HISTORY_THUMBNAIL_SIZE", 256))
+        )
         
         # Initialize database
         self._init_db()
+        
+        self._id_lock = threading.Lock()
+        self._id_block_next = self._id_block_end = 0
+        
+        if write_behind is None:
+            write_behind = os.getenv("HISTORY_WRITE_BEHIND", "true").lower() in ("1", "true", "yes")
+        self.writer = None
+        if write_behind:
+            self.writer = WriteBehindQueue(
+                self._write_batch,
+                max_batch=int(os.getenv("HISTORY_WRITE_BATCH", 64)),
+                max_delay=float(os.getenv("HISTORY_WRITE_DELAY_MS", 20)) / 1000.0,
+                name="history-writer"
+            )
+        # Transient write errors are retried with a doubling backoff before a save is dropped
+        self.write_retries = int(os.getenv("HISTORY_WRITE_RETRIES", 3))
+        self.write_retry_delay = float(os.getenv("HISTORY_WRITE_RETRY_MS", 100)) / 1000.0
+        self._write_failures = 0
+        
+        # Retention policy (HISTORY_RETENTION_DAYS / HISTORY_MAX_QUERIES), applied periodically if set
+        self.retention_days = float(os.getenv("HISTORY_RETENTION_DAYS")) if os.getenv("HISTORY_RETENTION_DAYS") else None
+        self.max_queries = int(os.getenv("HISTORY_MAX_QUERIES")) if os.getenv("HISTORY_MAX_QUERIES") else None
+        self.archive_enabled = os.getenv("HISTORY_ARCHIVE", "true").lower() in ("1", "true", "yes")
+        self.archive_dir = os.getenv("HISTORY_ARCHIVE_DIR", str(self.history_dir / 'archive'))
+        self.archive_format = os.getenv("HISTORY_ARCHIVE_FORMAT", "parquet").lower()
+        self._retention_stop = threading.Event()
+        retention_interval = float(os.getenv("HISTORY_RETENTION_INTERVAL_HOURS", 0))
+        if retention_interval > 0 and (self.retention_days is not None or self.max_queries is not None):
+            threading.Thread(
+                target=self._retention_loop, args=(retention_interval * 3600,),
+                name="history-retention", daemon=True
+            ).start()
+        
+        # Queued saves are written (and the WAL checkpointed) when the process exits
+        atexit.register(self.close)
     
     def _init_db(self):
         """Create database tables if they don't exist"""
-        conn = sqlite3.connect(self.db_path)
+        with self.pool.transaction() as conn:
+            self._create_tables(conn)
+    
+    def _create_tables(self, conn):
         cursor = conn.cursor()
         
         # Create queries table
@@ -72,10 +182,21 @@ class HistoryManager:
                 -- Performance
                 text_gen_time REAL,
                 image_gen_time REAL,
-                total_time REAL
+                total_time REAL,
+                
+                -- Image store blobs (NULL for images saved before the store existed)
+                query_image_hash TEXT,
+                generated_image_hash TEXT,
+                
+                -- Repeat-query lookup (see find_reusable)
+                query_key TEXT,
+                index_version TEXT,
+                query_image_dhash TEXT
             )
         ''')
         
+        ImageStore.create_tables(cursor)
+        
         # Create retrieval results table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS retrieval_results (
@@ -86,64 +207,122 @@ class HistoryManager:
                 file_name TEXT NOT NULL,
                 similarity_score REAL NOT NULL,
                 captions TEXT NOT NULL,
+                image_id INTEGER,
                 
                 FOREIGN KEY (query_id) REFERENCES queries(id) ON DELETE CASCADE
             )
         ''')
         
-        # Create index for faster queries
+        # Columns added after the first release, missing from older databases
+        self._add_missing_columns(cursor, 'queries', {
+            'query_image_hash': 'TEXT',
+            'generated_image_hash': 'TEXT',
+            'query_key': 'TEXT',
+            'index_version': 'TEXT',
+            'query_image_dhash': 'TEXT'
+        })
+        self._add_missing_columns(cursor, 'retrieval_results', {'image_id': 'INTEGER'})
+        
+        # Keyset pagination walks (timestamp, id) newest first, optionally within one mode
+        cursor.execute('DROP INDEX IF EXISTS idx_query_timestamp')
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_query_timestamp 
-            ON queries(timestamp DESC)
+            CREATE INDEX IF NOT EXISTS idx_queries_timestamp_id
+            ON queries(timestamp DESC, id DESC)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_queries_mode_timestamp_id
+            ON queries(query_mode, timestamp DESC, id DESC)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_queries_similarity
+            ON queries(avg_similarity, timestamp)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_results_query_rank
+            ON retrieval_results(query_id, rank)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_queries_reuse
+            ON queries(query_key, query_mode, top_k, index_version, timestamp DESC)
         ''')
         
-        conn.commit()
-        conn.close()
-    
-    def _save_query_image(self, image: Image.Image, query_id: int) -> str:
-        """
-        Save query image to disk
-        
-        Args:
-            image: PIL Image object
-            query_id: Query ID for filename
-            
-        Returns:
-            Path to saved image
-        """
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"query_{query_id}_{timestamp}.jpg"
-        filepath = self.query_images_dir / filename
+        self.fts_enabled = self._create_fts(cursor)
         
-        # Convert RGBA to RGB if needed
-        if image.mode == 'RGBA':
-            image = image.convert('RGB')
+        # Statistics rollups, maintained by the write and delete paths
+        rollups_exist = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_rollups'"
+        ).fetchone()
+        history_stats.create_tables(cursor)
+        if not rollups_exist:
+            history_stats.rebuild(conn)
         
-        image.save(filepath, 'JPEG', quality=95)
-        return str(filepath)
+        # Next free query ID, reserved in blocks (see _next_query_id)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS id_allocator (
+                name TEXT PRIMARY KEY,
+                next_id INTEGER NOT NULL
+            )
+        ''')
+    
+    @staticmethod
+    def _add_missing_columns(cursor, table: str, columns: Dict[str, str]):
+        existing = {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}
+        for column, column_type in columns.items():
+            if column not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
     
-    def _save_generated_image(self, image: Image.Image, query_id: int) -> str:
+    def _create_fts(self, cursor) -> bool:
         """
-        Save generated image to disk
+        Full-text index over query and generated text, kept in sync by triggers
         
-        Args:
-            image: PIL Image object
-            query_id: Query ID for filename
-            
         Returns:
-            Path to saved image
+            False if this SQLite build lacks FTS5 (search then falls back to LIKE)
         """
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"gen_{query_id}_{timestamp}.jpg"
-        filepath = self.generated_images_dir / filename
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'queries_fts'"
+        ).fetchone()
+        if exists:
+            return True
         
-        # Convert RGBA to RGB if needed
-        if image.mode == 'RGBA':
-            image = image.convert('RGB')
+        try:
+            # External-content table: the text lives only in queries
+            cursor.execute('''
+                CREATE VIRTUAL TABLE queries_fts USING fts5(
+                    query_text, generated_text,
+                    content='queries', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            print(f"FTS5 not available, history search uses LIKE: {e}")
+            return False
         
-        image.save(filepath, 'JPEG', quality=95)
-        return str(filepath)
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS queries_fts_insert AFTER INSERT ON queries BEGIN
+                INSERT INTO queries_fts(rowid, query_text, generated_text)
+                VALUES (new.id, new.query_text, new.generated_text);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS queries_fts_delete AFTER DELETE ON queries BEGIN
+                INSERT INTO queries_fts(queries_fts, rowid, query_text, generated_text)
+                VALUES ('delete', old.id, old.query_text, old.generated_text);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS queries_fts_update
+            AFTER UPDATE OF query_text, generated_text ON queries BEGIN
+                INSERT INTO queries_fts(queries_fts, rowid, query_text, generated_text)
+                VALUES ('delete', old.id, old.query_text, old.generated_text);
+                INSERT INTO queries_fts(rowid, query_text, generated_text)
+                VALUES (new.id, new.query_text, new.generated_text);
+            END
+        ''')
+        # Index rows saved before the FTS table existed
+        cursor.execute("INSERT INTO queries_fts(queries_fts) VALUES ('rebuild')")
+        return True
     
+    @timed(OPERATION_SECONDS, operation='save')
     def save_query(
         self,
         query_data: Dict,
@@ -157,6 +336,10 @@ class HistoryManager:
         """
         Save complete query to database
         
+        With write-behind enabled the query is queued and its ID returned at once;
+        images are encoded and rows inserted by the background writer. Reads through
+        this manager wait for queued saves first, so they always see them.
+        
         Args:
             query_data: Query information (mode, text, image, etc.)
             results: Retrieval results
@@ -169,23 +352,89 @@ class HistoryManager:
         Returns:
             Query ID
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        query_id = self._next_query_id()
+        record = {
+            'id': query_id,
+            'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+            'query_data': query_data,
+            'results': results['results'],
+            'retrieval_metrics': retrieval_metrics,
+            'performance': performance,
+            'generated_text': generated_text,
+            'text_metrics': text_metrics,
+            'query_image': query_data.get('query_image'),
+            'generated_image': generated_image
+        }
         
-        try:
-            # Insert query first to get ID
-            cursor.execute('''
-                INSERT INTO queries (
-                    query_mode, query_text, text_weight, top_k,
-                    retrieval_time, avg_similarity, diversity, 
-                    min_similarity, max_similarity, std_similarity,
-                    generated_text,
-                    word_count, sentence_count, vocabulary_richness, avg_word_length,
-                    text_gen_time, image_gen_time, total_time
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
+        if self.writer is not None:
+            self.writer.submit(record)
+        else:
+            self._write_records([record])
+        return query_id
+    
+    def _next_query_id(self) -> int:
+        """
+        Allocate a query ID without inserting the row. IDs are reserved from the
+        database in blocks, so several worker processes never hand out the same one.
+        """
+        with self._id_lock:
+            if self._id_block_next >= self._id_block_end:
+                with self.pool.transaction() as conn:
+                    row = conn.execute("SELECT next_id FROM id_allocator WHERE name = 'queries'").fetchone()
+                    if row is None:
+                        seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'queries'").fetchone()
+                        max_id = conn.execute('SELECT MAX(id) FROM queries').fetchone()[0]
+                        start = max(seq[0] if seq else 0, max_id or 0) + 1
+                        conn.execute("INSERT INTO id_allocator (name, next_id) VALUES ('queries', ?)", (start,))
+                    else:
+                        start = row[0]
+                    conn.execute(
+                        "UPDATE id_allocator SET next_id = ? WHERE name = 'queries'",
+                        (start + self.ID_BLOCK_SIZE,)
+                    )
+                self._id_block_next = start
+                self._id_block_end = start + self.ID_BLOCK_SIZE
+            
+            query_id = self._id_block_next
+            self._id_block_next += 1
+            return query_id
+    
+    def _write_records(self, records: List[Dict]):
+        """
+        Store images and insert a batch of queued queries in one transaction
+        
+        Images are hashed, and encoded if not already stored, before the write lock is
+        taken; the transaction only takes references and moves new files into place.
+        
+        Args:
+            records: Records built by save_query
+        """
+        prepared = []
+        with self.pool.connection() as conn:
+            for record in records:
+                query_image = record['query_image']
+                generated_image = record['generated_image']
+                prepared.append((
+                    self.image_store.prepare(query_image, conn) if query_image else None,
+                    self.image_store.prepare(generated_image, conn) if generated_image else None
+                ))
+        
+        query_rows = []
+        result_rows = []
+        for record, (query_blob, generated_blob) in zip(records, prepared):
+            query_id = record['id']
+            query_data = record['query_data']
+            retrieval_metrics = record['retrieval_metrics']
+            performance = record['performance']
+            text_metrics = record['text_metrics']
+            
+            # Image paths (indices 4 and 14) are filled in once the blobs are referenced
+            query_rows.append([
+                query_id,
+                record['timestamp'],
                 query_data['query_mode'],
                 query_data.get('query_text'),
+                None,
                 query_data.get('text_weight'),
                 query_data['top_k'],
                 performance['retrieval_time'],
@@ -194,65 +443,124 @@ class HistoryManager:
                 retrieval_metrics['min_similarity'],
                 retrieval_metrics['max_similarity'],
                 retrieval_metrics['std_similarity'],
-                generated_text,
+                record['generated_text'],
+                None,
                 text_metrics.get('word_count') if text_metrics else None,
                 text_metrics.get('sentence_count') if text_metrics else None,
                 text_metrics.get('vocabulary_richness') if text_metrics else None,
                 text_metrics.get('avg_word_length') if text_metrics else None,
                 performance.get('text_gen_time', 0),
                 performance.get('image_gen_time', 0),
-                performance['total_time']
-            ))
-            
-            query_id = cursor.lastrowid
+                performance['total_time'],
+                query_blob.hash if query_blob else None,
+                generated_blob.hash if generated_blob else None,
+                self.query_key(
+                    query_data.get('query_text') if query_data['query_mode'] != 'Image Only' else None,
+                    record['query_image']
+                ),
+                query_data.get('index_version'),
+                ImageStore.perceptual_hash(record['query_image'], size=VERIFY_HASH_SIZE)
+                if record['query_image'] is not None else None
+            ])
             
-            # Save query image if provided
-            if query_data.get('query_image'):
-                query_image_path = self._save_query_image(
-                    query_data['query_image'],
-                    query_id
-                )
-                cursor.execute(
-                    'UPDATE queries SET query_image_path = ? WHERE id = ?',
-                    (query_image_path, query_id)
-                )
-            
-            # Save generated image if provided
-            if generated_image:
-                gen_image_path = self._save_generated_image(
-                    generated_image,
-                    query_id
-                )
-                cursor.execute(
-                    'UPDATE queries SET generated_image_path = ? WHERE id = ?',
-                    (gen_image_path, query_id)
-                )
-            
-            # Insert retrieval results
-            for result in results['results']:
-                cursor.execute('''
-                    INSERT INTO retrieval_results (
-                        query_id, rank, image_path, file_name,
-                        similarity_score, captions
-                    ) VALUES (?, ?, ?, ?, ?, ?)
-                ''', (
+            result_rows.extend(
+                (
                     query_id,
                     result['rank'],
                     result['image_path'],
                     result['file_name'],
                     result['similarity_score'],
-                    json.dumps(result['captions'])
-                ))
-            
-            conn.commit()
-            return query_id
+                    json.dumps(result['captions']),
+                    result.get('image_id')
+                )
+                for result in record['results']
+            )
+        
+        blobs = [blob for pair in prepared for blob in pair if blob is not None]
+        try:
+            for attempt in range(self.write_retries + 1):
+                try:
+                    with self.pool.transaction() as conn:
+                        paths = self.image_store.add_refs(conn, blobs)
+                        for row in query_rows:
+                            row[4] = paths.get(row[22])
+                            row[14] = paths.get(row[23])
+                        conn.executemany(INSERT_QUERY_SQL, query_rows)
+                        conn.executemany(INSERT_RESULT_SQL, result_rows)
+                        # timestamp, query_mode, avg_similarity, diversity, total_time
+                        history_stats.apply(conn, [(row[1], row[2], row[8], row[9], row[21]) for row in query_rows])
+                    break
+                except TRANSIENT_WRITE_ERRORS as e:
+                    # Rolled back; add_refs re-encodes any blob it had already moved into place
+                    if attempt == self.write_retries:
+                        raise
+                    delay = self.write_retry_delay * 2 ** attempt
+                    print(f"History write failed ({e}), retrying in {delay * 1000:.0f}ms")
+                    WRITE_RETRIES.inc()
+                    time.sleep(delay)
+        finally:
+            # Temp files of images that were already stored, or of a failed transaction
+            self.image_store.discard(blobs)
+    
+    def _write_batch(self, records: List[Dict]):
+        """Background writer callback: one transaction per batch, falling back to per-record writes"""
+        with OPERATION_SECONDS.labels(operation='write_batch').time():
+            try:
+                self._write_records(records)
+                return
+            except TRANSIENT_WRITE_ERRORS as e:
+                # Already retried; writing the records one by one would only fail again
+                self._drop_records(records, e)
+                return
+            except Exception as e:
+                if len(records) == 1:
+                    self._drop_records(records, e)
+                    return
+                print(f"Error saving history batch of {len(records)}, retrying individually: {e}")
+        
+        for record in records:
+            try:
+                self._write_records([record])
+            except Exception as e:
+                self._drop_records([record], e)
+    
+    def _drop_records(self, records: List[Dict], error: Exception):
+        """Count queued saves that could not be written"""
+        for record in records:
+            print(f"Error saving query {record['id']}: {error}")
+        # Only the single background writer thread gets here
+        self._write_failures += len(records)
+        WRITE_FAILURES.inc(len(records))
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every query queued so far is written
+        
+        Args:
+            timeout: Seconds to wait (None = no limit)
             
+        Returns:
+            True if the queue drained in time
+        """
+        if self.writer is None:
+            return True
+        return self.writer.flush(timeout)
+    
+    def close(self):
+        """Flush queued saves, checkpoint the WAL into the database file and close connections"""
+        self._retention_stop.set()
+        if self.writer is not None:
+            # Later saves (e.g. from other atexit handlers) are written synchronously
+            writer, self.writer = self.writer, None
+            writer.close()
+        try:
+            with self.pool.connection() as conn:
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
         except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+            print(f"History checkpoint failed: {e}")
+        self.pool.close()
     
+    @timed(OPERATION_SECONDS, operation='list')
     def get_all_queries(self, limit: int = 50) -> List[Dict]:
         """
         Get recent queries
@@ -263,21 +571,133 @@ class HistoryManager:
         Returns:
             List of query dictionaries
         """
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        self.flush()
+        with self.pool.connection() as conn:
+            cursor = conn.execute('''
+                SELECT * FROM queries
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            ''', (limit,))
+            
+            return [dict(row) for row in cursor.fetchall()]
+    
+    @timed(OPERATION_SECONDS, operation='list')
+    def list_queries(
+        self,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        mode: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        min_similarity: Optional[float] = None,
+        max_similarity: Optional[float] = None,
+        search: Optional[str] = None,
+        full: bool = False
+    ) -> Dict:
+        """
+        Page through queries newest first, with filters
         
-        cursor.execute('''
-            SELECT * FROM queries
-            ORDER BY timestamp DESC
+        Pages are keyset-paginated on (timestamp, id), so each page costs the same
+        however deep it is and rows saved meanwhile don't shift later pages.
+        
+        Args:
+            limit: Queries per page
+            cursor: next_cursor from the previous page (None = first page)
+            mode: Only this query_mode
+            since: Only queries at or after this UTC time ('YYYY-MM-DD[ HH:MM:SS]' or ISO 8601)
+            until: Only queries before this UTC time
+            min_similarity: Minimum avg_similarity
+            max_similarity: Maximum avg_similarity
+            search: Full-text search over query and generated text
+            full: Return every column instead of the list projection
+            
+        Returns:
+            Dictionary with 'queries' and 'next_cursor' (None on the last page)
+        """
+        conditions = []
+        params = []
+        
+        if cursor:
+            cursor_timestamp, cursor_id = self._decode_cursor(cursor)
+            conditions.append('(timestamp, id) < (?, ?)')
+            params.extend([cursor_timestamp, cursor_id])
+        if mode:
+            conditions.append('query_mode = ?')
+            params.append(mode)
+        if since:
+            conditions.append('timestamp >= ?')
+            params.append(self._normalize_timestamp(since))
+        if until:
+            conditions.append('timestamp < ?')
+            params.append(self._normalize_timestamp(until))
+        if min_similarity is not None:
+            conditions.append('avg_similarity >= ?')
+            params.append(float(min_similarity))
+        if max_similarity is not None:
+            conditions.append('avg_similarity <= ?')
+            params.append(float(max_similarity))
+        if search and search.strip():
+            if self.fts_enabled:
+                conditions.append('id IN (SELECT rowid FROM queries_fts WHERE queries_fts MATCH ?)')
+                params.append(self._fts_query(search))
+            else:
+                conditions.append('(query_text LIKE ? OR generated_text LIKE ?)')
+                params.extend([f"%{search.strip()}%"] * 2)
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f'''
+            SELECT {'*' if full else LIST_COLUMNS} FROM queries
+            {where}
+            ORDER BY timestamp DESC, id DESC
             LIMIT ?
-        ''', (limit,))
+        '''
+        
+        self.flush()
+        with self.pool.connection() as conn:
+            # One extra row tells whether there is a next page
+            rows = conn.execute(sql, params + [limit + 1]).fetchall()
         
-        queries = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        queries = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = queries[-1]
+            next_cursor = self._encode_cursor(last['timestamp'], last['id'])
         
-        return queries
+        return {'queries': queries, 'next_cursor': next_cursor}
     
+    @staticmethod
+    def _encode_cursor(timestamp: str, query_id: int) -> str:
+        return base64.urlsafe_b64encode(f"{timestamp}|{query_id}".encode()).decode().rstrip('=')
+    
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            timestamp, query_id = base64.urlsafe_b64decode(padded).decode().rsplit('|', 1)
+            return timestamp, int(query_id)
+        except Exception:
+            raise ValueError(f"Invalid cursor: {cursor}")
+    
+    @staticmethod
+    def _normalize_timestamp(value: str) -> str:
+        """ISO 8601 or SQLite-style UTC time to the stored 'YYYY-MM-DD HH:MM:SS' form"""
+        value = str(value).strip()
+        if value.endswith('Z'):
+            value = value[:-1]
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"Invalid timestamp: {value}")
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed.strftime('%Y-%m-%d %H:%M:%S')
+    
+    @staticmethod
+    def _fts_query(text: str) -> str:
+        """User text to an FTS5 query: every word must match as a prefix; FTS syntax is quoted away"""
+        return ' '.join('"' + term.replace('"', '""') + '"*' for term in text.split())
+    
+    @timed(OPERATION_SECONDS, operation='get')
     def get_query_by_id(self, query_id: int) -> Optional[Dict]:
         """
         Get specific query with all results
@@ -288,38 +708,160 @@ class HistoryManager:
         Returns:
             Query dictionary with results, or None if not found
         """
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
+        self.flush()
+        with self.pool.connection() as conn:
+            return self._load_query(conn, query_id)
+    
+    @staticmethod
+    def _load_query(conn, query_id: int) -> Optional[Dict]:
         # Get query
-        cursor.execute('SELECT * FROM queries WHERE id = ?', (query_id,))
-        query = cursor.fetchone()
+        query = conn.execute('SELECT * FROM queries WHERE id = ?', (query_id,)).fetchone()
         
         if not query:
-            conn.close()
             return None
         
         query_dict = dict(query)
         
         # Get retrieval results
-        cursor.execute('''
+        rows = conn.execute('''
             SELECT * FROM retrieval_results
             WHERE query_id = ?
             ORDER BY rank
-        ''', (query_id,))
+        ''', (query_id,)).fetchall()
         
         results = []
-        for row in cursor.fetchall():
+        for row in rows:
             result = dict(row)
             result['captions'] = json.loads(result['captions'])
             results.append(result)
         
         query_dict['retrieval_results'] = results
         
-        conn.close()
         return query_dict
     
+    @staticmethod
+    def normalize_query_text(text: Optional[str]) -> str:
+        """Case, width, whitespace and trailing punctuation folded, so trivially different phrasings match"""
+        text = unicodedata.normalize('NFKC', text or '').casefold()
+        return ' '.join(text.split()).strip(' .!?')
+    
+    @classmethod
+    def query_key(cls, query_text: Optional[str] = None, query_image: Optional[Image.Image] = None) -> Optional[str]:
+        """
+        Lookup key shared by near-exact repeats of a query: normalized text and/or a
+        perceptual hash of the query image
+        
+        Returns:
+            Key string, or None for an empty query
+        """
+        parts = []
+        text = cls.normalize_query_text(query_text)
+        if text:
+            parts.append('t:' + hashlib.sha1(text.encode('utf-8')).hexdigest())
+        if query_image is not None:
+            parts.append('i:' + ImageStore.perceptual_hash(query_image))
+        return '|'.join(parts) or None
+    
+    @timed(OPERATION_SECONDS, operation='reuse_lookup')
+    def find_reusable(
+        self,
+        query_mode: str,
+        top_k: int,
+        index_version: str,
+        query_text: Optional[str] = None,
+        query_image: Optional[Image.Image] = None,
+        text_weight: Optional[float] = None,
+        max_age_days: Optional[float] = None,
+        allow_near_exact: bool = True
+    ) -> Optional[Dict]:
+        """
+        Most recent stored query that repeats this one, for serving it without
+        retrieval or generation. Queries still in the write-behind queue are not searched.
+        
+        Args:
+            query_mode: Stored query_mode label
+            top_k: Number of results
+            index_version: Current retriever index version; results from other versions never match
+            query_text: Text query
+            query_image: Query image
+            text_weight: Multimodal text weight (ignored when None)
+            max_age_days: Only queries saved within this many days
+            allow_near_exact: Also match normalized text / perceptually equal images
+        
+        Returns:
+            Query dictionary as from get_query_by_id plus 'match' ('exact' or
+            'near_exact'), or None
+        """
+        key = self.query_key(query_text, query_image)
+        if key is None or not index_version:
+            return None
+        
+        conditions = ['query_key = ?', 'query_mode = ?', 'top_k = ?', 'index_version = ?']
+        params = [key, query_mode, top_k, index_version]
+        if text_weight is not None:
+            conditions.append('abs(text_weight - ?) < 1e-6')
+            params.append(text_weight)
+        if max_age_days is not None:
+            conditions.append("timestamp >= datetime('now', ?)")
+            params.append(f'-{float(max_age_days)} days')
+        
+        with self.pool.connection() as conn:
+            candidates = conn.execute(f'''
+                SELECT id, query_text, query_image_hash, query_image_dhash FROM queries
+                WHERE {' AND '.join(conditions)}
+                ORDER BY timestamp DESC LIMIT 10
+            ''', params).fetchall()
+            if not candidates:
+                return None
+            
+            # Prefer a byte-for-byte repeat: same text and same image pixels
+            image_hash = ImageStore.hash_image(query_image) if query_image is not None else None
+            match, chosen = 'near_exact', None
+            for row in candidates:
+                if (row['query_text'] or '') == (query_text or '') and row['query_image_hash'] == image_hash:
+                    match, chosen = 'exact', row['id']
+                    break
+            if chosen is None:
+                if not allow_near_exact:
+                    return None
+                chosen = self._verified_near_exact(candidates, query_image, image_hash)
+                if chosen is None:
+                    return None
+            
+            query = self._load_query(conn, chosen)
+        
+        if query is None:
+            return None
+        query['match'] = match
+        query['retrieval_results'] = [
+            {field: result[field] for field in RESULT_FIELDS} for result in query['retrieval_results']
+        ]
+        return query
+    
+    @staticmethod
+    def _verified_near_exact(candidates, query_image: Optional[Image.Image], image_hash: Optional[str]) -> Optional[int]:
+        """
+        Newest candidate whose image really is the query image. The 8x8 hash in
+        query_key only narrows the search: flat images all hash to zeros.
+        
+        Returns:
+            Query id, or None if no candidate's image is confirmed
+        """
+        if query_image is None:
+            return candidates[0]['id']
+        if ImageStore.is_low_entropy(ImageStore.perceptual_hash(query_image)):
+            return None
+        
+        dhash = ImageStore.perceptual_hash(query_image, size=VERIFY_HASH_SIZE)
+        for row in candidates:
+            if row['query_image_hash'] == image_hash:
+                return row['id']
+            if row['query_image_dhash'] and \
+                    ImageStore.hamming_distance(dhash, row['query_image_dhash']) <= VERIFY_MAX_DISTANCE:
+                return row['id']
+        return None
+    
+    @timed(OPERATION_SECONDS, operation='delete')
     def delete_query(self, query_id: int) -> bool:
         """
         Delete query and associated files
@@ -330,78 +872,224 @@ class HistoryManager:
         Returns:
             True if successful, False otherwise
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        self.flush()
         try:
-            # Get file paths before deleting
-            cursor.execute(
-                'SELECT query_image_path, generated_image_path FROM queries WHERE id = ?',
-                (query_id,)
-            )
-            row = cursor.fetchone()
-            
-            if row:
-                # Delete files
-                if row[0] and Path(row[0]).exists():
-                    Path(row[0]).unlink()
-                if row[1] and Path(row[1]).exists():
-                    Path(row[1]).unlink()
+            with self.pool.transaction() as conn:
+                # CASCADE deletes retrieval_results and releases image references
+                rows, released = self._delete_rows(conn, [query_id])
             
-            # Delete from database (CASCADE will delete retrieval_results)
-            cursor.execute('DELETE FROM queries WHERE id = ?', (query_id,))
-            conn.commit()
+            # Files are removed once the rows are gone, so a rollback never loses an image
+            self._remove_released(released)
+            self._unlink_legacy_images(rows)
             
             return True
             
         except Exception as e:
-            conn.rollback()
             print(f"Error deleting query: {e}")
             return False
-        finally:
-            conn.close()
     
-    def get_statistics(self) -> Dict:
+    def _remove_released(self, released):
+        """Delete files of image blobs released by a committed transaction"""
+        if not released:
+            return
+        try:
+            # Under the write lock, so a concurrent save of the same image can't re-add it mid-unlink
+            with self.pool.transaction() as conn:
+                self.image_store.remove_released(conn, released)
+        except Exception as e:
+            # Left for collect_image_orphans
+            print(f"Error removing released images: {e}")
+    
+    @staticmethod
+    def _unlink_legacy_images(rows):
+        """Delete image files saved before the image store (they belong to one query alone)"""
+        for row in rows:
+            for path, image_hash in ((row[0], row[2]), (row[1], row[3])):
+                if path and not image_hash and Path(path).exists():
+                    Path(path).unlink()
+    
+    @timed(OPERATION_SECONDS, operation='retention')
+    def apply_retention(
+        self,
+        max_age_days: Optional[float] = None,
+        max_queries: Optional[int] = None,
+        archive: Optional[bool] = None,
+        batch_size: int = 500
+    ) -> Dict:
         """
-        Get usage statistics
+        Delete queries outside the retention policy, archiving them first, then reclaim space
         
+        Args:
+            max_age_days: Delete queries older than this (default: HISTORY_RETENTION_DAYS)
+            max_queries: Keep only the newest this many (default: HISTORY_MAX_QUERIES)
+            archive: Write deleted queries and results to HISTORY_ARCHIVE_DIR first
+                     (default: HISTORY_ARCHIVE, on; requires pyarrow)
+            batch_size: Queries deleted per write transaction
+            
         Returns:
-            Dictionary with statistics
+            Dictionary with deleted queries, purged orphan results, archive files and pages freed
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        max_age_days = self.retention_days if max_age_days is None else max_age_days
+        max_queries = self.max_queries if max_queries is None else max_queries
+        archive = self.archive_enabled if archive is None else archive
+        self.flush()
         
-        # Total queries
-        cursor.execute('SELECT COUNT(*) FROM queries')
-        total_queries = cursor.fetchone()[0]
+        summary = {'deleted': 0, 'orphaned_results': 0, 'archive_files': [], 'pages_freed': 0}
+        with self.pool.transaction() as conn:
+            summary['orphaned_results'] = history_retention.purge_orphaned_results(conn)
         
-        # Average metrics
-        cursor.execute('''
-            SELECT 
-                AVG(avg_similarity) as avg_sim,
-                AVG(diversity) as avg_div,
-                AVG(total_time) as avg_time
-            FROM queries
-        ''')
-        row = cursor.fetchone()
+        while max_age_days is not None or max_queries is not None:
+            archive_files = []
+            try:
+                with self.pool.transaction() as conn:
+                    ids = history_retention.expired_ids(conn, max_age_days, max_queries, batch_size)
+                    if not ids:
+                        break
+                    if archive:
+                        archive_files = history_retention.write_archive(
+                            conn, ids, self.archive_dir, self.archive_format
+                        )
+                    rows, released = self._delete_rows(conn, ids)
+            except Exception:
+                history_retention.discard_archive(archive_files)
+                raise
+            summary['archive_files'].extend(history_retention.publish_archive(archive_files))
+            summary['deleted'] += len(ids)
+            self._remove_released(released)
+            self._unlink_legacy_images(rows)
         
-        # Query mode distribution
-        cursor.execute('''
-            SELECT query_mode, COUNT(*) as count
-            FROM queries
-            GROUP BY query_mode
-        ''')
-        mode_dist = {row[0]: row[1] for row in cursor.fetchall()}
+        summary['pages_freed'] = self.compact()
+        if summary['deleted'] or summary['orphaned_results']:
+            print(
+                f"History retention: deleted {summary['deleted']} queries, "
+                f"{summary['orphaned_results']} orphaned results, freed {summary['pages_freed']} pages"
+            )
+        return summary
+    
+    def _delete_rows(self, conn, ids: List[int]):
+        """
+        Delete queries inside a write transaction, releasing rollups and image references
         
-        conn.close()
+        Returns:
+            Tuple of (deleted rows' image columns, blobs released for _remove_released)
+        """
+        placeholders = ','.join('?' * len(ids))
+        rows = conn.execute(
+            'SELECT query_image_path, generated_image_path, query_image_hash, generated_image_hash, '
+            f'{history_stats.SOURCE_COLUMNS} FROM queries WHERE id IN ({placeholders})',
+            ids
+        ).fetchall()
+        conn.execute(f'DELETE FROM queries WHERE id IN ({placeholders})', ids)
+        history_stats.apply(conn, [tuple(row)[4:] for row in rows], sign=-1)
+        released = self.image_store.release(conn, [h for row in rows for h in (row[2], row[3])])
+        return rows, released
+    
+    def compact(self, max_pages: Optional[int] = None) -> int:
+        """
+        Return free database pages to the filesystem, in short transactions
         
-        return {
-            'total_queries': total_queries,
-            'avg_similarity': row[0] if row[0] else 0,
-            'avg_diversity': row[1] if row[1] else 0,
-            'avg_time': row[2] if row[2] else 0,
-            'mode_distribution': mode_dist
-        }
+        Args:
+            max_pages: Stop after this many pages (None = all)
+            
+        Returns:
+            Pages freed (0 until vacuum() has converted a pre-existing database)
+        """
+        return history_retention.incremental_vacuum(self.pool, max_pages=max_pages)
+    
+    def vacuum(self):
+        """
+        Rewrite the whole database. Blocks writers; needed once to switch databases created
+        before incremental auto-vacuum, so that compact() can free pages
+        """
+        self.flush()
+        with self.pool.connection() as conn:
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.execute('VACUUM')
+    
+    def _retention_loop(self, interval: float):
+        while not self._retention_stop.wait(interval):
+            try:
+                self.apply_retention()
+            except Exception as e:
+                print(f"History retention failed: {e}")
+    
+    @timed(OPERATION_SECONDS, operation='stats')
+    def get_statistics(self) -> Dict:
+        """
+        Get usage statistics (read from rollups, so the cost doesn't grow with history size)
+        
+        Returns:
+            Dictionary with statistics
+        """
+        self.flush()
+        with self.pool.connection() as conn:
+            stats = history_stats.summary(conn)
+            stats['image_store'] = self.image_store.get_statistics(conn)
+        # Queued saves this process dropped after retrying
+        stats['write_failures'] = self._write_failures
+        return stats
+    
+    def get_image_path(self, image_hash: str, thumbnail: bool = False) -> Optional[str]:
+        """
+        Path of a stored history image
+        
+        Args:
+            image_hash: query_image_hash or generated_image_hash of a query
+            thumbnail: Return the thumbnail, deriving it on first request
+            
+        Returns:
+            File path, or None if no such image is stored
+        """
+        with self.pool.connection() as conn:
+            if thumbnail:
+                return self.image_store.thumbnail(conn, image_hash)
+            return self.image_store.path_for(conn, image_hash)
+    
+    def collect_image_orphans(self, min_age_seconds: float = 3600) -> int:
+        """
+        Remove image files no query references (left behind by a crash mid-save)
+        
+        Args:
+            min_age_seconds: Only files older than this
+            
+        Returns:
+            Number of files removed
+        """
+        self.flush()
+        with self.pool.transaction() as conn:
+            return self.image_store.collect_orphans(conn, min_age_seconds)
+    
+    @timed(OPERATION_SECONDS, operation='timeseries')
+    def get_timeseries(
+        self,
+        granularity: str = 'hour',
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        mode: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Query volume, averages and latency percentiles per hour or day
+        
+        Args:
+            granularity: 'hour' or 'day'
+            since: Only buckets from this UTC time on
+            until: Only buckets before this UTC time
+            mode: Only this query_mode (default: all modes)
+            
+        Returns:
+            List of {'bucket', 'count', 'avg_similarity', 'avg_time', 'p50', 'p95', 'p99'}
+        """
+        since = self._normalize_timestamp(since) if since else None
+        until = self._normalize_timestamp(until) if until else None
+        self.flush()
+        with self.pool.connection() as conn:
+            return history_stats.timeseries(conn, granularity, since, until, mode)
+    
+    def rebuild_statistics(self):
+        """Recompute the rollups from the queries table (after editing the database by hand)"""
+        self.flush()
+        with self.pool.transaction() as conn:
+            history_stats.rebuild(conn)
 
 
 if __name__ == "__main__":
@@ -409,8 +1097,7 @@ if __name__ == "__main__":
     manager = HistoryManager()
     print("History manager initialized successfully!")
     print(f"Database: {manager.db_path}")
-    print(f"Query images: {manager.query_images_dir}")
-    print(f"Generated images: {manager.generated_images_dir}")
+    print(f"Images: {manager.image_store.root} ({manager.image_store.format})")
     
     # Get statistics
     stats = manager.get_statistics()
@@ -418,3 +1105,4 @@ if __name__ == "__main__":
     print(f"  Total queries: {stats['total_queries']}")
     print(f"  Avg similarity: {stats['avg_similarity']:.3f}")
     print(f"  Avg time: {stats['avg_time']:.2f}s")
+    print(f"  Stored images: {stats['image_store']['blobs']} ({stats['image_store']['references']} references)")
@@ -0,0 +1,246 @@
+"""
+History Retention
+Bulk deletion of old queries, columnar archiving and incremental space reclamation
+
+Expired queries are processed in small batches, one write transaction each, so saves
+are never blocked for long. Within a batch the queries and their retrieval results are
+optionally written to an archive file (Parquet or Arrow IPC, zstd-compressed), then
+deleted: results go by ON DELETE CASCADE, and rollups and image references are released
+exactly as delete_query does. Freed pages are returned to the filesystem with
+incremental vacuum instead of a full VACUUM rewrite.
+"""
+
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+ARCHIVE_FORMATS = {
+    'parquet': 'parquet',
+    'arrow': 'arrow'
+}
+
+# SQLite declared type -> Arrow type name, for a fixed archive schema across batches
+_ARROW_TYPES = {
+    'INTEGER': 'int64',
+    'REAL': 'float64',
+    'TEXT': 'string',
+    'DATETIME': 'timestamp'
+}
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.feather
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        raise RuntimeError("Archiving history requires pyarrow (pip install pyarrow)")
+
+
+def expired_ids(
+    conn,
+    max_age_days: Optional[float] = None,
+    max_queries: Optional[int] = None,
+    limit: int = 500
+) -> List[int]:
+    """
+    Oldest queries outside the retention policy
+
+    Args:
+        conn: Connection
+        max_age_days: Queries older than this expire
+        max_queries: Only the newest this many queries are kept
+        limit: Most IDs to return (one batch)
+
+    Returns:
+        Query IDs, oldest first
+    """
+    # Both rules expire a prefix of the (timestamp, id) order, so the union is the longer prefix
+    bounds = []
+    if max_age_days is not None:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=max_age_days)
+        bounds.append((cutoff.strftime('%Y-%m-%d %H:%M:%S'), 0))
+    if max_queries is not None:
+        if max_queries <= 0:
+            return [row[0] for row in conn.execute('SELECT id FROM queries ORDER BY timestamp, id LIMIT ?', (limit,))]
+        oldest_kept = conn.execute(
+            'SELECT timestamp, id FROM queries ORDER BY timestamp DESC, id DESC LIMIT 1 OFFSET ?',
+            (max_queries - 1,)
+        ).fetchone()
+        if oldest_kept is not None:
+            bounds.append(tuple(oldest_kept))
+    if not bounds:
+        return []
+
+    return [row[0] for row in conn.execute(
+        'SELECT id FROM queries WHERE (timestamp, id) < (?, ?) ORDER BY timestamp, id LIMIT ?',
+        max(bounds) + (limit,)
+    )]
+
+
+def _arrow_schema(pa, conn, table: str):
+    fields = []
+    for _, name, declared, *_ in conn.execute(f'PRAGMA table_info({table})'):
+        kind = _ARROW_TYPES.get((declared or 'TEXT').upper(), 'string')
+        if kind == 'timestamp':
+            # Milliseconds: Parquet has no seconds unit, and Arrow IPC files must match it
+            fields.append(pa.field(name, pa.timestamp('ms', tz='UTC')))
+        elif table == 'retrieval_results' and name == 'captions':
+            fields.append(pa.field(name, pa.list_(pa.string())))
+        else:
+            fields.append(pa.field(name, getattr(pa, kind)()))
+    return pa.schema(fields)
+
+
+def _to_table(pa, schema, rows: List[Dict]):
+    columns = {}
+    for field in schema:
+        values = [row[field.name] for row in rows]
+        if pa.types.is_timestamp(field.type):
+            values = pa.compute.strptime(
+                pa.array(values, pa.string()), format='%Y-%m-%d %H:%M:%S', unit='s', error_is_null=True
+            ).cast(field.type)
+        elif pa.types.is_list(field.type):
+            values = pa.array([json.loads(v) if v else [] for v in values], field.type)
+        else:
+            values = pa.array(values, field.type)
+        columns[field.name] = values
+    return pa.table(columns, schema=schema)
+
+
+def write_archive(conn, ids: List[int], archive_dir: str, archive_format: str = 'parquet') -> List[str]:
+    """
+    Write queries and their retrieval results to compressed columnar files
+
+    Files are written under temporary names; call publish_archive after the deleting
+    transaction commits.
+
+    Args:
+        conn: Connection inside the deleting transaction
+        ids: Query IDs to archive
+        archive_dir: Root directory (files go to queries/ and retrieval_results/ below it)
+        archive_format: 'parquet' or 'arrow' (Arrow IPC / Feather v2)
+
+    Returns:
+        Temporary file paths
+    """
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unknown archive format: {archive_format}")
+    pa = _import_pyarrow()
+
+    placeholders = ','.join('?' * len(ids))
+    sources = {
+        'queries': conn.execute(f'SELECT * FROM queries WHERE id IN ({placeholders}) ORDER BY id', ids).fetchall(),
+        'retrieval_results': conn.execute(
+            f'SELECT * FROM retrieval_results WHERE query_id IN ({placeholders}) ORDER BY query_id, rank', ids
+        ).fetchall()
+    }
+
+    # One file per batch, named by its ID range so re-archiving a batch overwrites it
+    part = f"part-{min(ids):010d}-{max(ids):010d}.{ARCHIVE_FORMATS[archive_format]}"
+    written = []
+    for table, rows in sources.items():
+        directory = Path(archive_dir) / table
+        directory.mkdir(parents=True, exist_ok=True)
+        arrow_table = _to_table(pa, _arrow_schema(pa, conn, table), [dict(row) for row in rows])
+        tmp_path = directory / f".{part}.tmp"
+        if archive_format == 'parquet':
+            pa.parquet.write_table(arrow_table, tmp_path, compression='zstd')
+        else:
+            pa.feather.write_feather(arrow_table, tmp_path, compression='zstd')
+        written.append(str(tmp_path))
+    return written
+
+
+def publish_archive(tmp_paths: List[str]) -> List[str]:
+    """Give committed archive files their final names"""
+    final_paths = []
+    for tmp_path in tmp_paths:
+        path = Path(tmp_path)
+        final = path.with_name(path.name[1:-len('.tmp')])
+        os.replace(path, final)
+        final_paths.append(str(final))
+    return final_paths
+
+
+def discard_archive(tmp_paths: List[str]):
+    """Remove archive files of a batch whose transaction rolled back"""
+    for tmp_path in tmp_paths:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+def purge_orphaned_results(conn) -> int:
+    """
+    Delete retrieval results whose query is gone (left by deletes made before foreign
+    keys were enforced)
+
+    Returns:
+        Number of rows deleted
+    """
+    return conn.execute(
+        'DELETE FROM retrieval_results WHERE query_id NOT IN (SELECT id FROM queries)'
+    ).rowcount
+
+
+def incremental_vacuum(pool, pages_per_step: int = 1000, max_pages: Optional[int] = None) -> int:
+    """
+    Return free pages to the filesystem in short write transactions
+
+    Args:
+        pool: SQLitePool of the database
+        pages_per_step: Pages freed per transaction
+        max_pages: Stop after this many pages (None = all free pages)
+
+    Returns:
+        Pages freed
+    """
+    freed = 0
+    while max_pages is None or freed < max_pages:
+        step = pages_per_step if max_pages is None else min(pages_per_step, max_pages - freed)
+        with pool.transaction() as conn:
+            before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if before == 0:
+                break
+            # The pragma frees one page per result row; it must be stepped to completion
+            conn.execute(f'PRAGMA incremental_vacuum({int(step)})').fetchall()
+            after = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if after >= before:
+            break
+        freed += before - after
+    return freed
+
+
+def open_archive(archive_dir: str, table: str = 'queries'):
+    """
+    Open archived history as a pyarrow dataset (lazy, with predicate and column pushdown)
+
+    Args:
+        archive_dir: Root directory given to write_archive
+        table: 'queries' or 'retrieval_results'
+
+    Returns:
+        pyarrow.dataset.Dataset over every archived batch
+    """
+    _import_pyarrow()
+    import pyarrow.dataset as ds
+
+    directory = Path(archive_dir) / table
+    files = sorted(str(p) for p in directory.glob('part-*') if p.suffix in ('.parquet', '.arrow'))
+    parquet = [f for f in files if f.endswith('.parquet')]
+    arrow = [f for f in files if f.endswith('.arrow')]
+    datasets = []
+    if parquet:
+        datasets.append(ds.dataset(parquet, format='parquet'))
+    if arrow:
+        datasets.append(ds.dataset(arrow, format='ipc'))
+    if not datasets:
+        raise FileNotFoundError(f"No archived {table} under {archive_dir}")
+    return datasets[0] if len(datasets) == 1 else ds.dataset(datasets)
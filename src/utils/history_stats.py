@@ -0,0 +1,267 @@
+"""
+History Statistics Rollups
+Aggregates maintained in the history write path, so statistics never scan the queries table
+
+Each saved query adds to three rollup rows per mode: all-time, its day and its hour.
+A rollup keeps counts and running sums (for averages) plus a log-bucketed latency
+sketch, from which percentiles are read with ~5% relative error. Deleting a query
+subtracts the same amounts.
+"""
+
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+
+# Latency sketch: bin i covers (MIN_LATENCY * GAMMA^(i-1), MIN_LATENCY * GAMMA^i]
+SKETCH_GAMMA = 1.1
+SKETCH_MIN_LATENCY = 0.001
+
+GRANULARITIES = ('all', 'day', 'hour')
+
+# Columns of the queries table the rollups are computed from
+SOURCE_COLUMNS = 'timestamp, query_mode, avg_similarity, diversity, total_time'
+
+
+def latency_bin(seconds: float) -> int:
+    if seconds <= SKETCH_MIN_LATENCY:
+        return 0
+    return math.ceil(math.log(seconds / SKETCH_MIN_LATENCY) / math.log(SKETCH_GAMMA))
+
+
+def bin_value(index: int) -> float:
+    """Representative latency of a bin (the value with equal relative error to both edges)"""
+    if index == 0:
+        return SKETCH_MIN_LATENCY
+    return SKETCH_MIN_LATENCY * SKETCH_GAMMA ** index * 2 / (1 + SKETCH_GAMMA)
+
+
+def sketch_percentiles(bins: Dict[int, int], quantiles=(0.5, 0.95, 0.99)) -> Dict[str, Optional[float]]:
+    """
+    Percentiles from merged sketch bins
+
+    Args:
+        bins: bin index -> count
+        quantiles: Quantiles to read
+
+    Returns:
+        Dictionary like {'p50': ..., 'p95': ..., 'p99': ...} (None when empty)
+    """
+    total = sum(bins.values())
+    result = {}
+    ordered = sorted(bins.items())
+    for q in quantiles:
+        key = f"p{round(q * 100):d}"
+        if total <= 0:
+            result[key] = None
+            continue
+        rank = q * (total - 1)
+        seen = 0
+        for index, count in ordered:
+            seen += count
+            if seen > rank:
+                result[key] = bin_value(index)
+                break
+    return result
+
+
+def bucket_key(timestamp: str, granularity: str) -> str:
+    """Rollup bucket for a stored 'YYYY-MM-DD HH:MM:SS' timestamp"""
+    if granularity == 'hour':
+        return f"{timestamp[:13]}:00:00"
+    if granularity == 'day':
+        return timestamp[:10]
+    return ''
+
+
+def create_tables(cursor):
+    """Create rollup tables if they don't exist"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS history_rollups (
+            granularity TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            query_mode TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            similarity_count INTEGER NOT NULL DEFAULT 0,
+            similarity_sum REAL NOT NULL DEFAULT 0,
+            diversity_count INTEGER NOT NULL DEFAULT 0,
+            diversity_sum REAL NOT NULL DEFAULT 0,
+            time_count INTEGER NOT NULL DEFAULT 0,
+            time_sum REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket, query_mode)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS history_latency_bins (
+            granularity TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            query_mode TEXT NOT NULL,
+            bin INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (granularity, bucket, query_mode, bin)
+        ) WITHOUT ROWID
+    ''')
+
+
+def apply(conn, rows: Iterable, sign: int = 1):
+    """
+    Add (sign=1) or subtract (sign=-1) queries from the rollups, inside the caller's transaction
+
+    Args:
+        conn: Connection in a write transaction
+        rows: (timestamp, query_mode, avg_similarity, diversity, total_time) per query
+        sign: 1 when the queries are saved, -1 when they are deleted
+    """
+    totals = defaultdict(lambda: [0, 0, 0.0, 0, 0.0, 0, 0.0])
+    bins = defaultdict(int)
+
+    for timestamp, mode, similarity, diversity, total_time in rows:
+        for granularity in GRANULARITIES:
+            key = (granularity, bucket_key(timestamp, granularity), mode)
+            entry = totals[key]
+            entry[0] += sign
+            if similarity is not None:
+                entry[1] += sign
+                entry[2] += sign * similarity
+            if diversity is not None:
+                entry[3] += sign
+                entry[4] += sign * diversity
+            if total_time is not None:
+                entry[5] += sign
+                entry[6] += sign * total_time
+                bins[key + (latency_bin(total_time),)] += sign
+
+    if not totals:
+        return
+
+    conn.executemany('''
+        INSERT INTO history_rollups (
+            granularity, bucket, query_mode, count,
+            similarity_count, similarity_sum, diversity_count, diversity_sum, time_count, time_sum
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (granularity, bucket, query_mode) DO UPDATE SET
+            count = count + excluded.count,
+            similarity_count = similarity_count + excluded.similarity_count,
+            similarity_sum = similarity_sum + excluded.similarity_sum,
+            diversity_count = diversity_count + excluded.diversity_count,
+            diversity_sum = diversity_sum + excluded.diversity_sum,
+            time_count = time_count + excluded.time_count,
+            time_sum = time_sum + excluded.time_sum
+    ''', [key + tuple(entry) for key, entry in totals.items()])
+
+    conn.executemany('''
+        INSERT INTO history_latency_bins (granularity, bucket, query_mode, bin, count)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (granularity, bucket, query_mode, bin) DO UPDATE SET
+            count = count + excluded.count
+    ''', [key + (count,) for key, count in bins.items()])
+
+    if sign < 0:
+        conn.execute('DELETE FROM history_rollups WHERE count <= 0')
+        conn.execute('DELETE FROM history_latency_bins WHERE count <= 0')
+
+
+def rebuild(conn):
+    """Recompute every rollup from the queries table (first start, or after manual edits)"""
+    conn.execute('DELETE FROM history_rollups')
+    conn.execute('DELETE FROM history_latency_bins')
+    cursor = conn.execute(f'SELECT {SOURCE_COLUMNS} FROM queries')
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        apply(conn, [tuple(row) for row in rows])
+
+
+def _average(total: float, count: int) -> float:
+    return total / count if count else 0
+
+
+def summary(conn) -> Dict:
+    """
+    All-time statistics from the 'all' rollups
+
+    Returns:
+        Dictionary with totals, averages, mode distribution and latency percentiles
+    """
+    rows = conn.execute(
+        "SELECT * FROM history_rollups WHERE granularity = 'all'"
+    ).fetchall()
+    bins = defaultdict(int)
+    for index, count in conn.execute(
+        "SELECT bin, SUM(count) FROM history_latency_bins WHERE granularity = 'all' GROUP BY bin"
+    ):
+        bins[index] = count
+
+    return {
+        'total_queries': sum(row['count'] for row in rows),
+        'avg_similarity': _average(sum(row['similarity_sum'] for row in rows), sum(row['similarity_count'] for row in rows)),
+        'avg_diversity': _average(sum(row['diversity_sum'] for row in rows), sum(row['diversity_count'] for row in rows)),
+        'avg_time': _average(sum(row['time_sum'] for row in rows), sum(row['time_count'] for row in rows)),
+        'mode_distribution': {row['query_mode']: row['count'] for row in rows},
+        'latency_percentiles': sketch_percentiles(bins)
+    }
+
+
+def timeseries(
+    conn,
+    granularity: str = 'hour',
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    mode: Optional[str] = None
+) -> List[Dict]:
+    """
+    Per-bucket counts, averages and latency percentiles
+
+    Args:
+        conn: Connection
+        granularity: 'hour' or 'day'
+        since: First bucket to include (stored timestamp format)
+        until: Buckets before this time
+        mode: Only this query_mode (default: all modes merged)
+
+    Returns:
+        List of points in bucket order
+    """
+    if granularity not in ('hour', 'day'):
+        raise ValueError(f"Unknown granularity: {granularity}")
+
+    conditions = ['granularity = ?']
+    params = [granularity]
+    if since:
+        conditions.append('bucket >= ?')
+        params.append(bucket_key(since, granularity))
+    if until:
+        conditions.append('bucket < ?')
+        params.append(until[:10] if granularity == 'day' else until)
+    if mode:
+        conditions.append('query_mode = ?')
+        params.append(mode)
+    where = ' AND '.join(conditions)
+
+    points = {}
+    for row in conn.execute(f'''
+        SELECT bucket, SUM(count), SUM(similarity_sum), SUM(similarity_count), SUM(time_sum), SUM(time_count)
+        FROM history_rollups WHERE {where}
+        GROUP BY bucket ORDER BY bucket
+    ''', params):
+        points[row[0]] = {
+            'bucket': row[0],
+            'count': row[1],
+            'avg_similarity': _average(row[2], row[3]),
+            'avg_time': _average(row[4], row[5]),
+            '_bins': defaultdict(int)
+        }
+
+    for bucket, index, count in conn.execute(f'''
+        SELECT bucket, bin, SUM(count) FROM history_latency_bins WHERE {where}
+        GROUP BY bucket, bin
+    ''', params):
+        if bucket in points:
+            points[bucket]['_bins'][index] = count
+
+    series = []
+    for point in points.values():
+        point.update(sketch_percentiles(point.pop('_bins')))
+        series.append(point)
+    return series
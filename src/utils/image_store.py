@@ -0,0 +1,357 @@
+"""
+Content-Addressed Image Store
+Stores each distinct image once under its pixel hash, with reference counts kept in SQLite
+
+Layout: <root>/<h[0:2]>/<h[2:4]>/<hash>.<ext>, plus <hash>_thumb.<ext> derived on first use.
+Reference counts live in the image_blobs table of the caller's database and are changed
+inside the caller's write transaction. Files are only renamed into place or unlinked
+while that transaction holds the write lock, so a blob is never deleted while another
+query is taking a reference to it.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image
+
+
+FORMATS = {
+    'JPEG': 'jpg',
+    'WEBP': 'webp',
+    'PNG': 'png'
+}
+
+
+class PreparedImage:
+    """An image hashed (and, if new, encoded to a temp file) outside the write transaction"""
+
+    __slots__ = ('hash', 'tmp_path', 'image', 'width', 'height')
+
+    def __init__(self, image_hash: str, tmp_path: Optional[str], image: Image.Image):
+        self.hash = image_hash
+        self.tmp_path = tmp_path
+        self.image = image
+        self.width, self.height = image.size
+
+
+class ImageStore:
+    """De-duplicating image store with reference counting, configurable encoding and lazy thumbnails"""
+
+    def __init__(
+        self,
+        root: str = 'history/images',
+        image_format: str = 'JPEG',
+        quality: int = 90,
+        thumbnail_size: int = 256
+    ):
+        """
+        Initialize image store
+
+        Args:
+            root: Blob directory
+            image_format: 'JPEG', 'WEBP' or 'PNG' for newly stored images
+            quality: Encoder quality for JPEG/WebP
+            thumbnail_size: Longest side of derived thumbnails
+        """
+        image_format = image_format.upper()
+        if image_format not in FORMATS:
+            raise ValueError(f"Unsupported image format: {image_format}")
+        self.root = Path(root)
+        self.format = image_format
+        self.extension = FORMATS[image_format]
+        self.quality = quality
+        self.thumbnail_size = thumbnail_size
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def create_tables(cursor):
+        """Create the reference-count table if it doesn't exist"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS image_blobs (
+                hash TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                format TEXT NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                bytes INTEGER,
+                refcount INTEGER NOT NULL DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+    @staticmethod
+    def hash_image(image: Image.Image) -> str:
+        """Hash of the decoded pixels, so re-uploads of the same picture match regardless of file encoding"""
+        digest = hashlib.sha256()
+        digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def perceptual_hash(image: Image.Image, size: int = 8) -> str:
+        """
+        Difference hash: equal for the same picture after re-encoding or resizing,
+        unlike hash_image
+
+        Args:
+            image: PIL image
+            size: Hash is size*size bits
+
+        Returns:
+            Hex string
+        """
+        gray = image.convert('L').resize((size + 1, size), Image.LANCZOS)
+        pixels = list(gray.getdata())
+        bits = 0
+        for row in range(size):
+            for col in range(size):
+                left = pixels[row * (size + 1) + col]
+                bits = (bits << 1) | (left > pixels[row * (size + 1) + col + 1])
+        return f"{bits:0{size * size // 4}x}"
+
+    @staticmethod
+    def hamming_distance(a: str, b: str) -> int:
+        """Differing bits between two perceptual hashes of the same size"""
+        return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+    @staticmethod
+    def is_low_entropy(phash: str, max_bits: int = 2) -> bool:
+        """
+        Whether a perceptual hash is (nearly) all 0 or all 1 bits. Flat images such as
+        solid colours and smooth gradients hash like this, so it identifies nothing.
+
+        Args:
+            phash: Hex hash from perceptual_hash
+            max_bits: Set (or unset) bits still counted as flat
+        """
+        ones = bin(int(phash, 16)).count('1')
+        return min(ones, len(phash) * 4 - ones) <= max_bits
+
+    def _blob_path(self, image_hash: str, extension: str, suffix: str = '') -> Path:
+        return self.root / image_hash[:2] / image_hash[2:4] / f"{image_hash}{suffix}.{extension}"
+
+    def _encode(self, image: Image.Image, path_hint: Path) -> str:
+        """Encode to a temp file in the blob's directory (so the final rename is atomic)"""
+        path_hint.parent.mkdir(parents=True, exist_ok=True)
+        if self.format == 'JPEG' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        elif self.format == 'WEBP' and image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+        fd, tmp_path = tempfile.mkstemp(dir=path_hint.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if self.format == 'PNG':
+                    image.save(f, self.format, optimize=True)
+                else:
+                    image.save(f, self.format, quality=self.quality)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        return tmp_path
+
+    def prepare(self, image: Image.Image, conn=None) -> PreparedImage:
+        """
+        Hash an image and encode it unless it is already stored (no write lock needed)
+
+        Args:
+            image: PIL image
+            conn: Connection used to check for an existing blob (None = always encode)
+
+        Returns:
+            PreparedImage to pass to add_refs inside the write transaction
+        """
+        image_hash = self.hash_image(image)
+        if conn is not None:
+            if conn.execute('SELECT 1 FROM image_blobs WHERE hash = ?', (image_hash,)).fetchone():
+                return PreparedImage(image_hash, None, image)
+        return PreparedImage(image_hash, self._encode(image, self._blob_path(image_hash, self.extension)), image)
+
+    def add_refs(self, conn, prepared: Iterable[PreparedImage]) -> Dict[str, str]:
+        """
+        Take one reference per prepared image, inside the caller's write transaction
+
+        Args:
+            conn: Connection holding the write lock
+            prepared: Images from prepare()
+
+        Returns:
+            Dictionary of hash -> stored path
+        """
+        paths = {}
+        for item in prepared:
+            row = conn.execute('SELECT path FROM image_blobs WHERE hash = ?', (item.hash,)).fetchone()
+            if row is not None and Path(row[0]).exists():
+                conn.execute('UPDATE image_blobs SET refcount = refcount + 1 WHERE hash = ?', (item.hash,))
+                paths[item.hash] = row[0]
+                self._discard(item)
+                continue
+
+            # New blob (or one whose file went missing): move the encoded file into place
+            final_path = self._blob_path(item.hash, self.extension)
+            tmp_path = item.tmp_path or self._encode(item.image, final_path)
+            os.replace(tmp_path, final_path)
+            item.tmp_path = None
+            conn.execute('''
+                INSERT INTO image_blobs (hash, path, format, width, height, bytes, refcount)
+                VALUES (?, ?, ?, ?, ?, ?, 1)
+                ON CONFLICT (hash) DO UPDATE SET
+                    path = excluded.path, format = excluded.format, bytes = excluded.bytes,
+                    refcount = refcount + 1
+            ''', (
+                item.hash, str(final_path), self.format, item.width, item.height,
+                final_path.stat().st_size
+            ))
+            paths[item.hash] = str(final_path)
+        return paths
+
+    @staticmethod
+    def _discard(item: PreparedImage):
+        if item.tmp_path:
+            try:
+                os.unlink(item.tmp_path)
+            except FileNotFoundError:
+                pass
+            item.tmp_path = None
+
+    def discard(self, prepared: Iterable[PreparedImage]):
+        """Remove temp files of prepared images whose transaction failed"""
+        for item in prepared:
+            self._discard(item)
+
+    def release(self, conn, hashes: Iterable[str]) -> List[Tuple[str, str]]:
+        """
+        Drop one reference per hash and delete the rows of blobs that reach zero,
+        inside the caller's write transaction. Their files are left in place until
+        the caller has committed and calls remove_released().
+
+        Args:
+            conn: Connection holding the write lock
+            hashes: Blob hashes, once per reference being dropped
+
+        Returns:
+            (hash, path) of the blobs whose rows were deleted
+        """
+        hashes = [h for h in hashes if h]
+        if not hashes:
+            return []
+
+        conn.executemany('UPDATE image_blobs SET refcount = refcount - 1 WHERE hash = ?', [(h,) for h in hashes])
+        placeholders = ','.join('?' * len(set(hashes)))
+        dead = conn.execute(
+            f'SELECT hash, path FROM image_blobs WHERE refcount <= 0 AND hash IN ({placeholders})',
+            list(set(hashes))
+        ).fetchall()
+        if not dead:
+            return []
+
+        conn.executemany('DELETE FROM image_blobs WHERE hash = ?', [(row[0],) for row in dead])
+        return [(row[0], row[1]) for row in dead]
+
+    def remove_released(self, conn, released: Iterable[Tuple[str, str]]) -> int:
+        """
+        Delete the files of released blobs, after the transaction that released them
+        committed (a rolled-back release never loses files)
+
+        Args:
+            conn: Connection holding the write lock, so no save re-adds a blob between
+                  the check and the unlink
+            released: Pairs returned by release()
+
+        Returns:
+            Number of blobs whose files were removed
+        """
+        removed = 0
+        for image_hash, path in released:
+            # A save may have stored the same image again since the release
+            if conn.execute('SELECT 1 FROM image_blobs WHERE hash = ?', (image_hash,)).fetchone():
+                continue
+            self._unlink_blob(image_hash, Path(path))
+            removed += 1
+        return removed
+
+    def _unlink_blob(self, image_hash: str, path: Path):
+        for file in (path, self._blob_path(image_hash, path.suffix.lstrip('.'), '_thumb')):
+            try:
+                file.unlink()
+            except FileNotFoundError:
+                pass
+
+    def thumbnail(self, conn, image_hash: str) -> Optional[str]:
+        """
+        Path of a blob's thumbnail, deriving it on first request
+
+        Args:
+            conn: Connection for the blob lookup
+            image_hash: Blob hash
+
+        Returns:
+            Thumbnail path, or None if the blob doesn't exist
+        """
+        row = conn.execute('SELECT path FROM image_blobs WHERE hash = ?', (image_hash,)).fetchone()
+        if row is None or not Path(row[0]).exists():
+            return None
+
+        source = Path(row[0])
+        thumb_path = self._blob_path(image_hash, source.suffix.lstrip('.'), '_thumb')
+        if not thumb_path.exists():
+            with Image.open(source) as img:
+                img.thumbnail((self.thumbnail_size, self.thumbnail_size))
+                image_format = Image.registered_extensions().get(source.suffix.lower(), 'JPEG')
+                fd, tmp_path = tempfile.mkstemp(dir=thumb_path.parent, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    img.save(f, image_format, **({} if image_format == 'PNG' else {'quality': 80}))
+            # Concurrent derivations race harmlessly: both write identical content
+            os.replace(tmp_path, thumb_path)
+        return str(thumb_path)
+
+    def path_for(self, conn, image_hash: str) -> Optional[str]:
+        """Stored path of a blob, or None if it doesn't exist"""
+        row = conn.execute('SELECT path FROM image_blobs WHERE hash = ?', (image_hash,)).fetchone()
+        return row[0] if row else None
+
+    def collect_orphans(self, conn, min_age_seconds: float = 3600) -> int:
+        """
+        Delete blob files with no image_blobs row (left by a crash between encoding and
+        commit) and stale temp files. Run while holding the write lock.
+
+        Args:
+            conn: Connection holding the write lock
+            min_age_seconds: Skip files newer than this (they may belong to a save in progress)
+
+        Returns:
+            Number of files removed
+        """
+        known = {row[0] for row in conn.execute('SELECT hash FROM image_blobs')}
+        cutoff = time.time() - min_age_seconds
+        removed = 0
+        for file in self.root.glob('*/*/*'):
+            if not file.is_file() or file.stat().st_mtime > cutoff:
+                continue
+            image_hash = file.name.split('.')[0].split('_')[0]
+            if file.suffix == '.tmp' or image_hash not in known:
+                file.unlink()
+                removed += 1
+        return removed
+
+    def get_statistics(self, conn) -> Dict:
+        """
+        Get store statistics
+
+        Returns:
+            Dictionary with blob count, references and bytes stored vs referenced
+        """
+        blobs, references, stored, referenced = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(refcount), 0), COALESCE(SUM(bytes), 0), '
+            'COALESCE(SUM(bytes * refcount), 0) FROM image_blobs'
+        ).fetchone()
+        return {
+            'blobs': blobs,
+            'references': references,
+            'bytes_stored': stored,
+            'bytes_deduplicated': referenced - stored
+        }
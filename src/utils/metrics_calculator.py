@@ -3,25 +3,73 @@ Metrics Calculator for RAG System
 Calculates retrieval quality, generation quality, and performance metrics
 """
 
+import itertools
 import numpy as np
-from typing import Dict, List
+from typing import Dict, List, Sequence
 import re
 
 
+# Compiled once; the batch patterns also match the separator joining texts, so a single
+# pass over the whole batch can be split back into per-text tokens
+WORD_PATTERN = re.compile(r'\b\w+\b')
+SENTENCE_SPLIT_PATTERN = re.compile(r'[.!?]+')
+TEXT_SEPARATOR = '\x01'
+BATCH_WORD_PATTERN = re.compile(r'\x01|\b\w+\b')
+# Matches a separator, or a sentence (a run between terminators that isn't blank) as ''
+BATCH_SENTENCE_PATTERN = re.compile(r'(\x01)|[^.!?\x01]*[^\s.!?\x01][^.!?\x01]*')
+
+
+def _token_ids(tokens: List[str]):
+    """
+    Integer id per token, equal for equal tokens: the position of its first occurrence
+    (so ids are below len(tokens)). Also returns the token -> id dictionary.
+    """
+    vocabulary = {}
+    ids = np.fromiter(
+        map(vocabulary.setdefault, tokens, itertools.count()), dtype=np.int64, count=len(tokens)
+    )
+    return ids, vocabulary
+
+
+def _split_batch(is_separator: np.ndarray) -> np.ndarray:
+    """Text index of each non-separator token found in separator-joined texts"""
+    return np.cumsum(is_separator)[~is_separator]
+
+
+def _unique_per_group(value_ids: np.ndarray, n_values: int, group_ids: np.ndarray, n_groups: int) -> np.ndarray:
+    """Number of distinct value ids (all below n_values) in each group"""
+    pairs = np.sort(group_ids.astype(np.int64) * max(n_values, 1) + value_ids)
+    first = np.ones(pairs.size, dtype=bool)
+    first[1:] = pairs[1:] != pairs[:-1]
+    return np.bincount(pairs[first] // max(n_values, 1), minlength=n_groups)
+
+
 class MetricsCalculator:
     """Calculate various metrics for retrieval and generation"""
     
+    # Results at least this similar to a higher-ranked one count as redundant
+    REDUNDANCY_THRESHOLD = 0.9
+    
     @staticmethod
-    def calculate_retrieval_metrics(results: Dict) -> Dict:
+    def calculate_retrieval_metrics(results: Dict, embeddings: np.ndarray = None) -> Dict:
         """
         Calculate retrieval quality metrics
         
         Args:
             results: Search results dictionary
+            embeddings: Stored vectors of the results, in rank order (adds the
+                        embedding-space metrics of calculate_embedding_metrics)
             
         Returns:
             Dictionary with retrieval metrics
         """
+        metrics = MetricsCalculator._caption_retrieval_metrics(results)
+        if embeddings is not None:
+            metrics.update(MetricsCalculator.calculate_embedding_metrics(embeddings))
+        return metrics
+    
+    @staticmethod
+    def _caption_retrieval_metrics(results: Dict) -> Dict:
         if not results.get('results'):
             return {
                 'avg_similarity': 0.0,
@@ -52,6 +100,64 @@ class MetricsCalculator:
             'total_results': len(results['results'])
         }
     
+    @staticmethod
+    def calculate_embedding_metrics(embeddings: np.ndarray, redundancy_threshold: float = None) -> Dict:
+        """
+        Diversity of a result set in embedding space, from one k x k product of its
+        L2-normalized vectors
+        
+        - embedding_diversity: mean pairwise cosine distance (0 = identical results)
+        - embedding_spread: 1 - length of the mean vector (0 = all in one direction)
+        - embedding_coverage: effective number of distinct directions (entropy of the
+          similarity matrix's eigenvalues) as a fraction of k (1 = fully independent)
+        - redundancy: fraction of results at least redundancy_threshold similar to a
+          higher-ranked result (near-duplicates)
+        
+        Args:
+            embeddings: Vectors of the results in rank order (k x D)
+            redundancy_threshold: Cosine similarity for near-duplicates
+                                  (default REDUNDANCY_THRESHOLD)
+            
+        Returns:
+            Dictionary with embedding metrics
+        """
+        if redundancy_threshold is None:
+            redundancy_threshold = MetricsCalculator.REDUNDANCY_THRESHOLD
+        
+        k = len(embeddings)
+        if k < 2:
+            return {
+                'embedding_diversity': 0.0,
+                'embedding_spread': 0.0,
+                'embedding_coverage': float(k),
+                'redundancy': 0.0
+            }
+        
+        vectors = np.asarray(embeddings, dtype=np.float64)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        similarity = vectors @ vectors.T
+        
+        upper = np.triu_indices(k, 1)
+        mean_distance = 1.0 - similarity[upper].mean()
+        
+        # |mean vector|^2 is the mean of all entries of the similarity matrix
+        spread = 1.0 - np.sqrt(max(similarity.mean(), 0.0))
+        
+        eigenvalues = np.clip(np.linalg.eigvalsh(similarity), 0.0, None)
+        weights = eigenvalues[eigenvalues > 0] / eigenvalues.sum()
+        coverage = np.exp(-np.sum(weights * np.log(weights))) / k
+        
+        # Result i is redundant if some j < i is a near-duplicate of it
+        near_duplicates = np.tril(similarity >= redundancy_threshold, -1)
+        redundancy = near_duplicates.any(axis=1).mean()
+        
+        return {
+            'embedding_diversity': float(mean_distance),
+            'embedding_spread': float(spread),
+            'embedding_coverage': float(coverage),
+            'redundancy': float(redundancy)
+        }
+    
     @staticmethod
     def calculate_text_metrics(text: str) -> Dict:
         """
@@ -77,12 +183,12 @@ class MetricsCalculator:
         text = text.strip()
         
         # Word analysis
-        words = re.findall(r'\b\w+\b', text.lower())
+        words = WORD_PATTERN.findall(text.lower())
         word_count = len(words)
         unique_words = len(set(words))
         
         # Sentence analysis
-        sentences = [s.strip() for s in re.split(r'[.!?]+', text) if s.strip()]
+        sentences = [s.strip() for s in SENTENCE_SPLIT_PATTERN.split(text) if s.strip()]
         sentence_count = len(sentences)
         
         # Character count
@@ -103,6 +209,132 @@ class MetricsCalculator:
             'vocabulary_richness': float(vocabulary_richness)
         }
     
+    @staticmethod
+    def calculate_retrieval_metrics_batch(
+        scores: Sequence[Sequence[float]],
+        captions: Sequence[Sequence[str]] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Retrieval metrics for many result sets at once, identical to calling
+        calculate_retrieval_metrics on each
+        
+        Args:
+            scores: N x k similarity scores (2-D array, or N sequences of varying length)
+            captions: Per result set, all captions of its results (diversity is
+                      omitted when not given)
+            
+        Returns:
+            Dictionary of metric name -> array of N values (see batch_to_list)
+        """
+        n = len(scores)
+        metrics = {
+            'avg_similarity': np.zeros(n),
+            'min_similarity': np.zeros(n),
+            'max_similarity': np.zeros(n),
+            'std_similarity': np.zeros(n)
+        }
+        
+        if isinstance(scores, np.ndarray) and scores.ndim == 2:
+            lengths = np.full(n, scores.shape[1], dtype=np.int64)
+            blocks = [(np.arange(n), scores.astype(np.float64))] if scores.shape[1] else []
+        else:
+            # Rows of equal length are stacked and reduced together, so each row sees
+            # exactly the reduction the single-item version does
+            lengths = np.array([len(row) for row in scores], dtype=np.int64)
+            blocks = []
+            for length in np.unique(lengths[lengths > 0]):
+                rows = np.flatnonzero(lengths == length)
+                blocks.append((rows, np.array([scores[i] for i in rows], dtype=np.float64)))
+        
+        for rows, block in blocks:
+            metrics['avg_similarity'][rows] = np.mean(block, axis=1)
+            metrics['min_similarity'][rows] = np.min(block, axis=1)
+            metrics['max_similarity'][rows] = np.max(block, axis=1)
+            metrics['std_similarity'][rows] = np.std(block, axis=1)
+        
+        if captions is not None:
+            counts = np.array([len(c) for c in captions], dtype=np.int64)
+            caption_ids, _ = _token_ids([caption for group in captions for caption in group])
+            unique = _unique_per_group(caption_ids, caption_ids.size, np.repeat(np.arange(n), counts), n)
+            diversity = np.zeros(n)
+            np.divide(unique, counts, out=diversity, where=counts > 0)
+            # Like the single-item version, an empty result set has no diversity
+            diversity[lengths == 0] = 0.0
+            metrics['diversity'] = diversity
+        
+        metrics['total_results'] = lengths
+        return metrics
+    
+    @staticmethod
+    def calculate_text_metrics_batch(texts: Sequence[str]) -> Dict[str, np.ndarray]:
+        """
+        Text metrics for many texts at once, identical to calling calculate_text_metrics
+        on each. All texts are tokenized by one pass of a compiled pattern over the joined
+        batch; counts and averages are then per-text array reductions.
+        
+        Args:
+            texts: Generated texts (None or blank texts score zero)
+            
+        Returns:
+            Dictionary of metric name -> array of len(texts) values (see batch_to_list)
+        """
+        n = len(texts)
+        stripped = [(text or '').strip() for text in texts]
+        if any(TEXT_SEPARATOR in text for text in stripped):
+            # The separator can't be told apart from text containing it
+            return MetricsCalculator._text_metrics_rows(stripped)
+        
+        tokens = BATCH_WORD_PATTERN.findall(TEXT_SEPARATOR.join(stripped).lower())
+        token_ids, vocabulary = _token_ids(tokens)
+        is_separator = token_ids == vocabulary.get(TEXT_SEPARATOR, -1)
+        word_ids, word_text_ids = token_ids[~is_separator], _split_batch(is_separator)
+        word_lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))[~is_separator]
+        
+        # Sentences come back as '' and separators as themselves
+        sentence_tokens = BATCH_SENTENCE_PATTERN.findall(TEXT_SEPARATOR.join(stripped))
+        sentence_text_ids = _split_batch(
+            np.fromiter(map(bool, sentence_tokens), dtype=bool, count=len(sentence_tokens))
+        )
+        
+        word_count = np.bincount(word_text_ids, minlength=n)
+        unique_words = _unique_per_group(word_ids, token_ids.size, word_text_ids, n)
+        letters = np.bincount(word_text_ids, weights=word_lengths, minlength=n)
+        
+        has_words = word_count > 0
+        avg_word_length = np.zeros(n)
+        np.divide(letters, word_count, out=avg_word_length, where=has_words)
+        vocabulary_richness = np.zeros(n)
+        np.divide(unique_words, word_count, out=vocabulary_richness, where=has_words)
+        
+        return {
+            'word_count': word_count,
+            'char_count': np.array([len(text) for text in stripped], dtype=np.int64),
+            'sentence_count': np.bincount(sentence_text_ids, minlength=n),
+            'avg_word_length': avg_word_length,
+            'unique_words': unique_words,
+            'vocabulary_richness': vocabulary_richness
+        }
+    
+    @staticmethod
+    def _text_metrics_rows(texts: Sequence[str]) -> Dict[str, np.ndarray]:
+        rows = [MetricsCalculator.calculate_text_metrics(text) for text in texts]
+        return {key: np.array([row[key] for row in rows]) for key in rows[0]} if rows else {}
+    
+    @staticmethod
+    def batch_to_list(batch: Dict[str, np.ndarray]) -> List[Dict]:
+        """
+        Convert batch metrics to one dictionary per item, with the same keys and Python
+        types as the single-item methods return
+        
+        Args:
+            batch: Result of a *_batch method
+            
+        Returns:
+            List of metric dictionaries
+        """
+        columns = {key: values.tolist() for key, values in batch.items()}
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
+    
     @staticmethod
     def format_time(seconds: float) -> str:
         """
@@ -193,6 +425,24 @@ if __name__ == "__main__":
     for k, v in text_metrics.items():
         print(f"  {k}: {v}")
     
+    # Test embedding metrics (two near-duplicates and one different result)
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=(2, 512))
+    test_embeddings = np.vstack([base[0], base[0] + 0.1 * rng.normal(size=512), base[1]])
+    emb_metrics = calc.calculate_embedding_metrics(test_embeddings)
+    print("\nEmbedding Metrics:")
+    for k, v in emb_metrics.items():
+        print(f"  {k}: {v:.3f}")
+    
+    # Test batch metrics (identical to the single-item results)
+    batch = calc.calculate_retrieval_metrics_batch(
+        [[r['similarity_score'] for r in test_results['results']]],
+        [[c for r in test_results['results'] for c in r['captions']]]
+    )
+    print(f"\nBatch retrieval metrics match: {calc.batch_to_list(batch)[0] == ret_metrics}")
+    batch = calc.calculate_text_metrics_batch([test_text, "", "Short one."])
+    print(f"Batch text metrics match: {calc.batch_to_list(batch)[0] == text_metrics}")
+    
     # Test time formatting
     print("\nTime Formatting:")
     print(f"  0.0005s -> {calc.format_time(0.0005)}")
@@ -0,0 +1,236 @@
+"""
+Rate Limiter for Outbound API Calls
+Token-bucket request/token limits plus a concurrency cap, shared per provider/model
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+
+class RateLimitTimeout(TimeoutError):
+    """Raised when a caller's queue deadline passes before capacity frees up"""
+
+
+class RateLimiter:
+    """
+    Blocks callers until a request slot, enough token budget and a concurrency
+    slot are available. Waiters are woken in arrival order as capacity returns.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_concurrent: Optional[int] = None
+    ):
+        """
+        Initialize rate limiter
+
+        Args:
+            name: Limiter name (e.g. 'groq/llama3-70b-8192')
+            requests_per_minute: Request budget (None = unlimited)
+            tokens_per_minute: Token budget (None = unlimited)
+            max_concurrent: Maximum in-flight calls (None = unlimited)
+        """
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrent = max_concurrent
+
+        # Buckets start full so a cold process can burst up to one minute of budget
+        self._request_tokens = float(requests_per_minute or 0)
+        self._token_tokens = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self.in_flight = 0
+
+        self.total_acquired = 0
+        self.total_timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._recent_waits = deque(maxlen=500)
+
+    def _refill(self, now: float):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_tokens = min(
+                float(self.requests_per_minute),
+                self._request_tokens + elapsed * self.requests_per_minute / 60.0
+            )
+        if self.tokens_per_minute:
+            self._token_tokens = min(
+                float(self.tokens_per_minute),
+                self._token_tokens + elapsed * self.tokens_per_minute / 60.0
+            )
+
+    def _seconds_until_available(self, tokens: float) -> Optional[float]:
+        """0 if the call can start now, seconds until it can, or None if blocked on concurrency"""
+        if self.max_concurrent and self.in_flight >= self.max_concurrent:
+            return None
+
+        wait = 0.0
+        if self.requests_per_minute and self._request_tokens < 1:
+            wait = max(wait, (1 - self._request_tokens) * 60.0 / self.requests_per_minute)
+        if self.tokens_per_minute and self._token_tokens < tokens:
+            wait = max(wait, (tokens - self._token_tokens) * 60.0 / self.tokens_per_minute)
+        return wait
+
+    def acquire(self, tokens: float = 0, timeout: Optional[float] = None) -> float:
+        """
+        Wait for capacity and claim it
+
+        Args:
+            tokens: Estimated tokens the call will consume (prompt + completion)
+            timeout: Maximum seconds to wait in the queue (None = forever)
+
+        Returns:
+            Seconds spent waiting
+
+        Raises:
+            RateLimitTimeout: If the deadline passes while queued
+        """
+        if self.tokens_per_minute:
+            # A call larger than the whole bucket would never fit; let it drain the bucket instead
+            tokens = min(tokens, self.tokens_per_minute)
+
+        start = time.monotonic()
+        deadline = start + timeout if timeout is not None else None
+        ticket = object()
+
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+
+                    wait = None
+                    if self._queue[0] is ticket:
+                        wait = self._seconds_until_available(tokens)
+                        if wait == 0:
+                            break
+
+                    if deadline is not None and now >= deadline:
+                        self.total_timeouts += 1
+                        raise RateLimitTimeout(
+                            f"{self.name}: no capacity within {timeout:.1f}s"
+                        )
+
+                    # Wake up when budget refills, capacity is released, or the deadline hits
+                    sleep_for = wait if wait is not None else 1.0
+                    if deadline is not None:
+                        sleep_for = min(sleep_for, deadline - now)
+                    self._cond.wait(max(sleep_for, 0.001))
+
+                if self.requests_per_minute:
+                    self._request_tokens -= 1
+                if self.tokens_per_minute:
+                    self._token_tokens -= tokens
+                self.in_flight += 1
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+            waited = time.monotonic() - start
+            self.total_acquired += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self._recent_waits.append(waited)
+
+        return waited
+
+    def release(self):
+        """Return the concurrency slot claimed by acquire"""
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            self._cond.notify_all()
+
+    @contextmanager
+    def limit(self, tokens: float = 0, timeout: Optional[float] = None):
+        """
+        Context manager around acquire/release
+
+        Yields:
+            Seconds spent waiting in the queue
+        """
+        waited = self.acquire(tokens, timeout)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    def get_statistics(self) -> Dict:
+        """
+        Get limiter statistics
+
+        Returns:
+            Dictionary with queue depth, in-flight calls and queue wait metrics
+        """
+        with self._cond:
+            waits = sorted(self._recent_waits)
+            return {
+                'requests_per_minute': self.requests_per_minute,
+                'tokens_per_minute': self.tokens_per_minute,
+                'max_concurrent': self.max_concurrent,
+                'queued': len(self._queue),
+                'in_flight': self.in_flight,
+                'acquired': self.total_acquired,
+                'timeouts': self.total_timeouts,
+                'avg_wait': self.total_wait / self.total_acquired if self.total_acquired else 0.0,
+                'p95_wait': waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+                'max_wait': self.max_wait
+            }
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str, **kwargs) -> RateLimiter:
+    """
+    Get the process-wide limiter for a name, creating it on first use
+
+    Args:
+        name: Limiter name, typically 'provider/model'
+        **kwargs: RateLimiter settings, used only when the limiter is created
+
+    Returns:
+        Shared RateLimiter
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(name, **kwargs)
+        return _limiters[name]
+
+
+def get_all_statistics() -> Dict[str, Dict]:
+    """Statistics for every registered limiter"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.get_statistics() for limiter in limiters}
+
+
+if __name__ == "__main__":
+    # Test rate limiter: 120 requests/min with 2 concurrent slots
+    from concurrent.futures import ThreadPoolExecutor
+
+    limiter = get_rate_limiter("demo/model", requests_per_minute=120, max_concurrent=2)
+    limiter._request_tokens = 0  # start empty to show pacing
+
+    def call(i):
+        with limiter.limit(timeout=5) as waited:
+            time.sleep(0.05)
+            return waited
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        waits = list(pool.map(call, range(8)))
+
+    print(f"Waits: {[round(w, 2) for w in waits]}")
+    print(f"Statistics: {limiter.get_statistics()}")
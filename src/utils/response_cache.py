@@ -0,0 +1,222 @@
+"""
+Response Cache for LLM Generation
+Persistent SQLite cache keyed by provider, model, generation settings and prompt hash
+
+The cache is best-effort: a database error (e.g. a lock held past busy_timeout by
+another worker) counts as a miss or a skipped write and never fails generation.
+"""
+
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from src.utils.sqlite_pool import PoolTimeout, SQLitePool
+
+
+class ResponseCache:
+    """Persistent LLM response cache with TTL and size-based (LRU) eviction"""
+
+    def __init__(
+        self,
+        db_path: str = 'history/llm_cache.db',
+        ttl_seconds: float = 7 * 24 * 3600,
+        max_entries: int = 10000,
+        pool: SQLitePool = None
+    ):
+        """
+        Initialize response cache
+
+        Args:
+            db_path: Path to SQLite database file
+            ttl_seconds: Entries older than this are treated as misses and removed
+            max_entries: Least recently used entries beyond this are evicted
+            pool: Connection pool (default: a small WAL pool on db_path)
+        """
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.pool = pool or SQLitePool(db_path, max_connections=4)
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+        self._init_db()
+
+    def _init_db(self):
+        """Create cache table if it doesn't exist"""
+        with self.pool.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    provider TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_responses_last_accessed
+                ON responses(last_accessed)
+            ''')
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @staticmethod
+    def make_key(
+        provider: str,
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        system_message: str,
+        user_message: str
+    ) -> str:
+        """
+        Build cache key from generation settings and a hash of the messages
+
+        Returns:
+            Hex digest identifying the request
+        """
+        messages_hash = hashlib.sha256(
+            json.dumps([system_message, user_message]).encode('utf-8')
+        ).hexdigest()
+
+        key_data = json.dumps({
+            'provider': provider,
+            'model': model,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+            'messages': messages_hash
+        }, sort_keys=True)
+
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached response
+
+        Args:
+            key: Cache key from make_key
+
+        Returns:
+            Cached response, or None on miss or expiry
+        """
+        now = time.time()
+        try:
+            with self.pool.connection() as conn:
+                row = conn.execute(
+                    'SELECT response, created_at FROM responses WHERE key = ?',
+                    (key,)
+                ).fetchone()
+        except (sqlite3.Error, PoolTimeout) as e:
+            print(f"Response cache lookup failed: {e}")
+            self._count('errors')
+            row = None
+
+        if row is not None:
+            expired = now - row[1] > self.ttl_seconds
+            try:
+                # Only hits and expired entries take the write lock
+                with self.pool.transaction() as conn:
+                    if expired:
+                        conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                    else:
+                        conn.execute(
+                            'UPDATE responses SET last_accessed = ? WHERE key = ?',
+                            (now, key)
+                        )
+            except (sqlite3.Error, PoolTimeout) as e:
+                print(f"Response cache update skipped: {e}")
+                self._count('errors')
+            if expired:
+                row = None
+
+        self._count('misses' if row is None else 'hits')
+        return row[0] if row is not None else None
+
+    def set(self, key: str, response: str, provider: str, model: str):
+        """
+        Store a response and evict entries over the size limit
+
+        Args:
+            key: Cache key from make_key
+            response: Generated text (must be a real provider answer, not a fallback)
+            provider: LLM provider
+            model: Model name
+        """
+        now = time.time()
+        try:
+            with self.pool.transaction() as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO responses (
+                        key, provider, model, response, created_at, last_accessed
+                    ) VALUES (?, ?, ?, ?, ?, ?)
+                ''', (key, provider, model, response, now, now))
+
+                # Drop expired entries, then least recently used ones beyond max_entries
+                conn.execute(
+                    'DELETE FROM responses WHERE created_at < ?',
+                    (now - self.ttl_seconds,)
+                )
+                conn.execute('''
+                    DELETE FROM responses WHERE key IN (
+                        SELECT key FROM responses
+                        ORDER BY last_accessed DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                ''', (self.max_entries,))
+        except (sqlite3.Error, PoolTimeout) as e:
+            # A skipped write only costs a future miss
+            print(f"Response cache write skipped: {e}")
+            self._count('errors')
+
+    def clear(self):
+        """Remove all cached responses"""
+        with self.pool.transaction() as conn:
+            conn.execute('DELETE FROM responses')
+
+    def get_statistics(self) -> Dict:
+        """
+        Get cache statistics
+
+        Returns:
+            Dictionary with entry count and hit/miss counters
+        """
+        try:
+            with self.pool.connection() as conn:
+                entries = conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        except (sqlite3.Error, PoolTimeout):
+            entries = None
+
+        with self._lock:
+            hits, misses, errors = self.hits, self.misses, self.errors
+        lookups = hits + misses
+        return {
+            'entries': entries,
+            'hits': hits,
+            'misses': misses,
+            'errors': errors,
+            'hit_rate': hits / lookups if lookups else 0.0
+        }
+
+
+if __name__ == "__main__":
+    # Test response cache
+    cache = ResponseCache()
+    key = cache.make_key("gemini", "gemini-1.5-flash", 0.7, 200, "system", "user")
+
+    print(f"Lookup before set: {cache.get(key)}")
+    cache.set(key, "A cached description.", "gemini", "gemini-1.5-flash")
+    print(f"Lookup after set: {cache.get(key)}")
+    print(f"Statistics: {cache.get_statistics()}")
@@ -0,0 +1,242 @@
+"""
+Result Handle Store
+Short-lived server-side copies of search and generation results, so saving to history
+references a handle instead of re-uploading results and images
+
+Entries live in a small SQLite database (shared by every worker process, unlike an
+in-memory dict) and expire after a TTL unless saved first. Images are kept as the
+encoded bytes the server already has: the uploaded file for query images and the
+JPEG sent to the client for generated images.
+"""
+
+import json
+import secrets
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from src.utils.sqlite_pool import SQLitePool
+
+
+class ResultStore:
+    """TTL store of result payloads and image bytes, addressed by random handles"""
+
+    def __init__(
+        self,
+        db_path: str = 'history/result_handles.db',
+        ttl_seconds: float = 900,
+        evict_interval: float = 60,
+        pool: SQLitePool = None
+    ):
+        """
+        Initialize result store
+
+        Args:
+            db_path: Path to SQLite database file
+            ttl_seconds: Handles not saved within this many seconds are evicted
+            evict_interval: Seconds between sweeps of expired handles
+            pool: Connection pool (default: a small WAL pool on db_path)
+        """
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.evict_interval = evict_interval
+        self.pool = pool or SQLitePool(db_path, max_connections=4)
+
+        self._lock = threading.Lock()
+        self._last_eviction = 0.0
+        self.stats = {'created': 0, 'hits': 0, 'misses': 0, 'evicted': 0}
+
+        with self.pool.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS result_handles (
+                    handle TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL,
+                    payload TEXT NOT NULL,
+                    query_image BLOB,
+                    generated_image BLOB
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_result_handles_expires ON result_handles(expires_at)')
+
+    def create(self, payload: Dict, query_image: Optional[bytes] = None) -> str:
+        """
+        Store a result and return its handle
+
+        Args:
+            payload: JSON-serialisable result data
+            query_image: Encoded query image bytes
+
+        Returns:
+            Handle string
+        """
+        self._maybe_evict()
+        handle = secrets.token_urlsafe(16)
+        with self.pool.transaction() as conn:
+            conn.execute(
+                'INSERT INTO result_handles (handle, expires_at, payload, query_image) VALUES (?, ?, ?, ?)',
+                (handle, time.time() + self.ttl_seconds, json.dumps(payload), query_image)
+            )
+        with self._lock:
+            self.stats['created'] += 1
+        return handle
+
+    def update(self, handle: str, payload: Optional[Dict] = None, generated_image: Optional[bytes] = None) -> bool:
+        """
+        Merge later results (e.g. generated text or image) into a handle and renew its TTL
+
+        Args:
+            handle: Handle from create()
+            payload: Keys to add or replace in the stored payload
+            generated_image: Encoded generated image bytes
+
+        Returns:
+            False if the handle doesn't exist or has expired
+        """
+        with self.pool.transaction() as conn:
+            row = conn.execute(
+                'SELECT payload FROM result_handles WHERE handle = ? AND expires_at > ?',
+                (handle, time.time())
+            ).fetchone()
+            if row is None:
+                return False
+            merged = json.loads(row[0])
+            merged.update(payload or {})
+            conn.execute(
+                'UPDATE result_handles SET payload = ?, expires_at = ?, '
+                'generated_image = COALESCE(?, generated_image) WHERE handle = ?',
+                (json.dumps(merged), time.time() + self.ttl_seconds, generated_image, handle)
+            )
+        return True
+
+    def get(self, handle: str) -> Optional[Dict]:
+        """
+        Look up a handle
+
+        Args:
+            handle: Handle from create()
+
+        Returns:
+            Dictionary with 'payload', 'query_image' and 'generated_image', or None if
+            the handle doesn't exist or has expired
+        """
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                'SELECT payload, query_image, generated_image FROM result_handles '
+                'WHERE handle = ? AND expires_at > ?',
+                (handle, time.time())
+            ).fetchone()
+        with self._lock:
+            self.stats['hits' if row else 'misses'] += 1
+        if row is None:
+            return None
+        return {
+            'payload': json.loads(row[0]),
+            'query_image': row[1],
+            'generated_image': row[2]
+        }
+
+    def claim(self, handle: str) -> Optional[Dict]:
+        """
+        Look up and remove a handle in one transaction, so only one caller can save it
+
+        Args:
+            handle: Handle from create()
+
+        Returns:
+            Same as get(), or None if the handle doesn't exist, has expired or was
+            claimed by another request
+        """
+        with self.pool.transaction() as conn:
+            row = conn.execute(
+                'SELECT payload, query_image, generated_image FROM result_handles '
+                'WHERE handle = ? AND expires_at > ?',
+                (handle, time.time())
+            ).fetchone()
+            if row is not None and conn.execute(
+                'DELETE FROM result_handles WHERE handle = ?', (handle,)
+            ).rowcount != 1:
+                row = None
+        with self._lock:
+            self.stats['hits' if row else 'misses'] += 1
+        if row is None:
+            return None
+        return {
+            'payload': json.loads(row[0]),
+            'query_image': row[1],
+            'generated_image': row[2]
+        }
+
+    def restore(self, handle: str, stored: Dict):
+        """
+        Put back a claimed handle (e.g. when saving its result failed), with a fresh TTL
+
+        Args:
+            handle: Handle passed to claim()
+            stored: Dictionary returned by claim()
+        """
+        with self.pool.transaction() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO result_handles (handle, expires_at, payload, query_image, generated_image) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (
+                    handle, time.time() + self.ttl_seconds, json.dumps(stored['payload']),
+                    stored['query_image'], stored['generated_image']
+                )
+            )
+
+    def delete(self, handle: str):
+        """Drop a handle (once its result is saved)"""
+        with self.pool.transaction() as conn:
+            conn.execute('DELETE FROM result_handles WHERE handle = ?', (handle,))
+
+    def _maybe_evict(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_eviction < self.evict_interval:
+                return
+            self._last_eviction = now
+        self.evict_expired()
+
+    def evict_expired(self) -> int:
+        """
+        Delete expired handles
+
+        Returns:
+            Number of handles evicted
+        """
+        with self.pool.transaction() as conn:
+            evicted = conn.execute('DELETE FROM result_handles WHERE expires_at <= ?', (time.time(),)).rowcount
+        with self._lock:
+            self.stats['evicted'] += evicted
+        return evicted
+
+    def get_statistics(self) -> Dict:
+        """
+        Get store statistics
+
+        Returns:
+            Dictionary with live handles and create/hit/miss/eviction counts
+        """
+        with self.pool.connection() as conn:
+            live = conn.execute(
+                'SELECT COUNT(*) FROM result_handles WHERE expires_at > ?', (time.time(),)
+            ).fetchone()[0]
+        with self._lock:
+            return {'live': live, 'ttl_seconds': self.ttl_seconds, **self.stats}
+
+
+if __name__ == "__main__":
+    # Test result store
+    import tempfile
+
+    store = ResultStore(str(Path(tempfile.mkdtemp()) / 'handles.db'), ttl_seconds=1)
+    handle = store.create({'query_text': 'a dog on a beach', 'results': []}, query_image=b'jpeg bytes')
+    store.update(handle, {'generated_text': 'A dog runs along the shore.'}, generated_image=b'more bytes')
+    print(f"Handle {handle}: {store.get(handle)['payload']}")
+    time.sleep(1.1)
+    print(f"After TTL: {store.get(handle)}, evicted {store.evict_expired()}")
+    print(f"Statistics: {store.get_statistics()}")
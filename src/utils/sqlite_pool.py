@@ -0,0 +1,224 @@
+"""
+SQLite Connection Pool
+Reusable WAL-mode connections shared by the threads of one process
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict
+
+
+class PoolTimeout(RuntimeError):
+    """Raised when no pooled connection becomes free in time"""
+
+
+class SQLitePool:
+    """
+    Fixed-size pool of SQLite connections in WAL mode.
+
+    WAL lets readers run alongside a writer, so only writes serialise. Pooled
+    connections keep their page cache and prepared-statement cache (sqlite3 caches
+    statements per connection by SQL text) across requests. Writes take the write
+    lock up front with BEGIN IMMEDIATE, so a busy database is waited out via
+    busy_timeout instead of failing when a read transaction tries to upgrade.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_connections: int = 8,
+        busy_timeout: float = 5.0,
+        cache_size_kb: int = 8192,
+        mmap_size_mb: int = 64,
+        synchronous: str = 'NORMAL',
+        acquire_timeout: float = 10.0,
+        cached_statements: int = 128,
+        auto_vacuum: str = 'INCREMENTAL'
+    ):
+        """
+        Initialize pool
+
+        Args:
+            db_path: Path to SQLite database file
+            max_connections: Connections kept open (readers can run concurrently)
+            busy_timeout: Seconds to wait for a lock held by another connection/process
+            cache_size_kb: Page cache per connection
+            mmap_size_mb: Memory-mapped I/O window (0 disables)
+            synchronous: NORMAL is durable across application crashes in WAL mode;
+                         FULL also survives power loss
+            acquire_timeout: Seconds to wait for a free pooled connection
+            cached_statements: Prepared statements kept per connection
+            auto_vacuum: Auto-vacuum mode of a new database file (existing databases
+                         keep theirs until the next VACUUM)
+        """
+        self.db_path = db_path
+        self.max_connections = max_connections
+        self.busy_timeout = busy_timeout
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size_mb = mmap_size_mb
+        self.synchronous = synchronous
+        self.acquire_timeout = acquire_timeout
+        self.cached_statements = cached_statements
+        self.auto_vacuum = auto_vacuum
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._reset()
+
+        self.stats = {'created': 0, 'acquired': 0, 'waited': 0, 'total_wait': 0.0}
+
+    def _reset(self):
+        """Start with an empty pool (also used after fork: connections must not cross processes)"""
+        self._pid = os.getpid()
+        # LIFO hands out the most recently used connection, whose cache is warmest
+        self._idle = queue.LifoQueue()
+        self._created = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.row_factory = sqlite3.Row
+        # Must precede the switch to WAL, which fixes the mode of an empty database
+        conn.execute(f'PRAGMA auto_vacuum={self.auto_vacuum}')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute(f'PRAGMA cache_size=-{int(self.cache_size_kb)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size_mb) * 1024 * 1024}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        # Off by default in SQLite; without it ON DELETE CASCADE does nothing
+        conn.execute('PRAGMA foreign_keys=ON')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout * 1000)}')
+        self.stats['created'] += 1
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+                if self._created < self.max_connections:
+                    self._created += 1
+                    conn = self._connect()
+            self.stats['acquired'] += 1
+
+        if conn is None:
+            start = time.monotonic()
+            try:
+                conn = self._idle.get(timeout=self.acquire_timeout)
+            except queue.Empty:
+                raise PoolTimeout(
+                    f"No free connection to {self.db_path} within {self.acquire_timeout:.1f}s"
+                )
+            with self._lock:
+                self.stats['waited'] += 1
+                self.stats['total_wait'] += time.monotonic() - start
+        return conn
+
+    def _release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._pid != os.getpid():
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for reads
+
+        Yields:
+            sqlite3.Connection with sqlite3.Row rows
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Borrow a connection inside a write transaction: committed on success,
+        rolled back on error
+
+        Yields:
+            sqlite3.Connection
+        """
+        conn = self._acquire()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._release(conn)
+
+    def get_statistics(self) -> Dict:
+        """
+        Get pool statistics
+
+        Returns:
+            Dictionary with open/idle connections and acquire waits
+        """
+        with self._lock:
+            return {
+                'max_connections': self.max_connections,
+                'open': self._created,
+                'idle': self._idle.qsize(),
+                'acquired': self.stats['acquired'],
+                'waited': self.stats['waited'],
+                'avg_wait': self.stats['total_wait'] / self.stats['waited'] if self.stats['waited'] else 0.0
+            }
+
+    def close(self):
+        """Close idle connections; connections still borrowed are closed by the GC"""
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._created = 0
+
+
+if __name__ == "__main__":
+    # Test pool: concurrent readers alongside a writer
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    path = os.path.join(tempfile.mkdtemp(), 'pool_test.db')
+    pool = SQLitePool(path, max_connections=4)
+    with pool.transaction() as conn:
+        conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT)')
+
+    def write(i):
+        with pool.transaction() as conn:
+            conn.execute('INSERT INTO items (value) VALUES (?)', (f"item {i}",))
+
+    def read(_):
+        with pool.connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(write, range(200)))
+        counts = list(executor.map(read, range(200)))
+
+    with pool.connection() as conn:
+        mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+    print(f"Journal mode: {mode}, rows: {max(counts)}")
+    print(f"Statistics: {pool.get_statistics()}")
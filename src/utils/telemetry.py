@@ -0,0 +1,582 @@
+"""
+Operational Telemetry
+In-process counters, gauges and fixed-bucket histograms, rendered in Prometheus text format
+
+With several worker processes behind one port, each worker writes its values to a
+per-pid file in a shared directory and a scrape merges them (multiprocess mode).
+"""
+
+import bisect
+import functools
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+# Latency buckets in seconds: 1ms .. 2min, covering FAISS lookups through SD generations
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_str(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """Base for metrics with optional labels; children are created on first use"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values, **kwargs):
+        """
+        Get the child for a label combination
+
+        Args:
+            *values: Label values in labelnames order, or
+            **kwargs: Label values by name
+
+        Returns:
+            Child metric with the same update methods
+        """
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} has labels {self.labelnames}; use .labels()")
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> Iterable[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def _child_values(self, child):
+        return child.value
+
+    def _add_child_values(self, child, values):
+        child.inc(values)
+
+    def _reset_child(self, child):
+        child.value = 0.0
+
+    def snapshot(self) -> Dict:
+        """Definition and current values, JSON-serialisable"""
+        return {
+            'kind': self.kind,
+            'documentation': self.documentation,
+            'labelnames': list(self.labelnames),
+            'samples': [[list(values), self._child_values(child)] for values, child in list(self._children.items())]
+        }
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}"
+        ]
+        for suffix, labels, value in self._samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """Monotonically increasing count (requests, errors, cache hits)"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        # Samples get the _total suffix; accept names declared with or without it
+        if name.endswith("_total"):
+            name = name[:-len("_total")]
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield "_total", _label_str(self.labelnames, values), child.value
+
+
+class _GaugeChild:
+    __slots__ = ('value', 'function', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        self.value = float(value)
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from a callable at scrape time (e.g. a queue length)"""
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is not None:
+            try:
+                return float(self.function())
+            except Exception:
+                return math.nan
+        return self.value
+
+
+class Gauge(_Metric):
+    """Value that goes up and down (queue depth, in-flight requests, loaded components)"""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default().dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self._default().set_function(function)
+
+    def _child_values(self, child):
+        return child.get()
+
+    def _reset_child(self, child):
+        pass
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield "", _label_str(self.labelnames, values), child.get()
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        """Observe the duration of a block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    """Distribution over fixed buckets; percentiles are computed by the scraper"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def _child_values(self, child):
+        with child._lock:
+            return [list(child.counts), child.sum, child.count]
+
+    def _add_child_values(self, child, values):
+        counts, total, count = values
+        with child._lock:
+            child.counts = [a + b for a, b in zip(child.counts, counts)]
+            child.sum += total
+            child.count += count
+
+    def _reset_child(self, child):
+        with child._lock:
+            child.counts = [0] * len(child.counts)
+            child.sum = 0.0
+            child.count = 0
+
+    def snapshot(self) -> Dict:
+        data = super().snapshot()
+        data['buckets'] = list(self.buckets)
+        return data
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts = list(child.counts)
+                total, count = child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                yield "_bucket", _label_str(self.labelnames, values, f'le="{_format_value(bound)}"'), cumulative
+            labels = _label_str(self.labelnames, values)
+            yield "_sum", labels, total
+            yield "_count", labels, count
+
+
+class MetricsRegistry:
+    """Process-wide collection of metrics; get-or-create so modules can declare metrics independently"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self.multiprocess_dir: Optional[Path] = None
+
+    def _get_or_create(self, cls, name: str, documentation: str, labelnames: Sequence[str], **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, documentation, labelnames, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} already registered with a different type or labels")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def register_collector(self, collector: Callable[[], None]):
+        """
+        Register a callable run before each render, to refresh gauges from
+        state owned elsewhere (rate-limiter queues, admission classes, ...)
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def _run_collectors(self):
+        with self._lock:
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+
+    def snapshot(self) -> Dict:
+        """
+        Current values of all metrics (after running the collectors)
+
+        Returns:
+            Dictionary of metric name -> definition and samples, JSON-serialisable
+        """
+        self._run_collectors()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def add_snapshot(self, snapshot: Dict, pid: int = None):
+        """
+        Add another process's snapshot to this registry: counters and histograms are
+        summed, gauges are kept per process under an extra 'pid' label
+
+        Args:
+            snapshot: Output of snapshot()
+            pid: Process the snapshot came from (gauges are skipped without one)
+        """
+        for name, data in snapshot.items():
+            labelnames = tuple(data['labelnames'])
+            if data['kind'] == 'gauge':
+                if pid is None:
+                    continue
+                metric = self.gauge(name, data['documentation'], labelnames + ('pid',))
+                for values, value in data['samples']:
+                    metric.labels(*values, str(pid)).set(value)
+                continue
+            if data['kind'] == 'histogram':
+                metric = self.histogram(name, data['documentation'], labelnames, buckets=data['buckets'])
+            else:
+                metric = self.counter(name, data['documentation'], labelnames)
+            for values, value in data['samples']:
+                metric._add_child_values(metric.labels(*values), value)
+
+    def reset(self):
+        """Zero counters and histograms in place (e.g. in a worker forked from a loaded master)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            for child in list(metric._children.values()):
+                metric._reset_child(child)
+
+    def enable_multiprocess(self, directory: str, flush_seconds: float = 5.0):
+        """
+        Share this process's metrics with the other workers behind the same port.
+        Call once per worker after fork: values inherited from the parent are zeroed
+        (the parent's own are flushed by it), then a daemon thread writes a snapshot
+        every flush_seconds and /metrics renders the merge of all workers.
+
+        Args:
+            directory: Directory shared by all workers (one file per process)
+            flush_seconds: How stale other workers' values may be at scrape time
+        """
+        self.reset()
+        self.multiprocess_dir = Path(directory)
+        self.multiprocess_dir.mkdir(parents=True, exist_ok=True)
+
+        def flush_loop():
+            while True:
+                time.sleep(flush_seconds)
+                try:
+                    write_snapshot(self.multiprocess_dir, self)
+                except Exception as e:
+                    print(f"Metrics snapshot not written: {e}")
+
+        threading.Thread(target=flush_loop, name="metrics-flush", daemon=True).start()
+
+    def _render_metrics(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def render(self) -> str:
+        """
+        Render all metrics in Prometheus text exposition format (version 0.0.4);
+        in multiprocess mode, merged across all workers
+
+        Returns:
+            Exposition text
+        """
+        if self.multiprocess_dir is not None:
+            write_snapshot(self.multiprocess_dir, self)
+            return merge_snapshots(self.multiprocess_dir)._render_metrics()
+
+        self._run_collectors()
+        return self._render_metrics()
+
+
+# Shared registry used by all instrumented modules
+registry = MetricsRegistry()
+
+
+def timed(histogram: Histogram, **labels):
+    """
+    Decorator observing a function's duration in a histogram
+
+    Args:
+        histogram: Histogram to observe into
+        **labels: Label values, resolved once at decoration time
+    """
+    child = histogram.labels(**labels) if labels else histogram._default()
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Counters and histograms of exited processes, folded together by mark_process_dead
+ARCHIVE_FILE = "metrics_archive.json"
+
+
+def _snapshot_path(directory: Path, pid: int) -> Path:
+    return Path(directory) / f"metrics_{pid}.json"
+
+
+def _write_json(path: Path, data: Dict):
+    # Write then rename, so a concurrent scrape never reads a partial file
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path: Path) -> Optional[Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot(directory, source: MetricsRegistry = None):
+    """
+    Write this process's metrics to its file in a multiprocess directory
+
+    Args:
+        directory: Shared metrics directory
+        source: Registry to snapshot (default: the shared registry)
+    """
+    _write_json(_snapshot_path(directory, os.getpid()), (source or registry).snapshot())
+
+
+def mark_process_dead(directory, pid: int):
+    """
+    Fold an exited process's counters and histograms into the archive and drop its
+    gauges, so its counts survive worker restarts without leaving stale gauges.
+    Call from the parent only (e.g. Gunicorn's child_exit hook).
+
+    Args:
+        directory: Shared metrics directory
+        pid: Exited process
+    """
+    path = _snapshot_path(directory, pid)
+    snapshot = _read_json(path)
+    if snapshot is not None:
+        archive = MetricsRegistry()
+        archive.add_snapshot(_read_json(Path(directory) / ARCHIVE_FILE) or {})
+        archive.add_snapshot(snapshot)
+        _write_json(Path(directory) / ARCHIVE_FILE, archive.snapshot())
+    path.unlink(missing_ok=True)
+
+
+def merge_snapshots(directory) -> MetricsRegistry:
+    """
+    Merge every process's snapshot (plus the archive of exited ones) in a directory
+
+    Returns:
+        New registry holding summed counters/histograms and per-pid gauges
+    """
+    merged = MetricsRegistry()
+    merged.add_snapshot(_read_json(Path(directory) / ARCHIVE_FILE) or {})
+    for path in sorted(Path(directory).glob("metrics_*.json")):
+        pid = path.stem[len("metrics_"):]
+        if not pid.isdigit():
+            continue
+        snapshot = _read_json(path)
+        if snapshot is not None:
+            merged.add_snapshot(snapshot, pid=int(pid))
+    return merged
+
+
+def clear_multiprocess_dir(directory):
+    """Remove snapshot files left by a previous run (call before starting workers)"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for path in directory.glob("metrics_*.json"):
+        path.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    # Test registry: counter, callback gauge and histogram, plus hot-path cost
+    requests_total = registry.counter("demo_requests_total", "Demo requests", ["endpoint", "status"])
+    latency = registry.histogram("demo_latency_seconds", "Demo latency", ["endpoint"])
+    queue_depth = registry.gauge("demo_queue_depth", "Demo queue depth")
+
+    pending = [1, 2, 3]
+    queue_depth.set_function(lambda: len(pending))
+
+    for ms in (3, 7, 40, 120, 800):
+        requests_total.labels(endpoint="search", status="200").inc()
+        latency.labels(endpoint="search").observe(ms / 1000)
+
+    print(registry.render())
+
+    child = latency.labels(endpoint="search")
+    n = 200000
+    start = time.perf_counter()
+    for _ in range(n):
+        child.observe(0.012)
+    print(f"observe(): {(time.perf_counter() - start) / n * 1e9:.0f}ns per call")
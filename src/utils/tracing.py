@@ -0,0 +1,251 @@
+"""
+Request Tracing
+Lightweight nested spans on a monotonic clock, exported as Server-Timing, JSON or a trace file
+"""
+
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('current_trace', default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """One timed operation inside a trace"""
+
+    __slots__ = ('name', 'parent', 'start_ns', 'end_ns', 'thread_id', 'attrs')
+
+    def __init__(self, name: str, parent: Optional['Span'], attrs: Dict):
+        self.name = name
+        self.parent = parent
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+        self.thread_id = threading.get_ident()
+        self.attrs = attrs
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.perf_counter_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    """Spans recorded for one request; safe to append to from several threads"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start_ns = time.perf_counter_ns()
+        self.wall_start = time.time()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def totals(self) -> Dict[str, Dict]:
+        """
+        Total duration and call count per span name, in order of first start
+
+        Returns:
+            Dictionary of name -> {'ms': ..., 'count': ...}
+        """
+        totals = {}
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start_ns)
+        for span in spans:
+            entry = totals.setdefault(span.name, {'ms': 0.0, 'count': 0})
+            entry['ms'] += span.duration_ms
+            entry['count'] += 1
+        return totals
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, e.g. 'clip.encode_text;dur=12.3, faiss.search;dur=0.4'"""
+        parts = []
+        for name, entry in self.totals().items():
+            part = f"{name};dur={entry['ms']:.2f}"
+            if entry['count'] > 1:
+                part += f';desc="x{entry["count"]}"'
+            parts.append(part)
+        parts.append(f"total;dur={(time.perf_counter_ns() - self.start_ns) / 1e6:.2f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict:
+        """
+        Trace as JSON-serialisable data
+
+        Returns:
+            Dictionary with the total, per-name totals and the individual spans
+            (offsets relative to the start of the trace)
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start_ns)
+        return {
+            'name': self.name,
+            'total_ms': (time.perf_counter_ns() - self.start_ns) / 1e6,
+            'totals': self.totals(),
+            'spans': [
+                {
+                    'name': span.name,
+                    'parent': span.parent.name if span.parent else None,
+                    'start_ms': (span.start_ns - self.start_ns) / 1e6,
+                    'duration_ms': span.duration_ms,
+                    **({'attrs': span.attrs} if span.attrs else {})
+                }
+                for span in spans
+            ]
+        }
+
+    def to_trace_events(self) -> List[Dict]:
+        """Spans as Chrome trace-event 'complete' events (viewable in Perfetto or chrome://tracing)"""
+        with self._lock:
+            spans = list(self.spans)
+        base_us = self.wall_start * 1e6
+        pid = os.getpid()
+        events = [{
+            'name': self.name, 'ph': 'X', 'pid': pid, 'tid': 0,
+            'ts': base_us, 'dur': (time.perf_counter_ns() - self.start_ns) / 1e3
+        }]
+        for span in spans:
+            events.append({
+                'name': span.name, 'ph': 'X', 'pid': pid, 'tid': span.thread_id,
+                'ts': base_us + (span.start_ns - self.start_ns) / 1e3,
+                'dur': span.duration_ms * 1e3,
+                'args': span.attrs
+            })
+        return events
+
+
+def start_trace(name: str) -> Trace:
+    """
+    Start a trace for the current context; spans opened afterwards are recorded in it
+
+    Args:
+        name: Trace name (e.g. 'POST /api/search/text')
+
+    Returns:
+        The new Trace
+    """
+    trace = Trace(name)
+    _current_trace.set(trace)
+    _current_span.set(None)
+    return trace
+
+
+def end_trace() -> Optional[Trace]:
+    """Detach and return the current trace"""
+    trace = _current_trace.get()
+    _current_trace.set(None)
+    _current_span.set(None)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Time a block as a span of the current trace (a no-op when no trace is active)
+
+    Args:
+        name: Span name, dotted by component (e.g. 'faiss.search')
+        **attrs: Small attributes recorded with the span (batch size, k, ...)
+
+    Yields:
+        The Span, or None when not tracing
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    current = Span(name, _current_span.get(), attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        current.end_ns = time.perf_counter_ns()
+        _current_span.reset(token)
+        trace.add(current)
+
+
+def traced(name: str):
+    """Decorator form of span()"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def run_in_context(func):
+    """
+    Wrap a callable so it runs with the caller's trace, e.g. when submitted to a thread pool
+
+    Args:
+        func: Callable to wrap
+
+    Returns:
+        Callable that runs func inside a copy of the current context
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.run(func, *args, **kwargs)
+    return wrapper
+
+
+class TraceFileExporter:
+    """
+    Appends traces to a Chrome trace-event file. The JSON array is left open so
+    the file can be appended to; trace viewers accept the missing closing bracket.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Output file (e.g. traces/api_trace.json)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, trace: Trace):
+        lines = "".join(json.dumps(event) + ",\n" for event in trace.to_trace_events())
+        with self._lock:
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, 'a') as f:
+                if new_file:
+                    f.write("[\n")
+                f.write(lines)
+
+
+if __name__ == "__main__":
+    # Test tracing: nested spans, per-name totals and Server-Timing output
+    trace = start_trace("demo")
+    with span("retrieval.search", k=5):
+        with span("clip.encode_text", batch=1):
+            time.sleep(0.01)
+        with span("faiss.search", k=5):
+            time.sleep(0.002)
+    for _ in range(3):
+        with span("image.base64"):
+            time.sleep(0.001)
+    end_trace()
+
+    print(f"Server-Timing: {trace.server_timing()}")
+    print(json.dumps(trace.to_dict()['totals'], indent=2))
@@ -0,0 +1,169 @@
+"""
+Write-Behind Queue
+Background thread that applies queued writes in batches, off the request path
+"""
+
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+class WriteBehindQueue:
+    """
+    Buffers items and hands them to a writer callback in batches from one
+    background thread. submit() returns immediately unless the queue is full,
+    which applies backpressure instead of growing without bound.
+    """
+
+    _STOP = object()
+    # Tells the writer to stop waiting for a fuller batch
+    _FLUSH = object()
+
+    def __init__(
+        self,
+        write_batch: Callable[[List], None],
+        max_batch: int = 64,
+        max_delay: float = 0.05,
+        max_pending: int = 1000,
+        name: str = "write-behind"
+    ):
+        """
+        Initialize queue
+
+        Args:
+            write_batch: Called with a list of items; must handle its own errors
+            max_batch: Most items per write_batch call
+            max_delay: Seconds to wait for more items once one is queued
+            max_pending: Queued items before submit() blocks
+            name: Thread name
+        """
+        self.write_batch = write_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._submitted = 0
+        self._completed = 0
+        self._pid = None
+        self._thread = None
+        self._queue = None
+        self._closed = False
+
+        self.stats = {'batches': 0, 'items': 0, 'max_batch_seen': 0}
+
+    def _ensure_thread(self):
+        """Start the writer lazily, and again in a forked child (threads don't survive fork)"""
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._cond:
+            if self._pid != os.getpid() or self._thread is None:
+                self._pid = os.getpid()
+                self._queue = queue.Queue(maxsize=self.max_pending)
+                self._submitted = self._completed = 0
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item):
+        """
+        Queue an item for writing
+
+        Args:
+            item: Passed to write_batch as part of a batch
+
+        Raises:
+            RuntimeError: If the queue has been closed
+        """
+        if self._closed:
+            raise RuntimeError(f"{self.name} queue is closed")
+        self._ensure_thread()
+        with self._cond:
+            self._submitted += 1
+        self._queue.put(item)
+
+    def pending(self) -> int:
+        with self._cond:
+            return self._submitted - self._completed
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is self._STOP:
+                return
+            if first is self._FLUSH:
+                continue
+
+            batch = [first]
+            stop = False
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                    break
+                if item is self._FLUSH:
+                    break
+                batch.append(item)
+
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                print(f"{self.name}: batch of {len(batch)} failed: {e}")
+
+            with self._cond:
+                self._completed += len(batch)
+                self.stats['batches'] += 1
+                self.stats['items'] += len(batch)
+                self.stats['max_batch_seen'] = max(self.stats['max_batch_seen'], len(batch))
+                self._cond.notify_all()
+
+            if stop:
+                return
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every item submitted before this call is written
+
+        Args:
+            timeout: Seconds to wait (None = no limit)
+
+        Returns:
+            True if they were written in time
+        """
+        if self._thread is None or self._pid != os.getpid():
+            return True
+        with self._cond:
+            target = self._submitted
+            if self._completed >= target:
+                return True
+        try:
+            self._queue.put_nowait(self._FLUSH)
+        except queue.Full:
+            pass
+        with self._cond:
+            return self._cond.wait_for(lambda: self._completed >= target, timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        """Write everything still queued, then stop the thread"""
+        self._closed = True
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def get_statistics(self) -> Dict:
+        with self._cond:
+            return {
+                'pending': self._submitted - self._completed,
+                'batches': self.stats['batches'],
+                'items': self.stats['items'],
+                'avg_batch': self.stats['items'] / self.stats['batches'] if self.stats['batches'] else 0.0,
+                'max_batch': self.stats['max_batch_seen']
+            }